@@ -0,0 +1,78 @@
+import sys
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from genes.functions import match_gene_data
+
+
+def make_inputs(directory, n_publications, n_symbols=5000, seed=0):
+    """
+    Write synthetic extracted_genes, results_4 and HGNC files of a given size.
+
+    Returns:
+    - (extracted_genes_file, merged_results_file, hgnc_file)
+    """
+    rng = np.random.default_rng(seed)
+    symbols = np.array([f"G{i}X" for i in range(n_symbols)])
+    noise = np.array([f"N{i}" for i in range(n_symbols)])
+
+    def gene_lists(n, pool, k):
+        return [', '.join(pool[rng.integers(0, len(pool), rng.integers(1, k))]) for _ in range(n)]
+
+    pmids = np.arange(n_publications) + 10000000
+    n_chapters = max(1, n_publications // 10)
+    genereviews = pd.DataFrame({
+        'title': [f"Chapter {i}" for i in range(n_chapters)],
+        'pmid': rng.choice(pmids, n_chapters, replace=False),
+        'genes': gene_lists(n_chapters, symbols, 12),
+    })
+    found = gene_lists(n_publications, np.concatenate([symbols, noise]), 8)
+    publications = pd.DataFrame({
+        'pdf': [f"{p}.pdf" for p in pmids],
+        'title': [f"Publication {p}" for p in pmids],
+        'pmid': pmids,
+        'Number_of_Faces': rng.integers(0, 5, n_publications),
+        'genes_found': [g if i % 20 else np.nan for i, g in enumerate(found)],
+    })
+    hgnc = pd.DataFrame({'hgnc_id': [f"HGNC:{i}" for i in range(n_symbols)], 'symbol': symbols})
+
+    files = (os.path.join(directory, 'extracted_genes.csv'),
+             os.path.join(directory, 'results_4.csv'),
+             os.path.join(directory, 'hgnc_complete_set.txt'))
+    genereviews.to_csv(files[0], index=False)
+    publications.to_csv(files[1], index=False)
+    hgnc.to_csv(files[2], sep='\t', index=False)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the match_gene_data engines on synthetic data.")
+    parser.add_argument('--publications', type=int, nargs='+', default=[10000, 100000],
+                        help="Sizes of the publication table to time.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.publications:
+            files = make_inputs(directory, n)
+            timings = {}
+            outputs = {}
+            for engine in ('iterrows', 'vectorized'):
+                outputs[engine] = os.path.join(directory, f"results_7_{engine}.csv")
+                start = time.perf_counter()
+                match_gene_data(*files, outputs[engine], engine=engine)
+                timings[engine] = time.perf_counter() - start
+            with open(outputs['iterrows'], 'rb') as a, open(outputs['vectorized'], 'rb') as b:
+                identical = a.read() == b.read()
+            print(f"{n} publications: iterrows {timings['iterrows']:.2f}s, "
+                  f"vectorized {timings['vectorized']:.2f}s "
+                  f"({timings['iterrows'] / timings['vectorized']:.1f}x), identical output: {identical}")
+
+
+if __name__ == "__main__":
+    main()
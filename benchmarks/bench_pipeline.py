@@ -0,0 +1,231 @@
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(1, os.path.abspath(os.path.dirname(__file__)))
+
+import main as pipeline_main
+from corpus import make_corpus
+from stub_detector import register_stub_detectors
+from pipeline import metrics
+from pipeline.runner import FileHasher
+from pipeline.storage import read_table, FORMAT_EXTENSIONS
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Slowdowns smaller than this are scheduling noise on stages that take milliseconds
+DEFAULT_MIN_SECONDS = 0.25
+# Written into corpus directories so --corpus only ever wipes a directory this script created
+CORPUS_MARKER = '.bench_corpus'
+
+
+def _measure_stage(run, config, trace_memory, verbose):
+    # Runs in a fresh process per stage, so the peak RSS is the stage's own
+    with metrics.collect() as stage_metrics:
+        output = sys.stdout if verbose else io.StringIO()
+        start = time.perf_counter()
+        with redirect_stdout(output), metrics.profiled(None, trace_memory):
+            run(config)
+        seconds = time.perf_counter() - start
+    return seconds, stage_metrics.snapshot(), metrics.peak_rss_bytes()
+
+
+def _output_rows(path):
+    if os.path.isfile(path) and os.path.splitext(path)[1].lower() in FORMAT_EXTENSIONS:
+        return len(read_table(path))
+    return 0
+
+
+def run_benchmark(directory, pipeline_args, trace_memory=False, verbose=False):
+    """
+    Run every pipeline stage on the corpus in directory, each in its own process.
+
+    Returns:
+    - results: dict of stage name to its seconds, peak RSS, throughput,
+      counters and output fingerprints.
+    """
+    stages = pipeline_main.build_stages(pipeline_main.parse_args(pipeline_args))
+    hasher = FileHasher()
+    results = {}
+    # Forked so the stage processes keep the stub detectors registered in this one
+    context = multiprocessing.get_context('fork')
+    for stage in stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            seconds, snapshot, peak_rss = executor.submit(_measure_stage, stage.run, stage.config,
+                                                          trace_memory, verbose).result()
+        stage_metrics = metrics.Metrics()
+        stage_metrics.merge(snapshot)
+        counters = dict(stage_metrics.counters)
+        rows = sum(_output_rows(path) for path in stage.outputs)
+        throughput = {'rows_per_second': rows / seconds}
+        for counter, name in (('pdfs', 'pdfs_per_second'), ('images', 'images_per_second'),
+                              ('genereviews.chapters', 'chapters_per_second')):
+            if counters.get(counter):
+                throughput[name] = counters[counter] / seconds
+        results[stage.name] = {
+            'seconds': seconds,
+            'peak_rss_bytes': peak_rss,
+            'output_rows': rows,
+            'throughput': throughput,
+            'timers': stage_metrics.summary()['timers'],
+            'counters': counters,
+            'gauges': stage_metrics.gauges,
+            'outputs': {path: hasher.fingerprint(path) for path in stage.outputs},
+        }
+        print(f"  {stage.name:<15} {seconds:8.2f}s  {peak_rss / 2 ** 20:7.0f} MB  " +
+              ', '.join(f"{value:,.1f} {name.replace('_per_second', '')}/s" for name, value in throughput.items()))
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance, min_seconds=DEFAULT_MIN_SECONDS):
+    """
+    Print every stage's time against the baseline and flag the stages that
+    got slower by more than tolerance and by more than min_seconds, or whose
+    outputs changed. The absolute floor keeps scheduling noise on stages of
+    a few milliseconds from counting as a regression.
+
+    Returns:
+    - regressions: list of stage names that got slower.
+    """
+    regressions = []
+    print(f"  {'stage':<15} {'seconds':>9} {'baseline':>9} {'change':>8}")
+    for name, result in results.items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print(f"  {name:<15} {result['seconds']:8.2f}s {'-':>9} {'new':>8}")
+            continue
+        change = result['seconds'] / base['seconds'] - 1 if base['seconds'] else 0.0
+        difference = result['seconds'] - base['seconds']
+        verdict = ''
+        if change > tolerance and difference > min_seconds:
+            verdict = 'SLOWER'
+            regressions.append(name)
+        elif change < -tolerance and -difference > min_seconds:
+            verdict = 'faster'
+        if result['outputs'] != base['outputs']:
+            verdict += ' (output changed)'
+        print(f"  {name:<15} {result['seconds']:8.2f}s {base['seconds']:8.2f}s {change:+7.0%}  {verdict}")
+    return regressions
+
+
+def check_export_cache(results, options):
+    """
+    With a shared image store and detection cache, every image the export
+    stage detects faces on was cached by the face detection stage, so the
+    export must not run the model at all.
+
+    Returns:
+    - ok: bool, False if the export stage ran the model; True if it did not
+      or the run had no store and cache to check.
+    """
+    # Other methods and decoders cache under other models or pixels than the YOLO export looks up
+    if not (options.image_store and options.cache) or options.method != 'yolo' or options.decode != 'bytes':
+        return True
+    export = results.get('export')
+    if export is None:
+        return True
+    inferences = export['timers'].get('detect', {}).get('count', 0)
+    cached = export['counters'].get('detect.cached', 0)
+    print(f"Export over the image store and cache: {cached} cached detections, {inferences} model runs.")
+    return inferences == 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark every pipeline stage on a synthetic corpus with a stub face detector.")
+    parser.add_argument('--pdfs', type=int, default=20, help="Number of synthetic PDFs (default: 20).")
+    parser.add_argument('--images-per-pdf', type=int, default=6, help="Figures per PDF, besides the logo (default: 6).")
+    parser.add_argument('--image-size', type=int, nargs=2, default=[400, 300], metavar=('WIDTH', 'HEIGHT'),
+                        help="Size of the figures in pixels (default: 400 300).")
+    parser.add_argument('--chapters', type=int, default=100, help="Number of GeneReviews chapters (default: 100).")
+    parser.add_argument('--symbols', type=int, default=2000, help="Number of HGNC symbols (default: 2000).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic corpus.")
+    parser.add_argument('--detector-delay', type=float, default=0.0,
+                        help="Seconds the stub detector sleeps per image, to mimic inference cost.")
+    parser.add_argument('--corpus', default=None,
+                        help="Directory to build and keep the corpus and outputs in (default: a temporary one).")
+    parser.add_argument('--trace-memory', action='store_true', help="Also report the peak traced Python memory.")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the stages.")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline results to compare with.")
+    parser.add_argument('--save-baseline', action='store_true', help="Save these results as the baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression (default: 0.2).")
+    parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS,
+                        help=f"Smallest slowdown in seconds that counts as a regression (default: {DEFAULT_MIN_SECONDS}).")
+    parser.add_argument('--report', default=None, help="Write the results as JSON.")
+    parser.add_argument('pipeline_args', nargs=argparse.REMAINDER,
+                        help="Options passed on to main.py after '--', e.g. -- --workers 4 --in-memory --batch-size 8.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pipeline_args = [arg for arg in args.pipeline_args if arg != '--']
+    if not args.verbose:
+        metrics.set_quiet()
+    register_stub_detectors(args.detector_delay)
+    corpus = {'pdfs': args.pdfs, 'images_per_pdf': args.images_per_pdf, 'image_size': args.image_size,
+              'chapters': args.chapters, 'symbols': args.symbols, 'seed': args.seed,
+              'detector_delay': args.detector_delay, 'pipeline_args': pipeline_args}
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        directory = os.path.abspath(args.corpus or temp_directory)
+        if args.corpus and os.path.exists(directory) and os.listdir(directory):
+            # Outputs, manifest and caches of an earlier run would make the stages skip work
+            if not os.path.exists(os.path.join(directory, CORPUS_MARKER)):
+                print(f"Error: {directory} is not empty and was not created by this benchmark.")
+                return 2
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, CORPUS_MARKER), 'w').close()
+        print(f"Building the corpus in {directory}")
+        make_corpus(directory, args.pdfs, args.images_per_pdf, tuple(args.image_size), args.chapters, args.symbols,
+                    args.seed)
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            results = run_benchmark(directory, pipeline_args, args.trace_memory, args.verbose)
+        finally:
+            os.chdir(cwd)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': {'cpus': os.cpu_count()},
+              'corpus': corpus, 'stages': results}
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not check_export_cache(results, pipeline_main.parse_args(pipeline_args)):
+        print("Error: the export stage ran the model on images the face detection stage cached.")
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Error: no baseline at {args.baseline} to compare with; run with --save-baseline to create one.")
+        return 2
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    if baseline['corpus'] != corpus:
+        print("Warning: the baseline was run on a different corpus or configuration.")
+    print("Compared with the baseline:")
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_seconds)
+    if regressions:
+        print(f"Slower than the baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
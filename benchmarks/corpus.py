@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import pandas as pd
+import cv2
+import fitz  # PyMuPDF
+
+
+NOISE_WORDS = ['the', 'of', 'and', 'patients', 'variant', 'syndrome', 'p53', '123', 'DNA', 'RNA', 'ABC', 'MRI']
+
+
+def synthetic_image(rng, width, height):
+    """
+    A noisy image whose quadrants are randomly bright or dark, so the stub
+    detector finds between zero and four faces in it.
+    """
+    levels = rng.choice([60, 200], size=(2, 2))
+    image = np.kron(levels, np.ones((height // 2 + 1, width // 2 + 1)))[:height, :width]
+    noise = rng.integers(-40, 40, size=(height, width, 3))
+    return np.clip(image[:, :, None] + noise, 0, 255).astype(np.uint8)
+
+
+def make_pdfs(directory, n_pdfs, images_per_pdf=6, image_size=(400, 300), first_index=1000, seed=0):
+    """
+    Write PDFs with embedded JPEG and PNG figures, two figures per page.
+
+    Every PDF also carries the same small logo, like the publisher logos of
+    real articles.
+
+    Returns:
+    - indexes: list of str, the PDF names without extension.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    logo = cv2.imencode('.png', synthetic_image(rng, 64, 64))[1].tobytes()
+    width, height = image_size
+    indexes = []
+    for n in range(n_pdfs):
+        index = str(first_index + n)
+        document = fitz.open()
+        page = document.new_page()
+        page.insert_image(fitz.Rect(20, 20, 84, 84), stream=logo)
+        for i in range(images_per_pdf):
+            if i and i % 2 == 0:
+                page = document.new_page()
+            ext = '.jpg' if i % 2 == 0 else '.png'
+            image_bytes = cv2.imencode(ext, synthetic_image(rng, width, height))[1].tobytes()
+            top = 100 + 330 * (i % 2)
+            page.insert_image(fitz.Rect(50, top, 50 + width * 0.8, top + height * 0.8), stream=image_bytes)
+        document.save(os.path.join(directory, f"{index}.pdf"))
+        document.close()
+        indexes.append(index)
+    return indexes
+
+
+def make_symbols(n_symbols, seed=0):
+    """
+    Returns:
+    - (symbols, aliases): approved HGNC-like symbols and one alias per symbol.
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list('ABCDEFGHIKLMNPRSTVWXYZ'))
+    symbols = [f"{''.join(rng.choice(letters, 3))}{i}" for i in range(n_symbols)]
+    aliases = [f"{''.join(rng.choice(letters, 4))}{i}A" for i in range(n_symbols)]
+    return symbols, aliases
+
+
+def make_hgnc(path, symbols, aliases):
+    pd.DataFrame({
+        'hgnc_id': [f"HGNC:{i}" for i in range(len(symbols))],
+        'symbol': symbols,
+        'prev_symbol': '',
+        'alias_symbol': aliases,
+    }).to_csv(path, sep='\t', index=False)
+
+
+def _words(rng, symbols, n):
+    pool = np.array(list(symbols) + NOISE_WORDS * max(1, len(symbols) // 50))
+    return ' '.join(pool[rng.integers(0, len(pool), n)])
+
+
+def make_chapters(directory, n_chapters, cited_pmids, symbols, refs_per_chapter=20, seed=0):
+    """
+    Write GeneReviews-like .nxml chapters: a title, a Diagnosis/Testing
+    section naming genes, and a reference list of PubMed IDs.
+
+    Every PubMed ID in cited_pmids is cited by one chapter; the other
+    references are random IDs outside the corpus, as most GeneReviews
+    references are.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    citing = rng.integers(0, n_chapters, len(cited_pmids))
+    for n in range(n_chapters):
+        pmids = [pmid for pmid, chapter in zip(cited_pmids, citing) if chapter == n]
+        pmids += [str(p) for p in rng.integers(40000000, 50000000, refs_per_chapter)]
+        refs = ''.join(f'<ref><element-citation><pub-id pub-id-type="pmid">{pmid}</pub-id></element-citation></ref>'
+                       for pmid in pmids)
+        chapter = (
+            f'<?xml version="1.0"?>\n<book-part><book-part-meta><title-group>'
+            f'<title>Synthetic Syndrome {n}</title></title-group></book-part-meta><body>'
+            f'<sec><title>Summary</title><p>{_words(rng, symbols, 80)}</p></sec>'
+            f'<sec id="diag"><title>Diagnosis/Testing</title><p>{_words(rng, symbols, 60)}</p>'
+            f'<sec><title>Sub</title><p>{_words(rng, symbols, 40)}</p></sec></sec>'
+            f'<sec><title>Management</title><p>{_words(rng, symbols, 80)}</p></sec>'
+            f'</body><back><ref-list>{refs}</ref-list></back></book-part>\n')
+        with open(os.path.join(directory, f"chapter_{n:06d}.nxml"), 'w') as f:
+            f.write(chapter)
+
+
+def make_retrieved(path, indexes, pmids, symbols, seed=0):
+    """
+    Write the PubMed metadata table of the PDFs (retrieved_df2.tsv).
+    """
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        'index': indexes,
+        'pmid': pmids[:len(indexes)],
+        'title': [_words(rng, symbols, 12) for _ in indexes],
+        'abstract': [_words(rng, symbols, 200) for _ in indexes],
+        'pub_date': '2020',
+        'pdf': [f"{index}.pdf" for index in indexes],
+    }).to_csv(path, sep='\t', index=False)
+
+
+def make_corpus(directory, n_pdfs=20, images_per_pdf=6, image_size=(400, 300), n_chapters=100, n_symbols=2000, seed=0):
+    """
+    Write every input of the pipeline under a directory, with the default
+    names main.py expects: pdfs/, gene_NBK1116/gene_NBK1116, retrieved_df2.tsv
+    and hgnc_complete_set.txt.
+
+    Half of the publications are cited by the chapters, so the matching stage
+    has both matches and misses.
+    """
+    rng = np.random.default_rng(seed)
+    indexes = make_pdfs(os.path.join(directory, 'pdfs'), n_pdfs, images_per_pdf, image_size, seed=seed)
+    symbols, aliases = make_symbols(n_symbols, seed)
+    pmids = [str(p) for p in rng.choice(np.arange(10000000, 40000000), 2 * n_pdfs, replace=False)]
+    make_chapters(os.path.join(directory, 'gene_NBK1116', 'gene_NBK1116'), n_chapters, pmids[::2], symbols, seed=seed)
+    make_retrieved(os.path.join(directory, 'retrieved_df2.tsv'), indexes, pmids, symbols + aliases[:50], seed)
+    make_hgnc(os.path.join(directory, 'hgnc_complete_set.txt'), symbols, aliases)
@@ -0,0 +1,109 @@
+import time
+import numpy as np
+import cv2
+
+from pdf_extraction import detectors
+
+
+def stub_faces(image, threshold=0.5):
+    """
+    Deterministic stand-in for face detection: a face in every bright quadrant.
+
+    Parameters:
+    - image: numpy.ndarray, the image, either uint8 or scaled to [0, 1].
+    - threshold: float, mean brightness (as a fraction) a quadrant needs.
+
+    Returns:
+    - faces: list of (cx, cy, w, h, confidence) relative to the image size.
+    """
+    height, width = image.shape[:2]
+    scale = 255.0 if image.dtype == np.uint8 else 1.0
+    faces = []
+    for row in range(2):
+        for column in range(2):
+            quadrant = image[row * height // 2:(row + 1) * height // 2, column * width // 2:(column + 1) * width // 2]
+            if quadrant.size and quadrant.mean() / scale > threshold:
+                faces.append((0.25 + 0.5 * column, 0.25 + 0.5 * row, 0.3, 0.3, 0.9))
+    return faces
+
+
+class StubNet:
+    """
+    Stands in for the cv2.dnn network detect_boxes_yolo_batch runs.
+
+    Every image of the blob gets one YOLO output row per quadrant:
+    (cx, cy, w, h, objectness, face score, back score).
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.blob = None
+
+    def setInput(self, blob):
+        self.blob = blob
+
+    def getUnconnectedOutLayersNames(self):
+        return ['yolo_stub']
+
+    def forward(self, names):
+        time.sleep(self.delay * len(self.blob))
+        output = np.zeros((len(self.blob), 4, 7), dtype=np.float32)
+        for n, image in enumerate(self.blob):
+            # The blob is (channels, height, width); stub_faces expects (height, width, channels)
+            for i, (cx, cy, w, h, confidence) in enumerate(stub_faces(image.transpose(1, 2, 0))):
+                output[n, i] = (cx, cy, w, h, confidence, confidence, 0.0)
+        return [output]
+
+
+class StubYolo:
+    """
+    Deterministic replacement for yoloface's face_analysis, with the same
+    face_detection signature and [x, y, h, w] box order.
+
+    Parameters:
+    - delay: float, seconds slept per image to mimic the cost of inference.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.full_net = StubNet(delay)
+        self.tiny_net = self.full_net
+
+    def face_detection(self, image_path=None, model='full', frame_status=False, frame_arr=None):
+        image = frame_arr if frame_status else cv2.imread(image_path)
+        time.sleep(self.delay)
+        height, width = image.shape[:2]
+        boxes, confidences = [], []
+        for cx, cy, w, h, confidence in stub_faces(image):
+            w, h = int(w * width), int(h * height)
+            boxes.append([int(cx * width - w / 2), int(cy * height - h / 2), h, w])
+            confidences.append(confidence)
+        return image, boxes, confidences
+
+
+class StubMTCNN:
+    """
+    Deterministic replacement for mtcnn.MTCNN.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def detect_faces(self, image):
+        time.sleep(self.delay)
+        height, width = image.shape[:2]
+        faces = []
+        for cx, cy, w, h, confidence in stub_faces(image):
+            w, h = int(w * width), int(h * height)
+            faces.append({'box': [int(cx * width - w / 2), int(cy * height - h / 2), w, h], 'confidence': confidence})
+        return faces
+
+
+def register_stub_detectors(delay=0.0):
+    """
+    Replace the 'yolo' and 'mctnn' detectors of this process with the stubs.
+
+    Pool workers started by fork inherit the registration.
+    """
+    detectors.register_detector('yolo', lambda: StubYolo(delay))
+    detectors.register_detector('mctnn', lambda: StubMTCNN(delay))
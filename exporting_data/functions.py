@@ -1,21 +1,31 @@
 import pandas as pd
 import fitz  # PyMuPDF
 import os
+import cv2
+import numpy as np
+from pipeline import metrics
+from pipeline.archives import iter_archived_files
+from pipeline.storage import read_table
+from pdf_extraction.cache import open_cache
+from pdf_extraction.functions import iter_images_from_pdf, decode_image, detect_boxes, save_face_crops, VALID_IMAGE_EXTENSIONS
+from pdf_extraction.image_store import open_image_store, DEFAULT_IMAGE_STORE
 
-def extract_images_from_pmid_list(csv_file, pdf_folder, image_output_folder):
+def extract_images_from_pmid_list(csv_file, pdf_folder, image_output_folder, archive_directory=None):
     """
     This function reads pmid values from a CSV file and extracts images from
     the corresponding PDF files. The extracted images are saved to a specified
     output folder.
 
     Parameters:
-    - csv_file: str, path to the CSV file containing pmid values.
+    - csv_file: str, path to the CSV (or Parquet/Feather) file containing pmid values.
     - pdf_folder: str, path to the folder containing the PDF files.
     - image_output_folder: str, path to the folder where extracted images will be saved.
+    - archive_directory: str, directory of zip and tar archives to read the
+      PDFs from instead of pdf_folder; only the listed PDFs are read.
     """
 
-    # Read the CSV file into a dataframe
-    df = pd.read_csv(csv_file)
+    # Read only the 'index' column of the file into a dataframe
+    df = read_table(csv_file, columns=['index'], schema='matched')
 
     # Ensure 'pmid' column exists in the dataframe
     if 'index' not in df.columns:
@@ -24,6 +34,14 @@ def extract_images_from_pmid_list(csv_file, pdf_folder, image_output_folder):
     # Create the output folder if it doesn't exist
     os.makedirs(image_output_folder, exist_ok=True)
 
+    if archive_directory is not None:
+        indexes = {f"{index}.pdf": index for index in df['index']}
+        for pdf_file, data in iter_archived_pdfs(archive_directory, indexes):
+            extract_images_from_pdf(pdf_file, image_output_folder, indexes.pop(pdf_file), stream=data)
+        for index in indexes.values():
+            print(f"PDF file for index {index} does not exist in the specified archives.")
+        return
+
     # Iterate through each pmid in the dataframe
     for index in df['index']:
         pdf_path = os.path.join(pdf_folder, f"{index}.pdf")
@@ -32,7 +50,16 @@ def extract_images_from_pmid_list(csv_file, pdf_folder, image_output_folder):
         else:
             print(f"PDF file for index {index} does not exist in the specified folder.")
 
-def extract_images_from_pdf(pdf_path, image_output_folder, index):
+def iter_archived_pdfs(archive_directory, pdf_files):
+    """
+    Yield (pdf_file, bytes) for the PDFs of the archives in a directory whose
+    names are in pdf_files; the other members are skipped without being read.
+    """
+    want = lambda name, _: name in pdf_files
+    for pdf_file, data, _ in iter_archived_files(archive_directory, ('.pdf',), want):
+        yield pdf_file, data
+
+def extract_images_from_pdf(pdf_path, image_output_folder, index, stream=None):
     """
     Extract images from a PDF file and save them to a specified output folder.
 
@@ -40,23 +67,26 @@ def extract_images_from_pdf(pdf_path, image_output_folder, index):
     - pdf_path: str, path to the PDF file.
     - image_output_folder: str, path to the folder where extracted images will be saved.
     - pmid: str, PubMed ID to be used as a prefix for the image filenames.
+    - stream: bytes of the PDF read from an archive, used instead of pdf_path.
     """
-    doc = fitz.open(pdf_path)
+    with metrics.timer('pdf.open'):
+        doc = fitz.open(stream=stream, filetype='pdf') if stream is not None else fitz.open(pdf_path)
     for i in range(len(doc)):
         for img in doc.get_page_images(i):
             xref = img[0]
-            base_image = doc.extract_image(xref)
+            with metrics.timer('image.extract'):
+                base_image = doc.extract_image(xref)
             image_bytes = base_image["image"]
             image_ext = base_image["ext"]
             image_filename = os.path.join(image_output_folder, f"{index}_page{i+1}_img{xref}.{image_ext}")
-            with open(image_filename, "wb") as img_file:
-                img_file.write(image_bytes)
+            with metrics.timer('image.write'):
+                with open(image_filename, "wb") as img_file:
+                    img_file.write(image_bytes)
+            metrics.count('images')
 
 import os
 import cv2
-from yoloface import face_analysis
-
-face_yolo = face_analysis()
+from pdf_extraction.detectors import get_detector
 
 
 def detect_faces_yolo_in_directory(image_dir, save_dir):
@@ -76,9 +106,9 @@ def detect_faces_yolo_in_directory(image_dir, save_dir):
 
         # Check if the file is an image (you can add more extensions if needed)
         if os.path.isfile(image_path) and filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            print(f"Processing {image_path}")
+            metrics.log(f"Processing {image_path}")
             face_count = detect_faces_yolo(image_path, save_dir)
-            print(f"Number of faces detected in {filename}: {face_count}")
+            metrics.log(f"Number of faces detected in {filename}: {face_count}")
 
 def detect_faces_yolo(image_path, save_dir):
     """
@@ -98,9 +128,12 @@ def detect_faces_yolo(image_path, save_dir):
 
     # Perform face detection
     try:
-        img, box, conf = face_yolo.face_detection(image_path=image_path, model='full')
+        face_yolo = get_detector('yolo')
+        with metrics.timer('detect'):
+            img, box, conf = face_yolo.face_detection(image_path=image_path, model='full')
     except Exception as e:
         print(f"Error during face detection: {e}")
+        metrics.count('errors.detect')
         return 0
     
     face_count = 0
@@ -126,11 +159,123 @@ def detect_faces_yolo(image_path, save_dir):
             if face_img.size > 0:
                 # Save the face image to the save directory
                 face_filename = os.path.join(save_dir, f"{os.path.splitext(os.path.basename(image_path))[0]}_face_{i+1}.jpg")
-                cv2.imwrite(face_filename, face_img)
+                with metrics.timer('crop.write'):
+                    cv2.imwrite(face_filename, face_img)
                 face_count += 1
             else:
-                print(f"Skipped empty face image from {image_path} at coordinates {x, y, w, h}")
+                metrics.log(f"Skipped empty face image from {image_path} at coordinates {x, y, w, h}")
     else:
-        print(f"No faces detected in {image_path}")
+        metrics.log(f"No faces detected in {image_path}")
     
-    return face_count
\ No newline at end of file
+    metrics.count('faces', face_count)
+    return face_count
+
+
+def export_faces_from_store(csv_file, pdf_folder, image_output_folder, save_dir, store_path=DEFAULT_IMAGE_STORE, cache_path=None, expand_ratio=0.4, archive_directory=None):
+    """
+    Export the images and faces of the listed PDFs using the shared image store.
+
+    Does the same as extract_images_from_pmid_list followed by
+    detect_faces_yolo_in_directory, but the images of a PDF already extracted
+    by the face detection step are read from the store instead of the PDF,
+    and with a detection cache the boxes found before are cropped again
+    without running the model. Faces are detected on the pixels the face
+    detection step saw (JPEGs after the same re-encode, see decode_image), so
+    every image it cached is a hit, and cropped from the images as saved.
+    Only PDFs missing from the store are opened, and their images are added to it.
+
+    Parameters:
+    - csv_file: str, path to the CSV (or Parquet/Feather) file containing the 'index' column.
+    - pdf_folder: str, path to the folder containing the PDF files.
+    - image_output_folder: str, path to the folder where extracted images will be saved.
+    - save_dir: str, path to the folder where the face crops will be saved.
+    - store_path: str, directory of the image store.
+    - cache_path: str, detection cache database, or None to always run the detector.
+    - expand_ratio: float, how much to expand each face box on every side.
+    - archive_directory: str, directory of zip and tar archives the PDFs were
+      read from instead of pdf_folder. PDFs in the store are then taken as
+      they are, and the missing ones are read from the archives.
+
+    Returns:
+    - counts: dict with the number of 'pdfs', 'extracted' PDFs, 'images' and 'faces'.
+    """
+    df = read_table(csv_file, columns=['index'], schema='matched')
+    if 'index' not in df.columns:
+        raise ValueError("CSV file must contain 'index' column")
+
+    os.makedirs(image_output_folder, exist_ok=True)
+    os.makedirs(save_dir, exist_ok=True)
+    store = open_image_store(store_path)
+    cache = open_cache(cache_path) if cache_path else None
+    counts = {'pdfs': 0, 'extracted': 0, 'images': 0, 'faces': 0}
+
+    if archive_directory is not None:
+        missing = {}
+        for index in df['index']:
+            images = store.images(f"{index}.pdf")
+            if images is None:
+                missing[f"{index}.pdf"] = index
+            else:
+                _export_images(index, images, store, image_output_folder, save_dir, cache, expand_ratio, counts)
+        for pdf_file, data in iter_archived_pdfs(archive_directory, missing):
+            for _ in iter_images_from_pdf(pdf_file, image_store=store, stream=data):
+                pass
+            counts['extracted'] += 1
+            _export_images(missing.pop(pdf_file), store.images(pdf_file), store, image_output_folder, save_dir,
+                           cache, expand_ratio, counts)
+        for index in missing.values():
+            print(f"PDF file for index {index} does not exist in the specified archives.")
+        if cache is not None:
+            cache.save_counters()
+        return counts
+
+    for index in df['index']:
+        pdf_file = f"{index}.pdf"
+        pdf_path = os.path.join(pdf_folder, pdf_file)
+        if not os.path.exists(pdf_path):
+            print(f"PDF file for index {index} does not exist in the specified folder.")
+            continue
+
+        images = store.images(pdf_file, pdf_path)
+        if images is None:
+            # Not extracted yet, or the PDF changed since: extract it into the store
+            for _ in iter_images_from_pdf(pdf_path, image_store=store):
+                pass
+            images = store.images(pdf_file)
+            counts['extracted'] += 1
+        _export_images(index, images, store, image_output_folder, save_dir, cache, expand_ratio, counts)
+
+    if cache is not None:
+        cache.save_counters()
+    return counts
+
+def _export_images(index, images, store, image_output_folder, save_dir, cache, expand_ratio, counts):
+    counts['pdfs'] += 1
+    for page, xref, image_ext, content_hash in images:
+        image_bytes = store.read(content_hash, image_ext)
+        image_filename = f"{index}_page{page}_img{xref}.{image_ext}"
+        with metrics.timer('image.write'):
+            with open(os.path.join(image_output_folder, image_filename), "wb") as img_file:
+                img_file.write(image_bytes)
+        counts['images'] += 1
+
+        if f".{image_ext.lower()}" not in VALID_IMAGE_EXTENSIONS:
+            continue
+        # Decoded like cv2.imread decodes the saved file, for the crops
+        with metrics.timer('image.decode'):
+            image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+            # Detected on the pixels the face detection step saw, JPEGs after their re-encode,
+            # so the boxes it cached are found under the same image hash
+            detect_image = decode_image(image_bytes, image_ext)
+        if image is None or detect_image is None:
+            print(f"Error: Unable to load image {image_filename}")
+            continue
+        try:
+            boxes, _ = detect_boxes(detect_image, 'yolo', cache)
+        except Exception as e:
+            print(f"Error during face detection: {e}")
+            metrics.count('errors.detect')
+            continue
+        face_count = save_face_crops(image, boxes, image_filename, save_dir, method='yolo', expand_ratio=expand_ratio)
+        metrics.log(f"Number of faces detected in {image_filename}: {face_count}")
+        counts['faces'] += face_count
@@ -1,5 +1,6 @@
 import os
 import sys
+import argparse
 
 # Add the parent directory to the system path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -8,12 +9,38 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from functions import extract_images_from_pmid_list
 from functions import extract_images_from_pdf
 from functions import detect_faces_yolo_in_directory
+from functions import export_faces_from_store
+from pipeline.storage import with_format
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the images and faces of the filtered publications.")
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help="Format of filtered_results_7 (default: csv).")
+    parser.add_argument('--image-store', default=None, metavar='PATH',
+                        help="Read the images from the store filled by pdf_extraction instead of the PDFs.")
+    parser.add_argument('--cache', default=None, metavar='PATH',
+                        help="Detection cache; with --image-store, faces detected before are cropped without running the model.")
+    parser.add_argument('--archives', default=None, metavar='DIRECTORY',
+                        help="Read the PDFs straight out of the zip and tar archives in this directory instead of pdfs/.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.image_store:
+        try:
+            counts = export_faces_from_store(with_format('filtered_results_7.csv', args.format), 'pdfs', 'images_2',
+                                             'faces_2', args.image_store, cache_path=args.cache,
+                                             archive_directory=args.archives)
+            print(f"Images and faces exported from the image store: {counts}")
+        except Exception as e:
+            print(f"Error exporting from the image store: {e}")
+        return
 
     try:
         # Attempt to extract images from the specified PMID list
-        extract_images_from_pmid_list('filtered_results_7.csv', 'pdfs', 'images_2')
+        extract_images_from_pmid_list(with_format('filtered_results_7.csv', args.format), 'pdfs', 'images_2',
+                                      archive_directory=args.archives)
         print("Images extracted successfully.")
     except Exception as e:
         # Print any error that occurs during image extraction
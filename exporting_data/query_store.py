@@ -0,0 +1,514 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pipeline.storage import read_table
+
+
+DEFAULT_QUERY_STORE = 'results.sqlite'
+FACE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+# Lists of pmids are looked up this many at a time, well under SQLite's limit on bound parameters
+_LOOKUP_CHUNK = 500
+
+# Columns of filtered_results_7 a publication is built from; a change to any of them updates it
+RESULT_COLUMNS = ['index', 'pmid', 'pub_title', 'abstract', 'pub_date', 'number_of_faces', 'genes_in_pub',
+                  'genereviews_title', 'genes_in_pub_and_genereviews', 'cross_referenced_genes']
+
+# Stores with another version are derived data in an outdated layout, rebuilt from scratch
+SCHEMA_VERSION = 2
+TABLES = ('publication', 'gene', 'publication_gene', 'publication_genereviews', 'face', 'publication_fts')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS publication (
+        pmid TEXT PRIMARY KEY,
+        pdf TEXT,
+        title TEXT,
+        abstract TEXT,
+        pub_date TEXT,
+        number_of_faces INTEGER,
+        genes_in_pub TEXT,
+        fingerprint TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS publication_pdf ON publication (pdf);
+    CREATE TABLE IF NOT EXISTS gene (
+        gene_id INTEGER PRIMARY KEY,
+        symbol TEXT NOT NULL UNIQUE COLLATE NOCASE
+    );
+    CREATE TABLE IF NOT EXISTS publication_gene (
+        gene_id INTEGER NOT NULL,
+        pmid TEXT NOT NULL,
+        cross_referenced INTEGER NOT NULL,
+        in_genereviews INTEGER NOT NULL,
+        PRIMARY KEY (gene_id, pmid)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS publication_gene_pmid ON publication_gene (pmid);
+    CREATE TABLE IF NOT EXISTS publication_genereviews (
+        pmid TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        title TEXT,
+        genes_in_pub_and_genereviews TEXT,
+        PRIMARY KEY (pmid, position)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS face (
+        path TEXT PRIMARY KEY,
+        pdf TEXT NOT NULL,
+        duplicate INTEGER,
+        representative TEXT
+    );
+    CREATE INDEX IF NOT EXISTS face_pdf ON face (pdf, path);
+    -- New publications are indexed by update_publications in one statement, several times faster than a
+    -- trigger per row; deleted ones are taken out of the index as they go
+    CREATE VIRTUAL TABLE IF NOT EXISTS publication_fts USING fts5(
+        title, abstract, content='publication', content_rowid='rowid'
+    );
+    CREATE TRIGGER IF NOT EXISTS publication_fts_delete AFTER DELETE ON publication BEGIN
+        INSERT INTO publication_fts (publication_fts, rowid, title, abstract)
+        VALUES ('delete', old.rowid, old.title, old.abstract);
+    END;
+"""
+
+
+def _split(genes):
+    # Comma-separated genes as a list, in the order listed, like genes/functions.py _split_genes
+    if genes is None:
+        return []
+    return [gene.strip() for gene in str(genes).split(',') if gene.strip()]
+
+
+def _union(lists):
+    seen = {}
+    for genes in lists:
+        seen.update(dict.fromkeys(genes))
+    return list(seen)
+
+
+def face_pdf(file_name):
+    """
+    Returns:
+    - pdf: str, the index of the PDF a face crop was cut from, e.g. '1000' for
+      '1000_page1_img5_face_1.jpg' or 'converted_1000_page1_0_face_1.jpg',
+      or None if the name does not follow the pipeline's naming.
+    """
+    if file_name.startswith('converted_'):
+        file_name = file_name[len('converted_'):]
+    position = file_name.find('_page')
+    return file_name[:position] if position > 0 else None
+
+
+def _group_rows(df):
+    """
+    Group the rows of filtered_results_7 by pmid; a publication has one row
+    per GeneReviews chapter it was matched to.
+
+    Yields:
+    - (pmid, rows, fingerprint): rows is the list of the publication's rows
+      as tuples of RESULT_COLUMNS, fingerprint a hash of them.
+    """
+    groups = {}
+    for row in df.itertuples(index=False, name=None):
+        groups.setdefault(row[1], []).append(row)
+    for pmid, rows in groups.items():
+        yield pmid, rows, hashlib.sha1(json.dumps(rows, default=str).encode()).hexdigest()
+
+
+def _publication(rows):
+    """
+    Returns:
+    - publication: dict of the publication's columns, its 'genes' as a dict
+      of symbol to (cross_referenced, in_genereviews) and its 'genereviews'
+      chapters as (title, genes) pairs.
+
+    Only HGNC cross-referenced genes and genes of the matched GeneReviews
+    chapters are genes of the publication. The other words genes_in_pub
+    found (e.g. RNA, ABC, MRI) are kept as 'genes_in_pub' text only, so
+    gene lookups do not return them.
+    """
+    pdf, _, title, abstract, pub_date, number_of_faces = rows[0][:6]
+    genes_in_pub = [_split(row[6]) for row in rows]
+    chapters = [(row[7], row[8]) for row in rows]
+    cross_referenced = [_split(row[9]) for row in rows]
+    in_genereviews = [_split(genes) for _, genes in chapters]
+    symbols = _union(cross_referenced + in_genereviews)
+    cross_referenced = set(_union(cross_referenced))
+    in_genereviews = set(_union(in_genereviews))
+    return {
+        'pdf': pdf,
+        'title': title,
+        'abstract': abstract,
+        'pub_date': pub_date,
+        'number_of_faces': None if number_of_faces is None else int(number_of_faces),
+        'genes_in_pub': ','.join(_union(genes_in_pub)),
+        'genes': {symbol: (int(symbol in cross_referenced), int(symbol in in_genereviews)) for symbol in symbols},
+        'genereviews': [(title, genes) for title, genes in chapters if title is not None or genes is not None],
+    }
+
+
+class QueryStore:
+    """
+    Indexed SQLite copy of the final results for looking publications up by
+    gene, pmid or words of their title and abstract.
+
+    filtered_results_7 repeats a publication once per GeneReviews chapter it
+    matches and keeps its genes in comma-separated strings, so answering
+    "which publications with faces mention gene X" from it means reading and
+    scanning the whole table. The store splits it into a publication table
+    keyed by pmid, a gene table keyed by symbol, the publication_gene pairs
+    (with whether the gene is HGNC cross-referenced and in a GeneReviews
+    chapter of the publication), the publication_genereviews chapters and
+    the face crops of every PDF. B-tree indexes on pmid and symbol and an
+    FTS5 index on title and abstract answer lookups in milliseconds.
+
+    The store is updated in place: a publication is only rewritten when its
+    rows in the results changed, and face crops are added and dropped as
+    they appear in or disappear from their directories.
+
+    Parameters:
+    - path: str, the database file, created if missing.
+    """
+
+    def __init__(self, path=DEFAULT_QUERY_STORE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        # Readers, e.g. the clinician-facing tool, keep querying while an update is written
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self.connection:
+                for table in TABLES:
+                    self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def update_publications(self, results_path, prune=True):
+        """
+        Bring the publications in line with a results table.
+
+        Parameters:
+        - results_path: str, filtered_results_7 in any format read_table reads.
+        - prune: bool, drop the publications missing from the table; False
+          when the table only holds new results, e.g. those of one more batch.
+
+        Returns:
+        - counts: dict with the number of publications 'added', 'updated',
+          'removed' and left 'unchanged'.
+        """
+        df = read_table(results_path, schema='matched')
+        df = df.rename(columns={'Number_of_Faces': 'number_of_faces'})
+        missing = [column for column in RESULT_COLUMNS if column not in df.columns]
+        if missing:
+            raise ValueError(f"{results_path} has no column {', '.join(missing)}")
+        df = df[RESULT_COLUMNS]
+        df = df[df['pmid'].notna()].astype(object)
+        df = df.where(df.notna(), None)
+
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        with self.connection:
+            stored = dict(self.connection.execute("SELECT pmid, fingerprint FROM publication"))
+            gene_ids = dict(self.connection.execute("SELECT symbol, gene_id FROM gene"))
+            seen = set()
+            inserted = []
+            for pmid, rows, fingerprint in _group_rows(df):
+                seen.add(pmid)
+                if stored.get(pmid) == fingerprint:
+                    counts['unchanged'] += 1
+                    continue
+                if pmid in stored:
+                    self._delete_publication(pmid)
+                    counts['updated'] += 1
+                else:
+                    counts['added'] += 1
+                self._insert_publication(pmid, _publication(rows), fingerprint, gene_ids)
+                inserted.append((pmid,))
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS inserted (pmid TEXT PRIMARY KEY)")
+            self.connection.executemany("INSERT INTO temp.inserted VALUES (?)", inserted)
+            self.connection.execute("INSERT INTO publication_fts (rowid, title, abstract) "
+                                    "SELECT rowid, title, abstract FROM publication "
+                                    "WHERE pmid IN (SELECT pmid FROM temp.inserted)")
+            self.connection.execute("DELETE FROM temp.inserted")
+            if prune:
+                for pmid in set(stored) - seen:
+                    self._delete_publication(pmid)
+                    counts['removed'] += 1
+                if counts['updated'] or counts['removed']:
+                    self.connection.execute("DELETE FROM gene WHERE gene_id NOT IN "
+                                            "(SELECT gene_id FROM publication_gene)")
+        return counts
+
+    def _insert_publication(self, pmid, publication, fingerprint, gene_ids):
+        self.connection.execute(
+            "INSERT INTO publication (pmid, pdf, title, abstract, pub_date, number_of_faces, genes_in_pub, fingerprint) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (pmid, publication['pdf'], publication['title'], publication['abstract'], publication['pub_date'],
+             publication['number_of_faces'], publication['genes_in_pub'], fingerprint))
+        rows = []
+        for symbol, (cross_referenced, in_genereviews) in publication['genes'].items():
+            gene_id = gene_ids.get(symbol)
+            if gene_id is None:
+                # The symbol may differ in case only from one already stored
+                self.connection.execute("INSERT OR IGNORE INTO gene (symbol) VALUES (?)", (symbol,))
+                gene_id = self.connection.execute("SELECT gene_id FROM gene WHERE symbol = ?", (symbol,)).fetchone()[0]
+                gene_ids[symbol] = gene_id
+            rows.append((gene_id, pmid, cross_referenced, in_genereviews))
+        self.connection.executemany("INSERT OR REPLACE INTO publication_gene VALUES (?, ?, ?, ?)", rows)
+        self.connection.executemany("INSERT INTO publication_genereviews VALUES (?, ?, ?, ?)",
+                                    [(pmid, position, title, genes)
+                                     for position, (title, genes) in enumerate(publication['genereviews'])])
+
+    def _delete_publication(self, pmid):
+        self.connection.execute("DELETE FROM publication_gene WHERE pmid = ?", (pmid,))
+        self.connection.execute("DELETE FROM publication_genereviews WHERE pmid = ?", (pmid,))
+        self.connection.execute("DELETE FROM publication WHERE pmid = ?", (pmid,))
+
+    def update_faces(self, face_directories, duplicates_path=None):
+        """
+        Bring the face crops in line with the crop directories.
+
+        Parameters:
+        - face_directories: list of str, e.g. ['faces_2']; crops are stored
+          by their path, joined to publications by the PDF index their name starts with.
+        - duplicates_path: str, the face_duplicates table of the face_index
+          stage, or None; its 'duplicate' and 'representative' columns are
+          copied for the crops it lists.
+
+        Returns:
+        - counts: dict with the number of crops 'added', 'updated' and 'removed'.
+        """
+        duplicates = {}
+        if duplicates_path and os.path.exists(duplicates_path):
+            df = read_table(duplicates_path, columns=['source', 'crop_id', 'representative', 'duplicate'])
+            for source, crop_id, representative, duplicate in df.itertuples(index=False):
+                path = os.path.join(os.path.normpath(source), crop_id)
+                duplicates[path] = (int(str(duplicate).lower() in ('true', '1')), representative)
+
+        faces = {}
+        for directory in face_directories:
+            directory = os.path.normpath(directory)
+            if not os.path.isdir(directory):
+                continue
+            for file_name in os.listdir(directory):
+                pdf = face_pdf(file_name)
+                if pdf is None or not file_name.lower().endswith(FACE_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, file_name)
+                faces[path] = (pdf,) + duplicates.get(path, (None, None))
+
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        with self.connection:
+            stored = {path: tuple(row) for path, *row in
+                      self.connection.execute("SELECT path, pdf, duplicate, representative FROM face")}
+            removed = [(path,) for path in set(stored) - set(faces)]
+            changed = [(path,) + row for path, row in faces.items() if stored.get(path) != row]
+            self.connection.executemany("DELETE FROM face WHERE path = ?", removed)
+            self.connection.executemany("INSERT OR REPLACE INTO face VALUES (?, ?, ?, ?)", changed)
+            counts['removed'] = len(removed)
+            counts['updated'] = sum(1 for row in changed if row[0] in stored)
+            counts['added'] = len(changed) - counts['updated']
+        return counts
+
+    def _details(self, publications, unique_faces=False):
+        # Add the GeneReviews chapters and face crops of the publications, a few queries per chunk of pmids
+        by_pmid = {publication['pmid']: publication for publication in publications}
+        by_pdf = {}
+        for publication in publications:
+            publication['genes_in_pub_and_genereviews'] = []
+            publication['genereviews'] = []
+            publication['faces'] = []
+            by_pdf.setdefault(publication['pdf'], []).append(publication)
+        pmids = list(by_pmid)
+        for start in range(0, len(pmids), _LOOKUP_CHUNK):
+            chunk = pmids[start:start + _LOOKUP_CHUNK]
+            marks = ','.join('?' * len(chunk))
+            for pmid, title, genes in self.connection.execute(
+                    f"SELECT pmid, title, genes_in_pub_and_genereviews FROM publication_genereviews "
+                    f"WHERE pmid IN ({marks}) ORDER BY pmid, position", chunk):
+                publication = by_pmid[pmid]
+                publication['genereviews'].append({'title': title, 'genes_in_pub_and_genereviews': _split(genes)})
+                publication['genes_in_pub_and_genereviews'] = _union(
+                    [publication['genes_in_pub_and_genereviews'], _split(genes)])
+        pdfs = [pdf for pdf in by_pdf if pdf is not None]
+        unique = " AND (duplicate IS NULL OR NOT duplicate)" if unique_faces else ""
+        for start in range(0, len(pdfs), _LOOKUP_CHUNK):
+            chunk = pdfs[start:start + _LOOKUP_CHUNK]
+            marks = ','.join('?' * len(chunk))
+            for pdf, path in self.connection.execute(
+                    f"SELECT pdf, path FROM face WHERE pdf IN ({marks}){unique} ORDER BY pdf, path", chunk):
+                for publication in by_pdf[pdf]:
+                    publication['faces'].append(path)
+        return publications
+
+    def _rows(self, cursor):
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def publication(self, pmid, unique_faces=False):
+        """
+        Returns:
+        - publication: dict with the publication's columns, abstract included,
+          its 'genes' (HGNC cross-referenced or in a matched GeneReviews
+          chapter), the unfiltered gene-like words of 'genes_in_pub', its
+          'genes_in_pub_and_genereviews', its 'genereviews' chapters and the
+          paths of its 'faces'; None if the pmid is not in the store.
+        """
+        rows = self._rows(self.connection.execute(
+            "SELECT pmid, pdf, title, abstract, pub_date, number_of_faces, genes_in_pub FROM publication WHERE pmid = ?",
+            (str(pmid),)))
+        if not rows:
+            return None
+        publication = self._details(rows, unique_faces)[0]
+        publication['genes_in_pub'] = _split(publication['genes_in_pub'])
+        publication['genes'] = [symbol for symbol, in self.connection.execute(
+            "SELECT symbol FROM publication_gene JOIN gene USING (gene_id) WHERE pmid = ? ORDER BY symbol",
+            (publication['pmid'],))]
+        return publication
+
+    def publications_for_gene(self, symbol, genereviews_only=False, with_faces=True, unique_faces=False, limit=None):
+        """
+        List the publications that mention a gene, most recent first.
+
+        A publication mentions a gene if it is HGNC cross-referenced in it or
+        in a GeneReviews chapter it was matched to; the unfiltered
+        genes_in_pub words are not looked up.
+
+        Parameters:
+        - symbol: str, the gene symbol, in any case.
+        - genereviews_only: bool, only publications where the gene is also in
+          a GeneReviews chapter they were matched to.
+        - with_faces: bool, only publications with at least one face.
+        - unique_faces: bool, leave out the crops the face_index stage marked as duplicates.
+        - limit: int, maximum number of publications, or None.
+
+        Returns:
+        - publications: list of dicts with 'pmid', 'pdf', 'title',
+          'pub_date', 'number_of_faces', 'cross_referenced', 'in_genereviews',
+          'genes_in_pub_and_genereviews', 'genereviews' and 'faces'.
+        """
+        query = ("SELECT p.pmid, p.pdf, p.title, p.pub_date, p.number_of_faces, pg.cross_referenced, pg.in_genereviews "
+                 "FROM gene g JOIN publication_gene pg ON pg.gene_id = g.gene_id "
+                 "JOIN publication p ON p.pmid = pg.pmid WHERE g.symbol = ?")
+        if genereviews_only:
+            query += " AND pg.in_genereviews"
+        if with_faces:
+            query += " AND p.number_of_faces > 0"
+        query += " ORDER BY p.pub_date DESC, p.pmid"
+        parameters = [symbol]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(int(limit))
+        return self._details(self._rows(self.connection.execute(query, parameters)), unique_faces)
+
+    def search(self, text, with_faces=True, unique_faces=False, limit=20):
+        """
+        Full-text search of the titles and abstracts, best matches first.
+
+        Parameters:
+        - text: str, an FTS5 query, e.g. 'craniofacial' or '"cleft palate" AND syndrome'.
+        - with_faces, unique_faces, limit: as in publications_for_gene.
+
+        Returns:
+        - publications: list of dicts as publications_for_gene, with 'rank'
+          (bm25, lower is better) instead of the gene columns.
+        """
+        query = ("SELECT p.pmid, p.pdf, p.title, p.pub_date, p.number_of_faces, publication_fts.rank AS rank "
+                 "FROM publication_fts JOIN publication p ON p.rowid = publication_fts.rowid "
+                 "WHERE publication_fts MATCH ?")
+        if with_faces:
+            query += " AND p.number_of_faces > 0"
+        query += " ORDER BY publication_fts.rank LIMIT ?"
+        return self._details(self._rows(self.connection.execute(query, (text, int(limit)))), unique_faces)
+
+    def counts(self):
+        return {table: self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('publication', 'gene', 'publication_gene', 'face')}
+
+    def close(self):
+        self.connection.close()
+
+
+def build_query_store(store_path, results_path, face_directories=(), duplicates_path=None, prune=True):
+    """
+    Create or update the query store from the final results and their face crops.
+
+    Parameters:
+    - store_path: str, the database file.
+    - results_path: str, filtered_results_7.
+    - face_directories: list of str, e.g. ['faces_2'].
+    - duplicates_path: str, the face_duplicates table of the face_index stage, or None.
+    - prune: bool, drop the publications missing from the results.
+
+    Returns:
+    - counts: dict with the publication and face counts of the update.
+    """
+    store = QueryStore(store_path)
+    try:
+        counts = {'publications': store.update_publications(results_path, prune=prune),
+                  'faces': store.update_faces(face_directories, duplicates_path)}
+        print(f"Query store {store_path}: publications {counts['publications']}, faces {counts['faces']}, "
+              f"totals {store.counts()}")
+        return counts
+    finally:
+        store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the indexed store of the final results.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Create or update the store from filtered_results_7 and the face crops.")
+    build.add_argument('store', nargs='?', default=DEFAULT_QUERY_STORE, help=f"Store file (default: {DEFAULT_QUERY_STORE}).")
+    build.add_argument('--results', default='filtered_results_7.csv', help="Results table (default: filtered_results_7.csv).")
+    build.add_argument('--faces', nargs='*', default=['faces_2'], help="Face crop directories (default: faces_2).")
+    build.add_argument('--duplicates', default=None, help="face_duplicates table of the face_index stage.")
+    build.add_argument('--keep-missing', action='store_true',
+                       help="Keep publications missing from --results, which then only needs the new results.")
+
+    for name, help_text in (('gene', "Publications mentioning a gene symbol."),
+                            ('pmid', "One publication by its pmid."),
+                            ('search', "Full-text search of the titles and abstracts (FTS5 query syntax).")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('store', help="Store file.")
+        command.add_argument('query')
+        command.add_argument('--unique-faces', action='store_true', help="Leave out duplicate face crops.")
+        if name != 'pmid':
+            command.add_argument('--all', action='store_true', help="Include publications without faces.")
+            command.add_argument('--limit', type=int, default=None if name == 'gene' else 20)
+        if name == 'gene':
+            command.add_argument('--genereviews-only', action='store_true',
+                                 help="Only publications where the gene is also in a matched GeneReviews chapter.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build_query_store(args.store, args.results, args.faces, args.duplicates, prune=not args.keep_missing)
+        return
+
+    if not os.path.exists(args.store):
+        parser.error(f"{args.store} does not exist")
+    store = QueryStore(args.store)
+    try:
+        start = time.perf_counter()
+        if args.command == 'gene':
+            result = store.publications_for_gene(args.query, genereviews_only=args.genereviews_only,
+                                                 with_faces=not args.all, unique_faces=args.unique_faces,
+                                                 limit=args.limit)
+        elif args.command == 'pmid':
+            result = store.publication(args.query, unique_faces=args.unique_faces)
+        else:
+            result = store.search(args.query, with_faces=not args.all, unique_faces=args.unique_faces,
+                                  limit=args.limit)
+        elapsed = time.perf_counter() - start
+        print(json.dumps(result, indent=2))
+        found = 0 if result is None else len(result) if isinstance(result, list) else 1
+        print(f"{found} publications in {elapsed * 1000:.1f} ms", file=sys.stderr)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,25 @@
+import io
 import os
+import shutil
 import tarfile
+import tempfile
 import re
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
 from bs4 import BeautifulSoup
+from lxml import etree
+import numpy as np
 import pandas as pd
+
+from genes.hgnc import load_hgnc_index
+from pipeline import metrics
+from pipeline.archives import iter_archive_members, prefetch, bounded_map, DEFAULT_PREFETCH
+from pipeline.storage import read_table, write_table, iter_table, storage_format, table_columns, TableWriter
+
+
 def unzip_file(file_path, destination_path):
     """
     Unzips a specified .tar.gz file to a given destination directory.
@@ -43,117 +59,347 @@ def unzip_file(file_path, destination_path):
 
 
 
-def extracting_genes(output_csv):
-    # Regular expression pattern to match potential gene symbols with at least 5 characters, excluding exactly three digits
-    gene_pattern = re.compile(r'\b(?!\d{3}\b)[A-Z0-9]{2,}\b')
-
-    generev = []
-
-    # Path to the directory containing the unzipped XML files
-    xml_path = Path('gene_NBK1116/gene_NBK1116')
-    xml_list = [xml_path / e.name for e in xml_path.rglob('*.nxml')]
-
-    for xml in xml_list:
-        try:
-            with open(xml, 'rb') as f:
-                soup = BeautifulSoup(f, 'lxml-xml')
-                title = soup.title.get_text() if soup.title else "No Title Found"
-                
-                # Skip retired chapters and specific content
-                if 'RETIRED CHAPTER, FOR HISTORICAL REFERENCE ONLY' not in title:
-                    if 'Resources for Genetics Professionals' not in title:
-                        ref_list = soup.find_all('ref-list')
-                        for ref in ref_list:
-                            pmids = [i.get_text() for i in ref.find_all('pub-id')]
-                            
-                            # Attempt to find a section header that likely represents the diagnosis section
-                            diagnosis_header = None
-                            possible_titles = soup.find_all('title', string=re.compile(r'Diagnosis/testing', re.I))
-                            
-                            genes_in_diagnosis = []
-
-                            if possible_titles:
-                                for title_tag in possible_titles:
-                                    # Check if the title is part of the relevant content
-                                    if 'diagnosis/testing' in title_tag.get_text().lower():
-                                        diagnosis_header = title_tag
-                                        break
-                            
-                            if diagnosis_header:
-                                # Get the next sibling elements until the next title or section header
-                                diagnosis_section = []
-                                next_sibling = diagnosis_header.find_next_sibling()
-                                while next_sibling and next_sibling.name != 'title':
-                                    diagnosis_section.append(next_sibling)
-                                    next_sibling = next_sibling.find_next_sibling()
-
-                                # Extract potential gene names from the diagnosis section
-                                for element in diagnosis_section:
-                                    for text in element.stripped_strings:
-                                        for match in gene_pattern.findall(text):
-                                            genes_in_diagnosis.append(match)
-                                
-                                # Remove duplicates
-                                genes_in_diagnosis = list(set(genes_in_diagnosis))
-                            
-                            genes_str = ', '.join(genes_in_diagnosis)
-                            for pmid in pmids:
-                                generev.append({'title': title, 'pmid': pmid, 'genes': genes_str})
+# Regular expression pattern to match potential gene symbols with at least 5 characters, excluding exactly three digits
+GENEREVIEWS_GENE_PATTERN = re.compile(r'\b(?!\d{3}\b)[A-Z0-9]{2,}\b')
+DIAGNOSIS_TITLE_PATTERN = re.compile(r'Diagnosis/testing', re.I)
+SKIPPED_CHAPTER_TITLES = ('RETIRED CHAPTER, FOR HISTORICAL REFERENCE ONLY', 'Resources for Genetics Professionals')
+
+
+def list_genereviews_chapters(xml_directory='gene_NBK1116/gene_NBK1116'):
+    """
+    List the .nxml chapter files of the GeneReviews dump.
+
+    Parameters:
+    - xml_directory: str, directory with the unzipped GeneReviews XML files.
+
+    Returns:
+    - xml_list: list of Path, in sorted order.
+    """
+    xml_path = Path(xml_directory)
+    return sorted(xml_path / e.name for e in xml_path.rglob('*.nxml'))
+
+
+def iter_archived_chapters(archive_path):
+    """
+    Read the .nxml chapters straight out of the GeneReviews tarball, without unzipping it.
+
+    Yields:
+    - (name, data): the chapter file name and its bytes, in archive order.
+    """
+    for name, data, _ in iter_archive_members(archive_path, ('.nxml',)):
+        yield name, data
+
+
+def _open_chapter(xml):
+    # A chapter is a path, or a (name, bytes) pair read from the tarball
+    if isinstance(xml, tuple):
+        return nullcontext(io.BytesIO(xml[1]))
+    return open(xml, 'rb')
+
+
+def extract_chapter_bs4(xml):
+    """
+    Extract the (title, pmid, genes) rows of one chapter with BeautifulSoup.
+
+    This is the original engine. It builds the whole tree and scans it again
+    for every reference list, and joins the genes in set order.
+    """
+    gene_pattern = GENEREVIEWS_GENE_PATTERN
+    rows = []
+    with _open_chapter(xml) as f:
+        soup = BeautifulSoup(f, 'lxml-xml')
+        title = soup.title.get_text() if soup.title else "No Title Found"
+        
+        # Skip retired chapters and specific content
+        if 'RETIRED CHAPTER, FOR HISTORICAL REFERENCE ONLY' not in title:
+            if 'Resources for Genetics Professionals' not in title:
+                ref_list = soup.find_all('ref-list')
+                for ref in ref_list:
+                    pmids = [i.get_text() for i in ref.find_all('pub-id')]
+                    
+                    # Attempt to find a section header that likely represents the diagnosis section
+                    diagnosis_header = None
+                    possible_titles = soup.find_all('title', string=re.compile(r'Diagnosis/testing', re.I))
+                    
+                    genes_in_diagnosis = []
+
+                    if possible_titles:
+                        for title_tag in possible_titles:
+                            # Check if the title is part of the relevant content
+                            if 'diagnosis/testing' in title_tag.get_text().lower():
+                                diagnosis_header = title_tag
+                                break
+                    
+                    if diagnosis_header:
+                        # Get the next sibling elements until the next title or section header
+                        diagnosis_section = []
+                        next_sibling = diagnosis_header.find_next_sibling()
+                        while next_sibling and next_sibling.name != 'title':
+                            diagnosis_section.append(next_sibling)
+                            next_sibling = next_sibling.find_next_sibling()
+
+                        # Extract potential gene names from the diagnosis section
+                        for element in diagnosis_section:
+                            for text in element.stripped_strings:
+                                for match in gene_pattern.findall(text):
+                                    genes_in_diagnosis.append(match)
                         
-        except Exception as e:
-            print(f"Error processing {xml}: {e}")
+                        # Remove duplicates
+                        genes_in_diagnosis = list(set(genes_in_diagnosis))
+                    
+                    genes_str = ', '.join(genes_in_diagnosis)
+                    for pmid in pmids:
+                        rows.append({'title': title, 'pmid': pmid, 'genes': genes_str})
+    return rows
+
+
+def _single_string(element):
+    # Same as BeautifulSoup's Tag.string: the text of an element whose only child is one string
+    children = list(element)
+    if not children:
+        return element.text or None
+    if len(children) == 1 and not element.text and not children[0].tail:
+        return _single_string(children[0])
+    return None
+
+
+def extract_chapter_lxml(xml, find_genes=None):
+    """
+    Extract the (title, pmid, genes) rows of one chapter in a single streaming pass.
 
-    # Create a DataFrame
-    genes = pd.DataFrame(generev, columns=['title', 'pmid', 'genes'])
+    Gives the same rows as extract_chapter_bs4, but the chapter is read once
+    with lxml.etree.iterparse: the first <title>, the first 'Diagnosis/testing'
+    section and the <pub-id>s of every <ref-list> are picked up as the parser
+    goes, and elements are freed as soon as they are no longer needed, so
+    memory stays bounded. Genes are joined in order of first appearance
+    rather than set order.
 
-    # Save the DataFrame to a CSV file
-    genes.to_csv(output_csv, index=False)
-    print(f"Gene information saved to {output_csv}")
+    Parameters:
+    - xml: str or Path, the .nxml chapter file, or a (name, bytes) pair
+      from iter_archived_chapters.
+    - find_genes: callable returning the genes in a string, e.g. the find
+      method of an HGNC index; defaults to GENEREVIEWS_GENE_PATTERN.findall.
 
-import pandas as pd
+    Returns:
+    - rows: list of dicts with 'title', 'pmid' and 'genes'.
+    """
+    if find_genes is None:
+        find_genes = GENEREVIEWS_GENE_PATTERN.findall
+    title_element = None
+    title = None
+    diagnosis_parent = None
+    collecting = False
+    genes = {}
+    ref_lists = []
+    open_ref_lists = []
+    # Elements whose text is still needed when they end; their descendants are kept until then
+    capturing = set()
+
+    source = io.BytesIO(xml[1]) if isinstance(xml, tuple) else str(xml)
+    context = etree.iterparse(source, events=('start', 'end'), remove_comments=True, remove_pis=True,
+                              recover=True, resolve_entities=False, huge_tree=True)
+    for event, element in context:
+        tag = element.tag
+        if event == 'start':
+            if tag == 'title':
+                if title_element is None:
+                    title_element = element
+                capturing.add(element)
+            elif tag == 'pub-id':
+                capturing.add(element)
+            elif tag == 'ref-list':
+                pmids = []
+                ref_lists.append(pmids)
+                open_ref_lists.append(pmids)
+            if collecting and element.getparent() is diagnosis_parent:
+                capturing.add(element)
+            continue
 
-def match_gene_data(file1, file2, hgnc_file, output_file):
+        if element is title_element:
+            title = ''.join(element.itertext())
+
+        if collecting and element.getparent() is diagnosis_parent:
+            if tag == 'title':
+                collecting = False
+            else:
+                for text in element.itertext():
+                    for match in find_genes(text):
+                        genes.setdefault(match, None)
+        elif collecting and element is diagnosis_parent:
+            collecting = False
+
+        if tag == 'title' and diagnosis_parent is None and element.getparent() is not None:
+            string = _single_string(element)
+            if string and DIAGNOSIS_TITLE_PATTERN.search(string) \
+                    and 'diagnosis/testing' in ''.join(element.itertext()).lower():
+                diagnosis_parent = element.getparent()
+                collecting = True
+        elif tag == 'pub-id':
+            pmid = ''.join(element.itertext())
+            for pmids in open_ref_lists:
+                pmids.append(pmid)
+        elif tag == 'ref-list':
+            open_ref_lists.pop()
+
+        capturing.discard(element)
+        if not capturing:
+            # Free everything that has been read; ancestors still hold their open elements
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+    del context
+
+    if title is None:
+        title = "No Title Found"
+    if any(skipped in title for skipped in SKIPPED_CHAPTER_TITLES):
+        return []
+    genes_str = ', '.join(genes)
+    return [{'title': title, 'pmid': pmid, 'genes': genes_str} for pmids in ref_lists for pmid in pmids]
+
+
+GENEREVIEWS_COLUMNS = ['title', 'pmid', 'genes']
+
+
+def _extract_chapter_shard(shard_index, xml_files, shard_directory, engine, hgnc_file=None):
     """
-    This function reads gene data from two input CSV files and an HGNC file,
-    then matches and cross-references genes between the files. The matched data
-    is saved to an output CSV file.
+    Extract a run of chapters and write their rows to one shard file.
+
+    Returns:
+    - (shard_path, errors, shard_metrics): the headerless CSV shard, a list of
+      {'file', 'error'} dicts for the chapters that failed and a snapshot of
+      the shard's metrics.
+    """
+    with metrics.collect() as shard_metrics:
+        extract_chapter = extract_chapter_lxml if engine == 'lxml' else extract_chapter_bs4
+        if hgnc_file is not None:
+            extract_chapter = partial(extract_chapter_lxml, find_genes=load_hgnc_index(hgnc_file).find)
+        rows, errors = [], []
+        for xml in xml_files:
+            try:
+                with shard_metrics.timer('genereviews.chapter'):
+                    rows.extend(extract_chapter(xml))
+            except Exception as e:
+                errors.append({'file': xml[0] if isinstance(xml, tuple) else str(xml), 'error': str(e)})
+        shard_metrics.count('genereviews.chapters', len(xml_files))
+        shard_metrics.count('genereviews.rows', len(rows))
+        shard_metrics.count('genereviews.errors', len(errors))
+        shard_path = os.path.join(shard_directory, f"shard_{shard_index:06d}.csv")
+        with shard_metrics.timer('genereviews.write_shard'):
+            pd.DataFrame(rows, columns=GENEREVIEWS_COLUMNS).to_csv(shard_path, index=False, header=False)
+    return shard_path, errors, shard_metrics.snapshot()
+
+
+def extracting_genes(output_csv, xml_directory='gene_NBK1116/gene_NBK1116', engine='lxml', workers=1, chapters_per_shard=32, error_report=None, hgnc_file=None, archive_path=None, prefetch_size=DEFAULT_PREFETCH):
+    """
+    Extract the PMIDs cited by every GeneReviews chapter together with the
+    genes named in the chapter's Diagnosis/testing section.
+
+    Chapters are processed in sorted path order in runs of chapters_per_shard,
+    each written to its own shard, optionally spread over a process pool. The
+    shards are concatenated in order, so the CSV is byte-identical whatever
+    the number of workers, and no more than one shard of rows is held in
+    memory per process.
 
     Parameters:
-    - file1: str, path to the first input CSV file.
-    - file2: str, path to the second input CSV file.
-    - hgnc_file: str, path to the HGNC text file.
-    - output_file: str, path to the output CSV file where results will be saved.
+    - output_csv: str, path of the CSV (or Parquet/Feather) file with 'title',
+      'pmid' and 'genes' columns.
+    - xml_directory: str, directory with the unzipped GeneReviews XML files.
+    - engine: str, 'lxml' for the streaming parser or 'bs4' for the original
+      BeautifulSoup one.
+    - workers: int, number of worker processes.
+    - chapters_per_shard: int, number of chapters per shard.
+    - error_report: str, CSV file listing the chapters that failed; defaults
+      to the output name with an '_errors' suffix. Only written if any failed.
+    - hgnc_file: str, path to hgnc_complete_set.txt; when given, only HGNC
+      symbols (with previous and alias symbols mapped to the approved one) are
+      listed as genes, instead of every word that looks like one. Needs the
+      lxml engine.
+    - archive_path: str, the GeneReviews tarball (e.g. gene_NBK1116.tar.gz);
+      when given, the chapters are parsed straight out of it instead of
+      xml_directory, in archive order rather than sorted path order. A
+      background thread decompresses the tarball at most prefetch_size
+      shards ahead of the parsing.
 
     Returns:
-    - output_file: str, path to the output CSV file.
+    - errors: list of {'file', 'error'} dicts for the chapters that failed.
     """
+    if engine not in ('lxml', 'bs4'):
+        raise ValueError(f"Unknown engine: {engine}")
+    if hgnc_file is not None and engine != 'lxml':
+        raise ValueError("Matching HGNC symbols needs the lxml engine")
+
+    if archive_path is not None:
+        chapters = iter_archived_chapters(archive_path)
+    else:
+        chapters = iter(list_genereviews_chapters(xml_directory))
+    shards = iter(lambda: list(islice(chapters, chapters_per_shard)), [])
+    if archive_path is not None:
+        shards = prefetch(shards, prefetch_size)
+    shard_directory = tempfile.mkdtemp(prefix='genereviews_shards_', dir=os.path.dirname(os.path.abspath(output_csv)))
+    extract_shard = partial(_extract_chapter_shard, shard_directory=shard_directory, engine=engine,
+                            hgnc_file=hgnc_file)
 
-    # Read the CSV files into dataframes
-    df1 = pd.read_csv(file1)
-    df2 = pd.read_csv(file2)
-    hgnc_df = pd.read_csv(hgnc_file, delimiter="\t", low_memory=False)  # Reading HGNC text file
+    try:
+        if workers <= 1:
+            results = [extract_shard(i, shard) for i, shard in enumerate(shards)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Only a few shards are queued ahead of the workers, so the tarball is not read into memory at once
+                submit = lambda shard: executor.submit(extract_shard, *shard)
+                results = list(bounded_map(submit, enumerate(shards), 2 * workers))
+        for _, _, shard_metrics in results:
+            metrics.merge(shard_metrics)
+
+        # Merge the shards in sorted path order behind a single header
+        with metrics.timer('genereviews.merge'):
+            is_csv = storage_format(output_csv) == 'csv'
+            merged_csv = output_csv if is_csv else os.path.join(shard_directory, 'merged.csv')
+            with open(merged_csv, 'w', newline='') as output:
+                pd.DataFrame(columns=GENEREVIEWS_COLUMNS).to_csv(output, index=False)
+                for shard_path, _, _ in results:
+                    with open(shard_path, 'r', newline='') as shard:
+                        shutil.copyfileobj(shard, output)
+            if not is_csv:
+                write_table(read_table(merged_csv, schema='genereviews'), output_csv, schema='genereviews')
+    finally:
+        shutil.rmtree(shard_directory, ignore_errors=True)
+
+    errors = [error for _, shard_errors, _ in results for error in shard_errors]
+    if errors:
+        if error_report is None:
+            error_report = f"{os.path.splitext(output_csv)[0]}_errors.csv"
+        pd.DataFrame(errors, columns=['file', 'error']).to_csv(error_report, index=False)
+        print(f"{len(errors)} chapters could not be processed, see {error_report}")
+    print(f"Gene information saved to {output_csv}")
+    return errors
 
-    # Ensure 'pmid' columns are of the same type
-    df1['pmid'] = df1['pmid'].astype(str)
-    df2['pmid'] = df2['pmid'].astype(str)
+import pandas as pd
 
-    # Check if required columns exist in the dataframes
-    if 'pmid' not in df1.columns or 'genes' not in df1.columns:
-        raise ValueError("Input file 1 must contain 'pmid' and 'genes' columns")
-    if 'pmid' not in df2.columns or 'genes_found' not in df2.columns:
-        raise ValueError("Input file 2 must contain 'pmid' and 'genes_found' columns")
-    if 'symbol' not in hgnc_df.columns:
-        raise ValueError("HGNC file must contain 'symbol' column")
+def _split_genes(genes):
+    # One row per gene, indexed by the row it came from, in the order listed
+    return genes.dropna().astype(str).str.split(',').explode().str.strip()
 
-    # Merge dataframes on 'pmid', keeping all rows from df2
-    merged_df = pd.merge(df2, df1, on='pmid', how='left')
 
+def _join_genes(genes, sep=','):
+    # Join the genes of each row with sep; the genes of a row are contiguous, as _split_genes leaves them
+    index = genes.index.to_numpy()
+    values = genes.tolist()
+    if not values:
+        return pd.Series(dtype=object)
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+    return pd.Series([sep.join(values[a:b]) for a, b in zip(starts, ends)], index=index[starts], dtype=object)
+
+
+def _match_rows_iterrows(merged_df, hgnc_symbols):
+    """
+    Original row by row matching, kept as engine='iterrows' for comparison.
+    """
     # Initialize a list to store matched rows
     matched_rows = []
 
-    # Get the set of symbols from the HGNC file
-    hgnc_symbols = set(hgnc_df['symbol'])
-
     # Iterate through each row of the merged dataframe
     for index, row in merged_df.iterrows():
         genes_found = row['genes_found']
@@ -186,7 +432,86 @@ def match_gene_data(file1, file2, hgnc_file, output_file):
         matched_rows.append(new_row)
 
     # Convert the matched rows to a dataframe
-    matched_df = pd.DataFrame(matched_rows)
+    return pd.DataFrame(matched_rows)
+
+
+def _match_rows_vectorized(merged_df, hgnc_symbols):
+    """
+    Columnar version of _match_rows_iterrows giving the same frame.
+
+    The gene lists are exploded to one row per gene, filtered against the
+    HGNC symbols with isin, and the GeneReviews genes are matched on
+    (row, gene) pairs; both lists are then joined back per row, keeping the
+    order and duplicates of the original lists.
+    """
+    found = _split_genes(merged_df['genes_found'])
+    cross = found[found.isin(hgnc_symbols)]
+    if cross.empty:
+        return pd.DataFrame()
+
+    cross_referenced = _join_genes(cross)
+    kept = cross_referenced.index
+
+    if 'genes' in merged_df.columns:
+        genes = _split_genes(merged_df.loc[kept, 'genes'])
+        pairs = pd.MultiIndex.from_arrays([genes.index, genes.values])
+        cross_pairs = pd.MultiIndex.from_arrays([cross.index, cross.values])
+        matching = _join_genes(genes[pairs.isin(cross_pairs)])
+        matched_df = merged_df.loc[kept].drop(columns=['genes'])
+    else:
+        matching = pd.Series(dtype=object)
+        matched_df = merged_df.loc[kept].copy()
+
+    matched_df['genes_in_pub_and_genereviews'] = matching.reindex(kept, fill_value='')
+    matched_df['cross_referenced_genes'] = cross_referenced
+    return matched_df.reset_index(drop=True)
+
+
+def match_gene_data(file1, file2, hgnc_file, output_file, engine='vectorized'):
+    """
+    This function reads gene data from two input CSV files and an HGNC file,
+    then matches and cross-references genes between the files. The matched data
+    is saved to an output CSV file.
+
+    Parameters:
+    - file1: str, path to the first input CSV (or Parquet/Feather) file.
+    - file2: str, path to the second input CSV (or Parquet/Feather) file.
+    - hgnc_file: str, path to the HGNC text file.
+    - output_file: str, path to the output CSV (or Parquet/Feather) file where results will be saved.
+    - engine: str, 'vectorized' (default) or 'iterrows' for the original
+      row by row loop; both write the same file.
+
+    Returns:
+    - output_file: str, path to the output CSV file.
+    """
+    if engine not in ('vectorized', 'iterrows'):
+        raise ValueError(f"Unknown engine: {engine}")
+
+    # Read the input tables; their schemas type 'pmid' as a string in both
+    with metrics.timer('match.read'):
+        df1 = read_table(file1, schema='genereviews')
+        df2 = read_table(file2, schema='abstract_genes')
+
+    # Check if required columns exist in the dataframes
+    if 'pmid' not in df1.columns or 'genes' not in df1.columns:
+        raise ValueError("Input file 1 must contain 'pmid' and 'genes' columns")
+    if 'pmid' not in df2.columns or 'genes_found' not in df2.columns:
+        raise ValueError("Input file 2 must contain 'pmid' and 'genes_found' columns")
+
+    # Merge dataframes on 'pmid', keeping all rows from df2
+    with metrics.timer('match.merge'):
+        merged_df = pd.merge(df2, df1, on='pmid', how='left')
+
+    # Get the set of approved symbols from the prebuilt HGNC index
+    with metrics.timer('match.hgnc_index'):
+        hgnc_symbols = load_hgnc_index(hgnc_file).approved
+
+    with metrics.timer('match.rows'):
+        if engine == 'iterrows':
+            matched_df = _match_rows_iterrows(merged_df, hgnc_symbols)
+        else:
+            matched_df = _match_rows_vectorized(merged_df, hgnc_symbols)
+    metrics.count('match.output_rows', len(matched_df))
 
     # Drop the 'pdf' column if it exists
     if 'pdf' in matched_df.columns:
@@ -200,42 +525,112 @@ def match_gene_data(file1, file2, hgnc_file, output_file):
         'matching_genes': 'genes_in_pub_and_genereviews'
     })
 
-    # Save the matched dataframe to a CSV file
-    matched_df.to_csv(output_file, index=False)
+    # Save the matched dataframe to a CSV (or Parquet/Feather) file
+    with metrics.timer('match.write'):
+        write_table(matched_df, output_file, schema='matched')
 
     return output_file
 
 
+
+def filter_matches(input_file, output_file):
+    """
+    Keep only the matched publications in which faces were detected.
+
+    Parameters:
+    - input_file: str, path to the matched data written by match_gene_data.
+    - output_file: str, path of the filtered file.
+
+    Returns:
+    - output_file: str, path of the filtered file.
+    """
+    # Find the faces column whatever its case and surrounding spaces
+    faces_column = next((column for column in table_columns(input_file)
+                         if column.strip().lower() == 'number_of_faces'), None)
+    if faces_column is None:
+        raise ValueError("Output file must contain 'number_of_faces' column")
+
+    # Filter out rows where 'number_of_faces' is 0 while reading; Parquet skips the row groups without faces
+    df = read_table(input_file, filters=[(faces_column, '!=', 0)], schema='matched')
+
+    # Normalize column names to handle case sensitivity and leading/trailing spaces
+    df.columns = df.columns.str.strip().str.lower()
+
+    # Save the filtered dataframe to a new file
+    write_table(df, output_file, schema='matched')
+    return output_file
+
 import pandas as pd
 import re
 
-def extract_genes_from_csv(input_csv_path, output_csv_path):
-    # Define the regex pattern for gene
-    gene_pattern = re.compile(r'\b(?!\d{3}\b)[A-Z0-9]{3,5}\b')
+# Regular expression pattern for gene-like words in titles and abstracts, excluding exactly three digits
+ABSTRACT_GENE_PATTERN = re.compile(r'\b(?!\d{3}\b)[A-Z0-9]{3,5}\b')
+# The same shortest word for the HGNC index, so short aliases are not found in ordinary text
+ABSTRACT_MIN_LENGTH = 3
 
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(input_csv_path)
 
-    # Function to find genes in text
-    def find_genes(text):
-        if pd.isna(text):
-            return set()
-        matches = gene_pattern.findall(text)
-        # Filter out patterns that are just numbers
-        return {match for match in matches if not match.isdigit()}
+def find_genes_in_columns(df, text_columns=('title', 'abstract'), hgnc_index=None):
+    """
+    Find the gene-like words of every row in some text columns.
 
-    # Apply the function to 'title' and 'abstract' columns and create a new column 'genes_found'
-    title_genes = df['title'].apply(find_genes)
-    abstract_genes = df['abstract'].apply(find_genes)
-    
-    # Combine and remove duplicates
-    df['genes_found'] = title_genes.combine(abstract_genes, lambda x, y: x.union(y)).apply(lambda x: ', '.join(x))
+    The matches are exploded to one row per gene, numbers are dropped and
+    each gene is kept once per row, in order of first appearance. With an
+    HGNC index, only HGNC symbols are found, already mapped to the approved
+    symbol.
 
-    # Save the modified DataFrame to a new CSV file
-    df.to_csv(output_csv_path, index=False)
+    Returns:
+    - genes_found: Series of ', ' joined genes aligned with df, '' where none were found.
+    """
+    if hgnc_index is not None:
+        find = partial(hgnc_index.find, min_length=ABSTRACT_MIN_LENGTH)
+        found = pd.concat([df[column].map(find).explode() for column in text_columns]).dropna()
+    else:
+        found = pd.concat([df[column].str.findall(ABSTRACT_GENE_PATTERN).explode() for column in text_columns])
+        found = found.dropna()
+        found = found[~found.str.isdigit()]
+    # Stable sort so a row's genes stay in column order, then keep the first of each (row, gene)
+    found = found.iloc[np.argsort(found.index.to_numpy(), kind='stable')]
+    found = found[~pd.MultiIndex.from_arrays([found.index, found.values]).duplicated()]
+    return _join_genes(found, sep=', ').reindex(df.index, fill_value='')
+
+
+def extract_genes_from_csv(input_csv_path, output_csv_path, chunksize=None, columns=None, hgnc_file=None):
+    """
+    Add a 'genes_found' column with the gene-like words of the title and abstract.
+
+    Parameters:
+    - input_csv_path: str, CSV (or Parquet/Feather) file with 'title' and 'abstract' columns.
+    - output_csv_path: str, path of the output CSV (or Parquet/Feather) file.
+    - chunksize: int, read and write this many rows at a time, so memory stays
+      flat however large the input is; None reads the whole file at once.
+    - columns: list of str, the input columns to read and keep in the output;
+      defaults to all of them. 'title' and 'abstract' are always read.
+    - hgnc_file: str, path to hgnc_complete_set.txt; when given, only HGNC
+      symbols are listed, normalised to the approved symbol, instead of
+      every 3 to 5 character word that looks like a gene.
+
+    Returns:
+    - None
+    """
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(list(columns) + ['title', 'abstract']))
+
+    if chunksize:
+        chunks = iter_table(input_csv_path, columns=usecols, chunksize=chunksize, schema='publications')
+    else:
+        chunks = [read_table(input_csv_path, columns=usecols, schema='publications')]
+
+    hgnc_index = load_hgnc_index(hgnc_file) if hgnc_file is not None else None
+
+    with TableWriter(output_csv_path, schema='abstract_genes') as writer:
+        for chunk in chunks:
+            chunk['genes_found'] = find_genes_in_columns(chunk, hgnc_index=hgnc_index)
+            if columns is not None:
+                chunk = chunk[[column for column in chunk.columns if column in columns or column == 'genes_found']]
+            writer.write(chunk)
 
     print(f'New CSV file saved as {output_csv_path}')
 
 # Example usage:
-# extract_genes_from_csv('input_file.csv', 'output_file.csv')
-
+# extract_genes_from_csv('input_file.csv', 'output_file.csv', chunksize=100000)
@@ -0,0 +1,185 @@
+import argparse
+import os
+import pickle
+import re
+import pandas as pd
+
+
+INDEX_VERSION = 1
+
+# Words made of letters, digits and '@', optionally joined by hyphens (e.g. HLA-DRB1, C1orf112)
+HYPHEN_CHAIN_PATTERN = re.compile(r'(?<![A-Za-z0-9@])[A-Za-z0-9@]+(?:-[A-Za-z0-9@]+)*(?![A-Za-z0-9@])')
+
+# Shortest word looked up, like the GeneReviews regex; one or two letter aliases (e.g. 'T') are ordinary words
+MIN_SYMBOL_LENGTH = 2
+
+# One index per (process, path), so pool workers load it once
+_loaded_indexes = {}
+
+
+class HGNCIndex:
+    """
+    Dictionary matcher for HGNC symbols.
+
+    Approved symbols map to themselves; previous and alias symbols map to
+    their approved symbol. Text is scanned once: each hyphen-joined word is
+    split into its parts and the longest run of parts that is a known
+    symbol is taken, so 'HLA-DRB1' is found as one symbol and
+    'BRCA1-associated' as BRCA1. Only whole words match.
+    """
+
+    def __init__(self, lookup, approved, max_parts):
+        self.lookup = lookup
+        self.approved = approved
+        self.max_parts = max_parts
+
+    def normalise(self, symbol):
+        """
+        Returns:
+        - approved: str, the approved symbol for a symbol or alias, or None.
+        """
+        return self.lookup.get(symbol)
+
+    def find(self, text, min_length=MIN_SYMBOL_LENGTH):
+        """
+        Find the HGNC symbols mentioned in a text.
+
+        Parameters:
+        - text: str, the text to scan; anything else gives no genes.
+        - min_length: int, words (or hyphen-joined runs) shorter than this
+          are not looked up, as the regexes they replace never matched them.
+
+        Returns:
+        - genes: list of approved symbols in order of appearance, with repeats.
+        """
+        if not isinstance(text, str):
+            return []
+        lookup = self.lookup
+        genes = []
+        for word in HYPHEN_CHAIN_PATTERN.findall(text):
+            if '-' not in word:
+                gene = lookup.get(word) if len(word) >= min_length else None
+                if gene is not None:
+                    genes.append(gene)
+                continue
+            parts = word.split('-')
+            i = 0
+            while i < len(parts):
+                for j in range(min(len(parts), i + self.max_parts), i, -1):
+                    candidate = '-'.join(parts[i:j])
+                    gene = lookup.get(candidate) if len(candidate) >= min_length else None
+                    if gene is not None:
+                        genes.append(gene)
+                        i = j
+                        break
+                else:
+                    i += 1
+        return genes
+
+
+def _split_symbols(column):
+    # prev_symbol and alias_symbol hold '|' separated lists
+    return column.dropna().astype(str).str.split('|').explode().str.strip()
+
+
+def build_hgnc_index(hgnc_file, index_path=None, aliases=True):
+    """
+    Read the HGNC complete set once and save a compact symbol index next to it.
+
+    An approved symbol always maps to itself. A previous or alias symbol maps
+    to its approved symbol unless it is also an approved symbol or it is
+    shared by several genes, in which case it is left out.
+
+    Parameters:
+    - hgnc_file: str, path to hgnc_complete_set.txt.
+    - index_path: str, where to save the index; defaults to hgnc_file + '.idx'.
+    - aliases: bool, include previous and alias symbols.
+
+    Returns:
+    - index: HGNCIndex.
+    """
+    wanted = {'symbol', 'prev_symbol', 'alias_symbol'} if aliases else {'symbol'}
+    hgnc_df = pd.read_csv(hgnc_file, delimiter="\t", usecols=lambda column: column in wanted, dtype=str)
+    if 'symbol' not in hgnc_df.columns:
+        raise ValueError("HGNC file must contain 'symbol' column")
+
+    symbols = hgnc_df['symbol'].dropna()
+    approved = set(symbols)
+    lookup = {symbol: symbol for symbol in approved}
+
+    columns = [column for column in ('prev_symbol', 'alias_symbol') if column in hgnc_df.columns]
+    if aliases and columns:
+        others = pd.concat([_split_symbols(hgnc_df[column]) for column in columns])
+        others = pd.DataFrame({'alias': others.values, 'symbol': hgnc_df['symbol'].reindex(others.index).values})
+        others = others[(others['alias'] != '') & ~others['alias'].isin(approved)].dropna().drop_duplicates()
+        unambiguous = others[~others['alias'].duplicated(keep=False)]
+        lookup.update(zip(unambiguous['alias'], unambiguous['symbol']))
+
+    max_parts = max((key.count('-') + 1 for key in lookup), default=1)
+    index = HGNCIndex(lookup, approved, max_parts)
+
+    if index_path is None:
+        index_path = hgnc_file + '.idx'
+    stat = os.stat(hgnc_file)
+    data = {'version': INDEX_VERSION, 'source': (stat.st_size, stat.st_mtime), 'aliases': aliases,
+            'lookup': lookup, 'approved': sorted(approved), 'max_parts': max_parts}
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, index_path)
+    return index
+
+
+def load_hgnc_index(hgnc_file, index_path=None, aliases=True):
+    """
+    Load the symbol index of an HGNC file, building it if it is missing or stale.
+
+    The index is rebuilt whenever the size or modification time of the HGNC
+    file changes, and is kept in memory for the rest of the process.
+
+    Parameters:
+    - hgnc_file: str, path to hgnc_complete_set.txt.
+    - index_path: str, path of the saved index; defaults to hgnc_file + '.idx'.
+    - aliases: bool, include previous and alias symbols.
+
+    Returns:
+    - index: HGNCIndex.
+    """
+    if index_path is None:
+        index_path = hgnc_file + '.idx'
+    key = (os.getpid(), os.path.abspath(index_path), aliases)
+    index = _loaded_indexes.get(key)
+    if index is not None:
+        return index
+
+    stat = os.stat(hgnc_file)
+    data = None
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            data = pickle.load(f)
+        if (data.get('version') != INDEX_VERSION or data.get('aliases') != aliases
+                or tuple(data.get('source', ())) != (stat.st_size, stat.st_mtime)):
+            data = None
+
+    if data is None:
+        index = build_hgnc_index(hgnc_file, index_path, aliases=aliases)
+    else:
+        index = HGNCIndex(data['lookup'], set(data['approved']), data['max_parts'])
+    _loaded_indexes[key] = index
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the HGNC symbol index used to find genes in text.")
+    parser.add_argument('hgnc_file', nargs='?', default='hgnc_complete_set.txt', help="Path to hgnc_complete_set.txt.")
+    parser.add_argument('--index', default=None, help="Where to save the index (default: HGNC file + '.idx').")
+    parser.add_argument('--no-aliases', action='store_true', help="Only index approved symbols.")
+    args = parser.parse_args(argv)
+
+    index = build_hgnc_index(args.hgnc_file, args.index, aliases=not args.no_aliases)
+    print(f"Indexed {len(index.approved)} approved symbols and {len(index.lookup) - len(index.approved)} "
+          f"previous/alias symbols from {args.hgnc_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import sys
 import os
+import time
+import argparse
 import pandas as pd
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -7,6 +9,9 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from functions import extracting_genes
 from functions import match_gene_data
 from functions import extract_genes_from_csv
+from functions import filter_matches
+from pipeline import metrics
+from pipeline.storage import with_format
 # from .functions import genes_in_text
 
 # Paths to the input and output files
@@ -15,28 +20,35 @@ merged_results_file = 'results_4.csv'
 output_file = 'results_7.csv'
 filtered_output_file = 'filtered_results_7.csv'
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Match the genes of the publications with GeneReviews and HGNC.")
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help="Format of the input and output tables (default: csv).")
+    parser.add_argument('--report', default=None, metavar='PATH',
+                        help="Write a JSON run report with the timers of the matching steps.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
     try:
-        # Run the matching function
-        match_gene_data(extracted_genes_file, merged_results_file, "hgnc_complete_set.txt", output_file)
-        
-        # Load the output CSV file
-        df = pd.read_csv(output_file)
-        
-        # Normalize column names to handle case sensitivity and leading/trailing spaces
-        df.columns = df.columns.str.strip().str.lower()
+        output = with_format(output_file, args.format)
+        filtered_output = with_format(filtered_output_file, args.format)
 
-        # Filter out rows where 'number_of_faces' is 0
-        if 'number_of_faces' not in df.columns:
-            raise ValueError("Output file must contain 'number_of_faces' column")
-        df = df[df['number_of_faces'] != 0]
+        # Run the matching function
+        match_gene_data(with_format(extracted_genes_file, args.format), with_format(merged_results_file, args.format),
+                        "hgnc_complete_set.txt", output)
         
-        # Save the filtered dataframe to a new CSV file
-        df.to_csv(filtered_output_file, index=False)
+        # Keep only the publications with detected faces
+        filter_matches(output, filtered_output)
 
-        print(f"Filtered matched data saved to {filtered_output_file}")
+        print(f"Filtered matched data saved to {filtered_output}")
     except Exception as e:
         print(f"Error: {e}")
 
+    if args.report:
+        metrics.write_report(args.report, wall_seconds=time.perf_counter() - start, settings=vars(args))
+        print(f"Run report saved to {args.report}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
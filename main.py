@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from pipeline import metrics
+from pipeline.runner import Stage, run_pipeline, select_stages, print_report, DEFAULT_STATE_PATH
+from pipeline.storage import with_format
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+# The source files each stage runs. pipeline/metrics.py only times and counts, so it is left out.
+GENES_CODE = ['genes/functions.py', 'genes/hgnc.py', 'pipeline/storage.py']
+DETECTION_CODE = ['pdf_extraction/functions.py', 'pdf_extraction/detectors.py', 'pdf_extraction/cache.py',
+                  'pdf_extraction/cascade.py', 'pdf_extraction/resolution.py', 'pdf_extraction/prefilter.py',
+                  'pdf_extraction/image_store.py', 'pdf_extraction/manifest.py', 'pipeline/archives.py',
+                  'pipeline/storage.py']
+
+
+def _code(*paths):
+    # Absolute paths of a stage's source files, so editing them reruns it and editing anything else does not
+    return [os.path.join(ROOT, *path.split('/')) for path in paths]
+
+
+def run_gene_reviews(config):
+    from genes.functions import extracting_genes
+    extracting_genes(config['output'], config['xml_directory'], engine=config['engine'],
+                     workers=config['workers'], hgnc_file=config['hgnc_file'], archive_path=config['archive'])
+
+
+def run_pdf_faces(config):
+    from pdf_extraction.functions import ensure_directories, process_pdfs, create_and_save_dataframe
+    ensure_directories(config['pdf_directory'], config['image_directory'], config['face_directory'])
+    data = process_pdfs(config['pdf_directory'], config['image_directory'], config['face_directory'],
+                        config['method'], in_memory=config['in_memory'], workers=config['workers'],
+                        batch_size=config['batch_size'], weights_dir=config['weights_dir'],
+                        cache_path=config['cache_path'], manifest_path=config['manifest_path'],
+                        image_store_path=config['image_store'], crop_store_path=config['crop_store'],
+                        archive_directory=config['archive_directory'], decoder=config['decoder'])
+    create_and_save_dataframe(data, config['output'])
+
+
+def run_merge_metadata(config):
+    from pipeline.storage import read_table
+    from pdf_extraction.functions import merge_dataframes
+    merge_dataframes(read_table(config['faces'], schema='faces'), config['retrieved'], config['output'])
+
+
+def run_abstract_genes(config):
+    from genes.functions import extract_genes_from_csv
+    extract_genes_from_csv(config['input'], config['output'], chunksize=config['chunksize'],
+                           hgnc_file=config['hgnc_file'])
+
+
+def run_match(config):
+    from genes.functions import match_gene_data, filter_matches
+    match_gene_data(config['genereviews'], config['publications'], config['hgnc'], config['output'])
+    filter_matches(config['output'], config['filtered_output'])
+
+
+def run_export(config):
+    from exporting_data.functions import extract_images_from_pmid_list, detect_faces_yolo_in_directory, export_faces_from_store
+    if config['image_store']:
+        export_faces_from_store(config['input'], config['pdf_directory'], config['image_directory'],
+                                config['face_directory'], config['image_store'], cache_path=config['cache_path'],
+                                archive_directory=config['archive_directory'])
+        return
+    extract_images_from_pmid_list(config['input'], config['pdf_directory'], config['image_directory'],
+                                  archive_directory=config['archive_directory'])
+    detect_faces_yolo_in_directory(config['image_directory'], config['face_directory'])
+
+
+def run_face_index(config):
+    from pdf_extraction.face_index import build_face_index, deduplicate_faces
+    build_face_index(config['index'], config['face_directories'], config['crop_store'], workers=config['workers'])
+    deduplicate_faces(config['index'], config['output'], threshold=config['threshold'])
+
+
+def run_query_store(config):
+    from exporting_data.query_store import build_query_store
+    build_query_store(config['output'], config['input'], config['face_directories'], config['duplicates'])
+
+
+def build_stages(args):
+    """
+    Declare the pipeline: what every stage reads, writes and is configured with.
+    """
+    extracted_genes = with_format('extracted_genes.csv', args.format)
+    results_1 = with_format('results_1.csv', args.format)
+    results_2 = with_format('results_2.csv', args.format)
+    results_4 = with_format('results_4.csv', args.format)
+    results_7 = with_format('results_7.csv', args.format)
+    filtered_results_7 = with_format('filtered_results_7.csv', args.format)
+    face_duplicates = with_format('face_duplicates.csv', args.format)
+    abstract_hgnc = args.hgnc_file if args.hgnc_abstracts else None
+    genereviews_source = args.genereviews_archive or args.xml_directory
+    pdf_source = args.pdf_archives or args.pdf_directory
+
+    return [
+        Stage('gene_reviews', run_gene_reviews,
+              inputs=[genereviews_source] + ([args.hgnc_file] if args.hgnc_genereviews else []),
+              outputs=[extracted_genes],
+              config={'output': extracted_genes, 'xml_directory': args.xml_directory, 'engine': 'lxml',
+                      'workers': args.workers, 'hgnc_file': args.hgnc_file if args.hgnc_genereviews else None,
+                      'archive': args.genereviews_archive},
+              code=_code(*GENES_CODE, 'pipeline/archives.py')),
+        Stage('pdf_faces', run_pdf_faces,
+              inputs=[pdf_source],
+              outputs=[results_1, args.crop_store or 'faces'],
+              config={'output': results_1, 'pdf_directory': args.pdf_directory, 'image_directory': 'images/',
+                      'face_directory': 'faces/', 'method': args.method, 'in_memory': args.in_memory,
+                      'workers': args.workers, 'batch_size': args.batch_size, 'weights_dir': args.weights_dir,
+                      'cache_path': args.cache, 'manifest_path': args.manifest, 'image_store': args.image_store,
+                      'crop_store': args.crop_store, 'archive_directory': args.pdf_archives,
+                      'decoder': args.decode},
+              code=_code(*DETECTION_CODE, 'pdf_extraction/crop_store.py')),
+        Stage('merge_metadata', run_merge_metadata,
+              inputs=[results_1, args.retrieved],
+              outputs=[results_2],
+              config={'faces': results_1, 'retrieved': args.retrieved, 'output': results_2},
+              code=_code('pdf_extraction/functions.py', 'pipeline/storage.py')),
+        Stage('abstract_genes', run_abstract_genes,
+              inputs=[results_2] + ([abstract_hgnc] if abstract_hgnc else []),
+              outputs=[results_4],
+              config={'input': results_2, 'output': results_4, 'chunksize': args.chunksize,
+                      'hgnc_file': abstract_hgnc},
+              code=_code(*GENES_CODE)),
+        Stage('match', run_match,
+              inputs=[extracted_genes, results_4, args.hgnc_file],
+              outputs=[results_7, filtered_results_7],
+              config={'genereviews': extracted_genes, 'publications': results_4, 'hgnc': args.hgnc_file,
+                      'output': results_7, 'filtered_output': filtered_results_7},
+              code=_code(*GENES_CODE)),
+        Stage('export', run_export,
+              inputs=[filtered_results_7, pdf_source],
+              outputs=['images_2', 'faces_2'],
+              config={'input': filtered_results_7, 'pdf_directory': args.pdf_directory,
+                      'image_directory': 'images_2', 'face_directory': 'faces_2',
+                      'image_store': args.image_store, 'cache_path': args.cache,
+                      'archive_directory': args.pdf_archives},
+              code=_code('exporting_data/functions.py', *DETECTION_CODE)),
+        Stage('face_index', run_face_index,
+              inputs=[results_1, 'faces_2'] + ([args.crop_store] if args.crop_store else ['faces']),
+              outputs=['face_index', face_duplicates],
+              config={'index': 'face_index', 'output': face_duplicates,
+                      'face_directories': ['faces_2'] if args.crop_store else ['faces', 'faces_2'],
+                      'crop_store': args.crop_store, 'threshold': args.dedup_threshold, 'workers': args.workers},
+              code=_code('pdf_extraction/face_index.py', 'pdf_extraction/crop_store.py', 'pipeline/archives.py',
+                    'pipeline/storage.py')),
+        Stage('query_store', run_query_store,
+              inputs=[filtered_results_7, 'faces_2', face_duplicates],
+              outputs=['results.sqlite'],
+              config={'input': filtered_results_7, 'output': 'results.sqlite', 'face_directories': ['faces_2'],
+                      'duplicates': face_duplicates},
+              code=_code('exporting_data/query_store.py', 'pipeline/storage.py')),
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the whole pipeline, skipping the stages whose inputs did not change.")
+    parser.add_argument('stages', nargs='*',
+                        help="Stages to bring up to date, with the stages they depend on (default: all).")
+    parser.add_argument('--jobs', type=int, default=2, help="Number of independent stages run at once (default: 2).")
+    parser.add_argument('--force', action='append', default=[],
+                        help="Rerun a stage even if it is up to date; 'all' reruns every stage. Can be repeated.")
+    parser.add_argument('--dry-run', action='store_true', help="Only show which stages would run.")
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help=f"Pipeline state file (default: {DEFAULT_STATE_PATH}).")
+    parser.add_argument('--list', action='store_true', help="List the stages with their inputs and outputs.")
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help="Format of the intermediate tables (default: csv).")
+    parser.add_argument('--pdf-directory', default='pdfs/', help="Directory with the PDFs (default: pdfs/).")
+    parser.add_argument('--retrieved', default='retrieved_df2.tsv', help="PubMed metadata of the PDFs.")
+    parser.add_argument('--xml-directory', default='gene_NBK1116/gene_NBK1116', help="Unzipped GeneReviews XML files.")
+    parser.add_argument('--genereviews-archive', default=None,
+                        help="Parse the chapters straight out of the GeneReviews tarball (e.g. gene_NBK1116.tar.gz) instead of --xml-directory.")
+    parser.add_argument('--pdf-archives', default=None,
+                        help="Read the PDFs of the face detection stage straight out of the zip and tar archives in this directory.")
+    parser.add_argument('--hgnc-file', default='hgnc_complete_set.txt', help="HGNC complete set.")
+    parser.add_argument('--hgnc-genereviews', action='store_true',
+                        help="Only list HGNC symbols as GeneReviews genes.")
+    parser.add_argument('--hgnc-abstracts', action='store_true',
+                        help="Only list HGNC symbols as genes of the titles and abstracts.")
+    parser.add_argument('--chunksize', type=int, default=100000, help="Rows per chunk when reading abstracts.")
+    parser.add_argument('--method', default='yolo', choices=['yolo', 'mctnn', 'cascade', 'cascade-mctnn'],
+                        help="Face detection method; the cascade methods only run YOLO or MTCNN on the images a Haar cascade lets through.")
+    parser.add_argument('--in-memory', action='store_true', help="Decode PDF images in memory.")
+    parser.add_argument('--decode', default='bytes', choices=['bytes', 'pixmap'],
+                        help="With --in-memory, decode the images with OpenCV ('bytes') or PyMuPDF ('pixmap', any format).")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes within a stage.")
+    parser.add_argument('--batch-size', type=int, default=1, help="Images per detector call.")
+    parser.add_argument('--weights-dir', default=None, help="Directory with pre-downloaded YOLO weights.")
+    parser.add_argument('--cache', default=None, help="Detection cache database.")
+    parser.add_argument('--image-store', default=None,
+                        help="Image store shared by the face detection and export stages.")
+    parser.add_argument('--crop-store', default=None,
+                        help="Pack the face crops of the face detection stage into shard files instead of faces/.")
+    parser.add_argument('--dedup-threshold', type=float, default=0.9,
+                        help="Minimum thumbnail correlation of two face crops the face_index stage groups as duplicates.")
+    parser.add_argument('--manifest', default='manifest.jsonl', help="Per-PDF manifest of the face detection stage.")
+    parser.add_argument('--quiet', action='store_true', help="Only print errors and summaries, not a line per image.")
+    parser.add_argument('--report', default=None,
+                        help="Write a JSON run report with the timers and counters of every stage, e.g. run_report.json.")
+    parser.add_argument('--profile', default=None, metavar='DIRECTORY',
+                        help="Run every stage under cProfile and save the stats to DIRECTORY/<stage>.prof.")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Record the peak traced Python memory of every stage in the run report.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = build_stages(args)
+
+    if args.list:
+        for stage in stages:
+            print(f"{stage.name}: {', '.join(stage.inputs)} -> {', '.join(stage.outputs)}")
+        return
+
+    try:
+        stages = select_stages(stages, args.stages)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    if args.quiet:
+        metrics.set_quiet()
+    start = time.perf_counter()
+    report = run_pipeline(stages, state_path=args.state, jobs=args.jobs, force=args.force, dry_run=args.dry_run,
+                          profile_directory=args.profile, trace_memory=args.trace_memory)
+    wall_seconds = time.perf_counter() - start
+    print("Pipeline summary:")
+    print_report(report, wall_seconds)
+    if args.report:
+        metrics.write_report(args.report, wall_seconds=wall_seconds, settings=vars(args), stages=report)
+        print(f"Run report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+DEFAULT_CACHE_PATH = 'detection_cache.sqlite'
+DEFAULT_MAX_ENTRIES = 1000000
+# last_used only orders eviction, so a hit refreshes it at most this often (seconds)
+LAST_USED_INTERVAL = 3600
+
+# One cache per (process, path); pool workers open their own connection
+_open_caches = {}
+
+
+def image_hash(image):
+    """
+    Hash a decoded image so the same figure is recognised however it was encoded.
+
+    Parameters:
+    - image: numpy.ndarray, the decoded image.
+
+    Returns:
+    - digest: str, hex digest of the pixel data and its shape.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(image.shape).encode())
+    digest.update(memoryview(image) if image.flags['C_CONTIGUOUS'] else image.tobytes())
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """
+    Persistent SQLite cache of face boxes keyed by image content and detector.
+
+    The raw detector boxes are stored, before any expansion, so a hit can be
+    cropped with any expansion ratio. Entries are evicted least recently used
+    first once max_entries is exceeded.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Hits and misses not yet added to the counters table
+        self.unsaved = {'hits': 0, 'misses': 0}
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS detections (
+                image_hash TEXT NOT NULL,
+                method TEXT NOT NULL,
+                model TEXT NOT NULL,
+                boxes TEXT NOT NULL,
+                confidences TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (image_hash, method, model)
+            );
+            CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0);
+        """)
+        self.connection.commit()
+        self.size = self.connection.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+
+    def get(self, image_hash, method, model='full'):
+        """
+        Look up the boxes for an image.
+
+        A lookup only reads: hits and misses are counted in memory until
+        save_counters, and last_used is rewritten only if it is older than
+        LAST_USED_INTERVAL, so pool workers do not queue for the write lock.
+
+        Returns:
+        - (boxes, confidences) or None on a miss.
+        """
+        row = self.connection.execute(
+            "SELECT boxes, confidences, last_used FROM detections WHERE image_hash = ? AND method = ? AND model = ?",
+            (image_hash, method, model)).fetchone()
+        if row is None:
+            self.misses += 1
+            self.unsaved['misses'] += 1
+            return None
+        self.hits += 1
+        self.unsaved['hits'] += 1
+        now = time.time()
+        if now - row[2] > LAST_USED_INTERVAL:
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE detections SET last_used = ? WHERE image_hash = ? AND method = ? AND model = ?",
+                    (now, image_hash, method, model))
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, image_hash, method, boxes, confidences, model='full'):
+        """
+        Store the boxes detected in an image, evicting old entries if the cache is full.
+        """
+        boxes = [[int(v) for v in box] for box in boxes]
+        confidences = [float(c) for c in confidences]
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?, ?)",
+                (image_hash, method, model, json.dumps(boxes), json.dumps(confidences), time.time()))
+            self.size += cursor.rowcount
+            if self.size > self.max_entries:
+                self.evict()
+            # Already holding the write lock
+            self._write_counters()
+
+    def save_counters(self):
+        """
+        Add the hits and misses counted since the last save to the totals of all runs.
+        """
+        if any(self.unsaved.values()):
+            with self.connection:
+                self._write_counters()
+
+    def _write_counters(self):
+        for name, value in self.unsaved.items():
+            if value:
+                self.connection.execute("UPDATE counters SET value = value + ? WHERE name = ?", (value, name))
+        self.unsaved = {'hits': 0, 'misses': 0}
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used entries.
+
+        Parameters:
+        - keep: int, number of entries to keep; defaults to 90% of max_entries
+          so eviction does not run on every insert once the cache is full.
+        """
+        if keep is None:
+            keep = int(self.max_entries * 0.9)
+        self.size = self.connection.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        excess = self.size - keep
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM detections WHERE rowid IN "
+                "(SELECT rowid FROM detections ORDER BY last_used LIMIT ?)", (excess,))
+            self.size -= excess
+
+    def invalidate(self, method=None, model=None):
+        """
+        Delete cached detections, e.g. after the weights of a model changed.
+
+        Parameters:
+        - method: str, only delete entries of this detection method.
+        - model: str, only delete entries of this model.
+
+        Returns:
+        - deleted: int, number of entries removed.
+        """
+        query = "DELETE FROM detections WHERE 1 = 1"
+        params = []
+        if method is not None:
+            query += " AND method = ?"
+            params.append(method)
+        if model is not None:
+            query += " AND model = ?"
+            params.append(model)
+        with self.connection:
+            deleted = self.connection.execute(query, params).rowcount
+            if method is None and model is None:
+                self.connection.execute("UPDATE counters SET value = 0")
+                self.unsaved = {'hits': 0, 'misses': 0}
+        self.size -= deleted
+        return deleted
+
+    def stats(self):
+        """
+        Returns:
+        - stats: dict with the entry count, the hits and misses of this process
+          and the totals over all runs.
+        """
+        totals = dict(self.connection.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            'entries': self.connection.execute("SELECT COUNT(*) FROM detections").fetchone()[0],
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': totals.get('hits', 0) + self.unsaved['hits'],
+            'total_misses': totals.get('misses', 0) + self.unsaved['misses'],
+        }
+
+    def close(self):
+        self.save_counters()
+        self.connection.close()
+
+
+def open_cache(path, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Return this process's cache for a path, opening it on first use.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    cache = _open_caches.get(key)
+    if cache is None:
+        cache = _open_caches[key] = DetectionCache(path, max_entries)
+    return cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the face detection cache.")
+    parser.add_argument('path', nargs='?', default=DEFAULT_CACHE_PATH, help="Path to the cache database.")
+    parser.add_argument('--invalidate', action='store_true', help="Delete cached detections.")
+    parser.add_argument('--method', default=None, help="With --invalidate, only delete entries of this method.")
+    parser.add_argument('--model', default=None, help="With --invalidate, only delete entries of this model.")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"No cache found at {args.path}")
+        return
+    cache = DetectionCache(args.path)
+    if args.invalidate:
+        deleted = cache.invalidate(method=args.method, model=args.model)
+        print(f"Deleted {deleted} cached detections from {args.path}")
+    print(cache.stats())
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+import cv2
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pdf_extraction import detectors
+from pipeline import metrics
+
+
+# Cascade methods and the heavy model each one escalates candidate images to
+CASCADE_METHODS = {'cascade': 'yolo', 'cascade-mctnn': 'mctnn'}
+
+# Permissive by design: a false candidate only costs one heavy model run, a missed face is lost
+DEFAULT_CASCADE = {
+    'max_size': 320,       # long side of the grayscale image the Haar cascades run on
+    'scale_factor': 1.1,   # step between the detection window sizes
+    'min_neighbors': 1,    # overlapping hits needed to keep a candidate; higher rejects more
+    'min_size': 12,        # smallest face, in pixels of the downscaled image
+}
+
+# Settings of this process; pool workers get them through their initializer (see functions.load_detector)
+_settings = dict(DEFAULT_CASCADE)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+
+def configure(**settings):
+    """
+    Change the cascade settings (see DEFAULT_CASCADE) of this process.
+    """
+    unknown = set(settings) - set(DEFAULT_CASCADE)
+    if unknown:
+        raise ValueError(f"Unknown cascade settings: {', '.join(sorted(unknown))}")
+    _settings.update(settings)
+
+
+def cascade_settings():
+    return dict(_settings)
+
+
+@contextmanager
+def using(settings=None):
+    """
+    Run a block with other cascade settings in this process, restoring the previous ones afterwards.
+    """
+    previous = cascade_settings()
+    configure(**(settings or {}))
+    try:
+        yield
+    finally:
+        _settings.update(previous)
+
+
+def has_face_candidates(image, settings=None):
+    """
+    Cheap first tier: run OpenCV's bundled Haar cascades on a small grayscale
+    copy of the image and report whether anything face-like was found.
+
+    Parameters:
+    - image: numpy.ndarray, the BGR (or grayscale) image.
+    - settings: dict of cascade settings; defaults to cascade_settings().
+
+    Returns:
+    - bool, True if the image should go on to the heavy model.
+    """
+    settings = settings or cascade_settings()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = settings['max_size'] / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.equalizeHist(gray)
+    min_size = (settings['min_size'], settings['min_size'])
+    for classifier in detectors.get_detector('haar'):
+        faces = classifier.detectMultiScale(gray, scaleFactor=settings['scale_factor'],
+                                            minNeighbors=settings['min_neighbors'], minSize=min_size)
+        if len(faces):
+            return True
+    return False
+
+
+def passes_cascade(image):
+    """
+    Run the first tier on an image and count the outcome as 'cascade.rejected'
+    or 'cascade.escalated'.
+    """
+    with metrics.timer('detect.cascade'):
+        candidate = has_face_candidates(image)
+    metrics.count('cascade.escalated' if candidate else 'cascade.rejected')
+    return candidate
+
+
+def print_cascade_counts(counters):
+    """
+    Print how many images each tier of the cascade rejected, from the metrics counters.
+    """
+    rejected = counters.get('cascade.rejected', 0)
+    escalated = counters.get('cascade.escalated', 0)
+    heavy_rejected = counters.get('cascade.heavy_rejected', 0)
+    print(f"Cascade: {rejected + escalated} images, {rejected} rejected by the Haar tier, "
+          f"{escalated} escalated, {heavy_rejected} of them rejected by the heavy model.")
+
+
+def evaluate_cascade(image_paths, heavy='yolo', labels=None):
+    """
+    Measure the speed and recall of the cascade against the heavy model alone.
+
+    Every image is run through the heavy model alone and through the cascade
+    (Haar tier, then the heavy model for the candidates).
+
+    Parameters:
+    - image_paths: list of str, the sample of images.
+    - heavy: str, 'yolo' or 'mctnn'.
+    - labels: dict mapping image file name to its true number of faces, or None.
+
+    Returns:
+    - result: dict with the number of 'images', the images 'rejected' and
+      'escalated' by the Haar tier, the heavy-only and cascade seconds, the
+      'image_recall' and 'face_recall' of the cascade relative to heavy-only
+      (the share of the images and faces heavy-only finds that the cascade
+      still finds) and, with labels, the 'labelled_recall' of both.
+    """
+    from pdf_extraction.functions import detect_boxes
+
+    # Model loading is kept out of the timings
+    detectors.warm_up(heavy, 'haar')
+    result = {'images': 0, 'rejected': 0, 'escalated': 0, 'heavy_seconds': 0.0, 'cascade_seconds': 0.0}
+    heavy_images = heavy_faces = kept_images = kept_faces = 0
+    labelled = {'heavy': 0, 'cascade': 0, 'faces': 0}
+    for image_path in image_paths:
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"Skipping unreadable image {image_path}")
+            continue
+        result['images'] += 1
+
+        start = time.perf_counter()
+        boxes, _ = detect_boxes(image, heavy)
+        heavy_seconds = time.perf_counter() - start
+        result['heavy_seconds'] += heavy_seconds
+
+        start = time.perf_counter()
+        candidate = has_face_candidates(image)
+        result['cascade_seconds'] += time.perf_counter() - start
+        if candidate:
+            # The heavy model would give the same boxes again, so its time is counted rather than spent twice
+            result['escalated'] += 1
+            result['cascade_seconds'] += heavy_seconds
+        else:
+            result['rejected'] += 1
+
+        if boxes:
+            heavy_images += 1
+            heavy_faces += len(boxes)
+            if candidate:
+                kept_images += 1
+                kept_faces += len(boxes)
+        if labels is not None and labels.get(os.path.basename(image_path), 0) > 0:
+            labelled['faces'] += 1
+            labelled['heavy'] += bool(boxes)
+            labelled['cascade'] += bool(boxes) and candidate
+
+    result['image_recall'] = kept_images / heavy_images if heavy_images else None
+    result['face_recall'] = kept_faces / heavy_faces if heavy_faces else None
+    result['speedup'] = result['heavy_seconds'] / result['cascade_seconds'] if result['cascade_seconds'] else None
+    if labels is not None:
+        result['labelled_recall'] = {
+            'heavy': labelled['heavy'] / labelled['faces'] if labelled['faces'] else None,
+            'cascade': labelled['cascade'] / labelled['faces'] if labelled['faces'] else None,
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure what the cascade detector saves and misses compared with the heavy model alone.")
+    parser.add_argument('images', help="Directory with a sample of extracted images, e.g. images/.")
+    parser.add_argument('--heavy', default='yolo', choices=['yolo', 'mctnn'], help="Heavy model (default: yolo).")
+    parser.add_argument('--labels', default=None,
+                        help="CSV with 'image' and 'faces' columns giving the true number of faces per image.")
+    parser.add_argument('--sample', type=int, default=None, help="Only use the first N images, in sorted order.")
+    parser.add_argument('--weights-dir', default=None, help="Directory with pre-downloaded YOLO weights.")
+    for name, value in DEFAULT_CASCADE.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value,
+                            help=f"Cascade setting {name} (default: {value}).")
+    args = parser.parse_args(argv)
+
+    configure(**{name: getattr(args, name) for name in DEFAULT_CASCADE})
+    if args.weights_dir:
+        detectors.configure(args.weights_dir)
+    image_paths = sorted(os.path.join(args.images, f) for f in os.listdir(args.images)
+                         if f.lower().endswith(IMAGE_EXTENSIONS))[:args.sample]
+    labels = None
+    if args.labels:
+        df = pd.read_csv(args.labels, dtype={'image': str})
+        labels = dict(zip(df['image'], df['faces']))
+
+    result = evaluate_cascade(image_paths, args.heavy, labels)
+    print(json.dumps(dict(result, settings=cascade_settings()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
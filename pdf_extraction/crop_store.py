@@ -0,0 +1,291 @@
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import cv2
+
+
+DEFAULT_CROP_STORE = 'face_crops'
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+DEFAULT_QUEUE_SIZE = 256
+
+# One writer per (process, path); pool workers open their own
+_open_writers = {}
+
+
+def _connect(directory):
+    connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=60, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS crops (
+            crop_id TEXT PRIMARY KEY,
+            shard TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            source TEXT,
+            pdf TEXT,
+            page INTEGER,
+            xref INTEGER,
+            x INTEGER,
+            y INTEGER,
+            w INTEGER,
+            h INTEGER,
+            confidence REAL
+        );
+        CREATE INDEX IF NOT EXISTS crops_pdf ON crops (pdf);
+    """)
+    connection.commit()
+    return connection
+
+
+class CropShardWriter:
+    """
+    Append face crops to size-bounded shard files instead of one JPEG per face.
+
+    Crops are queued and encoded and written by a background thread, so the
+    detector does not wait on the disk; the bounded queue keeps memory flat
+    if the disk falls behind. Every process writes its own shards
+    (shard-<pid>-<n>.bin) and records each crop's shard, offset and length,
+    with its source image, PDF, page, xref, box and confidence, in a shared
+    SQLite index.
+
+    Parameters:
+    - directory: str, directory holding the shards and index.sqlite.
+    - shard_size: int, a new shard is started once a shard would grow past this many bytes.
+    - queue_size: int, number of crops that can wait to be written.
+    - batch_size: int, index rows committed at once.
+    """
+
+    def __init__(self, directory=DEFAULT_CROP_STORE, shard_size=DEFAULT_SHARD_SIZE, queue_size=DEFAULT_QUEUE_SIZE,
+                 batch_size=500):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        os.makedirs(directory, exist_ok=True)
+        self.connection = _connect(directory)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.shard = None
+        self.shard_file = None
+        self.shard_number = 0
+        self.pending = []
+        self.thread = threading.Thread(target=self._write_loop, name='crop-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, crop_id, crop, metadata=None):
+        """
+        Queue a crop to be written; blocks while the queue is full.
+
+        Parameters:
+        - crop_id: str, unique name of the crop, e.g. '1000_page1_0_face_1'.
+        - crop: numpy.ndarray (encoded as JPEG by the writer) or already encoded bytes.
+        - metadata: dict with any of 'source', 'pdf', 'page', 'xref', 'box' (x, y, w, h) and 'confidence'.
+        """
+        self._raise_error()
+        self.queue.put((crop_id, crop, metadata or {}))
+
+    def flush(self):
+        """
+        Wait until every queued crop is written and indexed.
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.connection.close()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError(f"Writing face crops failed: {error}")
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        # Skip the names left by an earlier process with the same pid
+        while True:
+            self.shard = f"shard-{os.getpid()}-{self.shard_number:05d}.bin"
+            self.shard_number += 1
+            if not os.path.exists(os.path.join(self.directory, self.shard)):
+                break
+        self.shard_file = open(os.path.join(self.directory, self.shard), 'ab')
+
+    def _write(self, crop_id, crop, metadata):
+        if isinstance(crop, bytes):
+            data = crop
+        else:
+            success, buffer = cv2.imencode('.jpg', crop)
+            if not success:
+                raise ValueError(f"Could not encode crop {crop_id}")
+            data = buffer.tobytes()
+        if self.shard_file is None or (self.shard_file.tell() and self.shard_file.tell() + len(data) > self.shard_size):
+            self._commit()
+            self._next_shard()
+        offset = self.shard_file.tell()
+        self.shard_file.write(data)
+        x, y, w, h = metadata.get('box') or (None, None, None, None)
+        self.pending.append((crop_id, self.shard, offset, len(data), metadata.get('source'), metadata.get('pdf'),
+                             metadata.get('page'), metadata.get('xref'), x, y, w, h, metadata.get('confidence')))
+        if len(self.pending) >= self.batch_size:
+            self._commit()
+
+    def _commit(self):
+        if self.shard_file is not None:
+            # The bytes must be on disk before the index points at them
+            self.shard_file.flush()
+        if self.pending:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO crops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                            self.pending)
+            self.pending = []
+
+    def _shutdown(self):
+        try:
+            self._commit()
+        finally:
+            if self.shard_file is not None:
+                self.shard_file.close()
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                # Leave the loop whatever happens, so close() joins the thread and raises the error
+                try:
+                    self._shutdown()
+                except Exception as e:
+                    if self.error is None:
+                        self.error = e
+                return
+            try:
+                if isinstance(item, threading.Event):
+                    self._commit()
+                    item.set()
+                    continue
+                if self.error is None:
+                    self._write(*item)
+            except Exception as e:
+                # Reported to the producer on its next put or flush
+                self.error = e
+                if isinstance(item, threading.Event):
+                    item.set()
+
+
+class CropShardReader:
+    """
+    Random access to the crops of a crop store by id.
+    """
+
+    def __init__(self, directory=DEFAULT_CROP_STORE):
+        self.directory = directory
+        self.connection = _connect(directory)
+        self.files = {}
+
+    def _read(self, shard, offset, length):
+        fd = self.files.get(shard)
+        if fd is None:
+            fd = self.files[shard] = os.open(os.path.join(self.directory, shard), os.O_RDONLY)
+        return os.pread(fd, length, offset)
+
+    def get(self, crop_id):
+        """
+        Returns:
+        - data: bytes, the JPEG encoded crop, or None if there is no such crop.
+        """
+        row = self.connection.execute("SELECT shard, offset, length FROM crops WHERE crop_id = ?", (crop_id,)).fetchone()
+        return None if row is None else self._read(*row)
+
+    def metadata(self, crop_id):
+        cursor = self.connection.execute("SELECT * FROM crops WHERE crop_id = ?", (crop_id,))
+        row = cursor.fetchone()
+        return None if row is None else dict(zip([c[0] for c in cursor.description], row))
+
+    def crop_ids(self, pdf=None):
+        if pdf is None:
+            rows = self.connection.execute("SELECT crop_id FROM crops ORDER BY crop_id")
+        else:
+            rows = self.connection.execute("SELECT crop_id FROM crops WHERE pdf = ? ORDER BY crop_id", (pdf,))
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM crops").fetchone()[0]
+
+    def export(self, output_directory, pdf=None):
+        """
+        Write crops out as individual <crop_id>.jpg files, as the default layout does.
+
+        Returns:
+        - count: int, number of files written.
+        """
+        os.makedirs(output_directory, exist_ok=True)
+        query = "SELECT crop_id, shard, offset, length FROM crops"
+        params = ()
+        if pdf is not None:
+            query += " WHERE pdf = ?"
+            params = (pdf,)
+        count = 0
+        # In shard order, so every shard is read front to back
+        for crop_id, shard, offset, length in self.connection.execute(query + " ORDER BY shard, offset", params):
+            with open(os.path.join(output_directory, f"{crop_id}.jpg"), 'wb') as f:
+                f.write(self._read(shard, offset, length))
+            count += 1
+        return count
+
+    def stats(self):
+        crops, data_bytes, shards = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0), COUNT(DISTINCT shard) FROM crops").fetchone()
+        return {'crops': crops, 'bytes': data_bytes, 'shards': shards}
+
+    def close(self):
+        for fd in self.files.values():
+            os.close(fd)
+        self.files = {}
+        self.connection.close()
+
+
+def open_crop_writer(path, shard_size=DEFAULT_SHARD_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Return this process's crop writer for a path, starting it on first use.
+
+    Pool workers do not run exit handlers, so callers flush() after each task.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    writer = _open_writers.get(key)
+    if writer is None:
+        writer = _open_writers[key] = CropShardWriter(path, shard_size, queue_size)
+        atexit.register(writer.close)
+    return writer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or unpack a face crop store.")
+    parser.add_argument('store', help="Crop store directory.")
+    parser.add_argument('--export', metavar='DIRECTORY', help="Write the crops out as individual JPEG files.")
+    parser.add_argument('--pdf', help="Only export the crops of this PDF.")
+    parser.add_argument('--show', metavar='CROP_ID', help="Print the metadata of a crop.")
+    args = parser.parse_args(argv)
+
+    reader = CropShardReader(args.store)
+    try:
+        if args.show:
+            print(json.dumps(reader.metadata(args.show), indent=2))
+        elif args.export:
+            print(f"Exported {reader.export(args.export, args.pdf)} crops to {args.export}")
+        else:
+            print(reader.stats())
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
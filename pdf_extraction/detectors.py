@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+from importlib import metadata
+import numpy as np
+import cv2
+
+
+# Files face_analysis() downloads into .yoloface; a local weights directory must hold the same files
+YOLO_MODEL_FILES = {
+    'tiny': ('yolov3-tiny_face.weights', 'yolov3_tiny_face.cfg'),
+    'full': ('face_detection.weights', 'face_detection.cfg'),
+}
+
+# OpenCV's bundled Haar cascades run by the first tier of the cascade methods
+HAAR_CASCADE_FILES = ('haarcascade_frontalface_default.xml', 'haarcascade_profileface.xml')
+
+# Directory with pre-downloaded YOLO weights; falls back to the YOLOFACE_WEIGHTS_DIR environment variable
+weights_dir = None
+
+_detectors = {}
+_factories = {}
+_file_hashes = {}
+_lock = threading.Lock()
+
+
+def configure(weights_directory=None):
+    """
+    Point the registry at a local directory holding the YOLO weights.
+
+    Parameters:
+    - weights_directory: str, directory containing the files listed in
+      YOLO_MODEL_FILES. When set, nothing is downloaded.
+    """
+    global weights_dir
+    weights_dir = weights_directory
+
+
+def register_detector(name, factory):
+    """
+    Register a function that builds a detector the first time it is needed.
+
+    Parameters:
+    - name: str, the detection method name (e.g. 'yolo').
+    - factory: callable taking no arguments and returning the detector.
+    """
+    _factories[name] = factory
+    _detectors.pop(name, None)
+
+
+def get_detector(name):
+    """
+    Return the detector for a method, loading it on first use.
+
+    The detector is cached for the rest of the process, so each process
+    (including every pool worker) loads a model at most once.
+
+    Parameters:
+    - name: str, the detection method name ('yolo' or 'mctnn').
+
+    Returns:
+    - detector: the loaded detector object.
+    """
+    detector = _detectors.get(name)
+    if detector is not None:
+        return detector
+    if name not in _factories:
+        raise ValueError(f"Unknown detection method: {name}")
+    with _lock:
+        if name not in _detectors:
+            _detectors[name] = _factories[name]()
+        return _detectors[name]
+
+
+def warm_up(*names):
+    """
+    Load the given detectors and run them once on a blank image.
+
+    The first inference call allocates the network buffers, so warming up
+    keeps that cost out of the timings of the first real image.
+    """
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    for name in names:
+        detector = get_detector(name)
+        if name == 'yolo':
+            detector.face_detection(frame_arr=blank, frame_status=True, model='full')
+        elif name == 'mctnn':
+            detector.detect_faces(blank)
+
+
+def release_detectors(*names):
+    """
+    Drop cached detectors so their memory can be freed.
+
+    Parameters:
+    - names: the detectors to release; all of them if none are given.
+    """
+    for name in names or list(_detectors):
+        _detectors.pop(name, None)
+
+
+def loaded_detectors():
+    return sorted(_detectors)
+
+
+def model_identity(name, weights_directory=None):
+    """
+    Describe the model a detection method runs, so results of other weights are told apart.
+
+    Parameters:
+    - name: str, the detection method name.
+    - weights_directory: str, the YOLO weights directory; defaults to the configured one.
+
+    Returns:
+    - identity: dict mapping each model file to the SHA-256 of its content, or
+      the detector package to its version when it bundles its own weights.
+    """
+    if name == 'yolo':
+        directory = weights_directory or weights_dir or os.environ.get('YOLOFACE_WEIGHTS_DIR') or '.yoloface'
+        files = [os.path.join(directory, f) for pair in YOLO_MODEL_FILES.values() for f in pair]
+        identity = {os.path.basename(path): _file_hash(path) for path in files if os.path.exists(path)}
+        return identity or {'yoloface': _package_version('yoloface')}
+    if name == 'haar':
+        return {f: _file_hash(os.path.join(cv2.data.haarcascades, f)) for f in HAAR_CASCADE_FILES}
+    if name == 'mctnn':
+        return {'mtcnn': _package_version('mtcnn')}
+    raise ValueError(f"Unknown detection method: {name}")
+
+
+def _file_hash(path):
+    # Weights are hundreds of MB, so hash each file once per process unless it changes
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as model_file:
+            for chunk in iter(lambda: model_file.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def _package_version(package):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _load_yolo():
+    from yoloface import face_analysis
+
+    directory = weights_dir or os.environ.get('YOLOFACE_WEIGHTS_DIR')
+    if not directory:
+        return face_analysis()  # Auto Download a large weight files from Google Drive.
+
+    # Build the object without its __init__, which would look for (and download) .yoloface in the cwd
+    detector = face_analysis.__new__(face_analysis)
+    for model, (weights_file, cfg_file) in YOLO_MODEL_FILES.items():
+        weights_path = os.path.join(directory, weights_file)
+        cfg_path = os.path.join(directory, cfg_file)
+        if not (os.path.exists(weights_path) and os.path.exists(cfg_path)):
+            if model == 'full':
+                raise FileNotFoundError(f"YOLO weights {weights_file} and {cfg_file} not found in {directory}")
+            continue
+        net = cv2.dnn.readNet(weights_path, cfg_path)
+        setattr(detector, f"{model}_weight_path", weights_path)
+        setattr(detector, f"{model}_cfg_path", cfg_path)
+        setattr(detector, f"{model}_net", net)
+    return detector
+
+
+def _load_mtcnn():
+    from mtcnn import MTCNN
+    return MTCNN()
+
+
+def _load_haar():
+    # Ship with opencv-python, so nothing is downloaded
+    classifiers = []
+    for cascade_file in HAAR_CASCADE_FILES:
+        classifier = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, cascade_file))
+        if classifier.empty():
+            raise FileNotFoundError(f"Haar cascade {cascade_file} not found in {cv2.data.haarcascades}")
+        classifiers.append(classifier)
+    return classifiers
+
+
+register_detector('yolo', _load_yolo)
+register_detector('mctnn', _load_mtcnn)
+register_detector('haar', _load_haar)
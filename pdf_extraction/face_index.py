@@ -0,0 +1,594 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, islice
+import cv2
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pdf_extraction.crop_store import CropShardReader
+from pipeline import metrics
+from pipeline.archives import bounded_map
+from pipeline.storage import write_table
+
+
+DEFAULT_FACE_INDEX = 'face_index'
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_BLOCK_SIZE = 65536
+# Similarities computed at once when comparing crops with each other, bounding memory to 64 MB
+PAIR_BLOCK_ENTRIES = 1 << 24
+
+# Side of the grayscale thumbnail every crop is reduced to; its pixels are the crop's vector
+THUMBNAIL_SIZE = 16
+VECTOR_DIM = THUMBNAIL_SIZE * THUMBNAIL_SIZE
+
+# Multi-index hashing: the 64-bit difference hash is split into bands of 16 bits, and crops whose
+# hashes differ in at most BAND_RADIUS bits of some band are candidates. Hashes at most
+# HASH_BANDS * (BAND_RADIUS + 1) - 1 = 7 bits apart therefore always are.
+HASH_BANDS = 4
+BAND_RADIUS = 1
+# Candidates whose hashes differ in more bits are not compared; near duplicates differ in a few
+MAX_HAMMING = 12
+# Crops sharing a band value with more others than this, e.g. blank or uniform crops, are not paired
+# through that band; MAX_BUCKET_SIZE ** 2 candidate pairs fit in one CANDIDATE_BLOCK
+MAX_BUCKET_SIZE = 2048
+CANDIDATE_BLOCK = MAX_BUCKET_SIZE ** 2
+# Candidate pairs whose vectors are gathered at once, bounding memory to 2 x 64 MB
+VECTOR_PAIR_BLOCK = 1 << 16
+
+CROP_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def crop_descriptor(image):
+    """
+    Describe a face crop compactly enough to compare millions of them.
+
+    Parameters:
+    - image: numpy.ndarray, the BGR or grayscale crop.
+
+    Returns:
+    - dhash: int, 64-bit difference hash of a 9x8 thumbnail; near-identical
+      crops differ in a few bits.
+    - vector: numpy.ndarray of VECTOR_DIM float32, the 16x16 grayscale
+      thumbnail with its mean removed and scaled to unit length, so the dot
+      product of two vectors is their correlation, whatever the brightness
+      and contrast of the crops.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = int(np.packbits(small[:, 1:] > small[:, :-1]).view('>u8')[0])
+    vector = cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return dhash, vector
+
+
+def load_crop(item):
+    """
+    Decode a face crop the way the index describes it, so queries and indexed
+    crops get the same hashes and vectors.
+
+    Parameters:
+    - item: str path or encoded bytes.
+
+    Returns:
+    - image: numpy.ndarray, the grayscale crop (JPEGs decode faster in grayscale), or None.
+    """
+    if isinstance(item, bytes):
+        return cv2.imdecode(np.frombuffer(item, np.uint8), cv2.IMREAD_GRAYSCALE)
+    return cv2.imread(item, cv2.IMREAD_GRAYSCALE)
+
+
+def _ranges(counts):
+    # np.arange(count) for every count, concatenated
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def _segment_pairs(a_starts, a_counts, b_starts, b_counts, same):
+    # Every pair of positions of segment a with segment b; with same, a and b are one segment, each pair once
+    left = np.repeat(a_starts, a_counts) + _ranges(a_counts)
+    if same:
+        right_starts = left + 1
+        right_counts = np.repeat(a_starts + a_counts, a_counts) - right_starts
+    else:
+        right_starts, right_counts = np.repeat(b_starts, a_counts), np.repeat(b_counts, a_counts)
+    return np.repeat(left, right_counts), np.repeat(right_starts, right_counts) + _ranges(right_counts)
+
+
+def _describe(items):
+    # Runs in the pool workers: items are (path or encoded bytes)
+    descriptors = []
+    for item in items:
+        image = load_crop(item)
+        if image is None or image.size == 0:
+            descriptors.append(None)
+            continue
+        dhash, vector = crop_descriptor(image)
+        descriptors.append((image.shape[1], image.shape[0], dhash, vector))
+    return descriptors
+
+
+class FaceIndex:
+    """
+    Descriptors of face crops in contiguous memory-mapped matrices.
+
+    Row i of vectors.f32 (float32, VECTOR_DIM columns) and hashes.u64
+    (uint64) describe the crop in row i of the crops table of index.sqlite,
+    which records its source (a faces directory or a crop store), its crop
+    id and its size. Queries read the matrices block by block through a
+    memory map, so the index can be far larger than memory and no crop is
+    decoded again once it is indexed.
+
+    Rows are appended; the matrices are written and flushed before the
+    table refers to them, so an interrupted build leaves at most some
+    unreferenced rows, which the next build overwrites.
+    """
+
+    def __init__(self, directory=DEFAULT_FACE_INDEX):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vector_path = os.path.join(directory, 'vectors.f32')
+        self.hash_path = os.path.join(directory, 'hashes.u64')
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=60)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS crops (
+                row INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                crop_id TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                UNIQUE (source, crop_id)
+            );
+        """)
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM crops").fetchone()[0]
+
+    def indexed(self, source):
+        """
+        Returns:
+        - crop_ids: set of str, the crops of a source already in the index.
+        """
+        return {row[0] for row in self.connection.execute("SELECT crop_id FROM crops WHERE source = ?", (source,))}
+
+    def add(self, source, crop_ids, descriptors):
+        """
+        Append the descriptors of crops of a source.
+
+        Parameters:
+        - source: str, the faces directory or crop store the crops come from.
+        - crop_ids: list of str, their ids within the source.
+        - descriptors: list of (width, height, dhash, vector), as built by _describe.
+        """
+        if not crop_ids:
+            return
+        start = len(self)
+        vectors = np.stack([d[3] for d in descriptors]).astype(np.float32)
+        hashes = np.array([d[2] for d in descriptors], dtype=np.uint64)
+        for path, data in ((self.vector_path, vectors), (self.hash_path, hashes)):
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                # Past the last referenced row, overwriting any left by an interrupted build
+                f.truncate(start * data.itemsize * (data.shape[1] if data.ndim == 2 else 1))
+                f.seek(0, os.SEEK_END)
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        with self.connection:
+            self.connection.executemany("INSERT INTO crops VALUES (?, ?, ?, ?, ?)",
+                                        [(start + i, source, crop_id, d[0], d[1])
+                                         for i, (crop_id, d) in enumerate(zip(crop_ids, descriptors))])
+
+    def vectors(self):
+        """
+        Returns:
+        - vectors: read-only numpy.memmap of shape (len(self), VECTOR_DIM).
+        """
+        count = len(self)
+        if not count:
+            return np.zeros((0, VECTOR_DIM), dtype=np.float32)
+        return np.memmap(self.vector_path, dtype=np.float32, mode='r', shape=(count, VECTOR_DIM))
+
+    def hashes(self):
+        count = len(self)
+        if not count:
+            return np.zeros(0, dtype=np.uint64)
+        return np.memmap(self.hash_path, dtype=np.uint64, mode='r', shape=(count,))
+
+    def crops(self):
+        """
+        Returns:
+        - crops: pandas.DataFrame with the 'source', 'crop_id', 'width' and 'height' of every row.
+        """
+        return pd.read_sql_query("SELECT source, crop_id, width, height FROM crops ORDER BY row", self.connection)
+
+    def remove_missing(self, present):
+        """
+        Drop the crops that no longer exist and compact the matrices.
+
+        Parameters:
+        - present: dict mapping source to the set of its crop ids that still
+          exist; the crops of other sources are kept.
+
+        Returns:
+        - removed: int, number of crops dropped.
+        """
+        crops = self.crops()
+        keep = np.array([source not in present or crop_id in present[source]
+                         for source, crop_id in zip(crops['source'], crops['crop_id'])], dtype=bool)
+        removed = int((~keep).sum())
+        if not removed:
+            return 0
+        rows = np.flatnonzero(keep)
+        vectors, hashes = self.vectors(), self.hashes()
+        for path, data in ((self.vector_path, vectors), (self.hash_path, hashes)):
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                for start in range(0, len(rows), DEFAULT_BLOCK_SIZE):
+                    f.write(np.ascontiguousarray(data[rows[start:start + DEFAULT_BLOCK_SIZE]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        del vectors, hashes
+        kept = crops[keep]
+        with self.connection:
+            self.connection.execute("DELETE FROM crops")
+            self.connection.executemany("INSERT INTO crops VALUES (?, ?, ?, ?, ?)",
+                                        [(i, row.source, row.crop_id, int(row.width), int(row.height))
+                                         for i, row in enumerate(kept.itertuples(index=False))])
+            os.replace(self.vector_path + '.tmp', self.vector_path)
+            os.replace(self.hash_path + '.tmp', self.hash_path)
+        return removed
+
+    def search(self, queries, k=10, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Find the k most similar indexed crops of every query.
+
+        The similarities are computed as one matrix product per block of
+        block_size rows, keeping a running top k, so memory is bounded by
+        the block and not the index.
+
+        Parameters:
+        - queries: numpy.ndarray of shape (m, VECTOR_DIM), vectors from crop_descriptor.
+        - k: int, number of neighbours.
+
+        Returns:
+        - rows: numpy.ndarray of shape (m, k), the rows of the neighbours, most similar first.
+        - similarities: numpy.ndarray of shape (m, k), their correlation with the query.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        vectors = self.vectors()
+        k = min(k, len(vectors))
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best = np.zeros((len(queries), 0), dtype=np.float32)
+        with metrics.timer('index.search'):
+            for start in range(0, len(vectors), block_size):
+                block = np.asarray(vectors[start:start + block_size])
+                similarities = np.concatenate([best, queries @ block.T], axis=1)
+                rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)),
+                                                                  (len(queries), len(block)))], axis=1)
+                if similarities.shape[1] > k:
+                    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+                    similarities = np.take_along_axis(similarities, top, axis=1)
+                    rows = np.take_along_axis(rows, top, axis=1)
+                best, best_rows = similarities, rows
+        order = np.argsort(-best, axis=1, kind='stable')
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+    @staticmethod
+    def _candidate_pairs(hashes, oversized):
+        """
+        Pairs of rows whose hashes differ in at most BAND_RADIUS bits of some band.
+
+        Per band, the rows are sorted by their band value; rows with equal
+        values form a segment, and segments whose values differ in at most
+        BAND_RADIUS bits are paired, found by binary search of the flipped
+        values. The pairs come out CANDIDATE_BLOCK at a time at most, so
+        memory stays bounded; a pair may come out of several bands.
+
+        Parameters:
+        - hashes: numpy.ndarray of uint64.
+        - oversized: set, filled with the rows of segments larger than
+          MAX_BUCKET_SIZE, which are not paired through that band.
+
+        Yields:
+        - (rows_a, rows_b): numpy.ndarrays of the rows of the pairs.
+        """
+        band_bits = 64 // HASH_BANDS
+        masks = np.array([sum(1 << bit for bit in bits) for radius in range(1, BAND_RADIUS + 1)
+                          for bits in combinations(range(band_bits), radius)], dtype=np.uint64)
+        for band in range(HASH_BANDS):
+            values = (hashes >> np.uint64(band * band_bits)) & np.uint64((1 << band_bits) - 1)
+            order = np.argsort(values, kind='stable')
+            keys, starts, counts = np.unique(values[order], return_index=True, return_counts=True)
+            large = counts > MAX_BUCKET_SIZE
+            for start, count in zip(starts[large], counts[large]):
+                oversized.update(order[start:start + count].tolist())
+            same = (counts > 1) & ~large
+            segments = [(starts[same], counts[same], starts[same], counts[same], True)]
+            for mask in masks:
+                neighbours = keys ^ mask
+                positions = np.minimum(np.searchsorted(keys, neighbours), len(keys) - 1)
+                # Each pair of segments once, from the lower value
+                found = (keys[positions] == neighbours) & (neighbours > keys) & ~large & ~large[positions]
+                positions = positions[found]
+                segments.append((starts[found], counts[found], starts[positions], counts[positions], False))
+            for a_starts, a_counts, b_starts, b_counts, same in segments:
+                work = a_counts * (a_counts - 1) // 2 if same else a_counts * b_counts
+                done = np.cumsum(work)
+                first = 0
+                while first < len(work):
+                    # As many segments as fit in a block, at least one
+                    last = max(first + 1, int(np.searchsorted(done, done[first] - work[first] + CANDIDATE_BLOCK,
+                                                              side='right')))
+                    i, j = _segment_pairs(a_starts[first:last], a_counts[first:last],
+                                          b_starts[first:last], b_counts[first:last], same)
+                    yield order[i], order[j]
+                    first = last
+
+    @staticmethod
+    def _similar_pairs(vectors, rows_a, rows_b, threshold, same):
+        # Pairs of rows_a and rows_b (sorted) at least threshold alike; with same, each pair once
+        b = np.asarray(vectors[rows_b])
+        step = max(1, PAIR_BLOCK_ENTRIES // len(rows_b))
+        for start in range(0, len(rows_a), step):
+            block = rows_a[start:start + step]
+            similarities = np.asarray(vectors[block]) @ b.T
+            i, j = np.nonzero(similarities >= threshold)
+            if same:
+                keep = block[i] < rows_b[j]
+                i, j = i[keep], j[keep]
+            yield block[i], rows_b[j]
+
+    @staticmethod
+    def _similar_candidate_pairs(vectors, hashes, rows_a, rows_b, threshold):
+        # Candidate pairs whose hashes are close, then whose vectors are at least threshold alike
+        close = np.bitwise_count(hashes[rows_a] ^ hashes[rows_b]) <= MAX_HAMMING
+        rows_a, rows_b = rows_a[close], rows_b[close]
+        for start in range(0, len(rows_a), VECTOR_PAIR_BLOCK):
+            a, b = rows_a[start:start + VECTOR_PAIR_BLOCK], rows_b[start:start + VECTOR_PAIR_BLOCK]
+            similarities = np.einsum('ij,ij->i', np.asarray(vectors[a]), np.asarray(vectors[b]))
+            keep = similarities >= threshold
+            yield a[keep], b[keep]
+
+    def duplicate_groups(self, threshold=DEFAULT_THRESHOLD, exhaustive=False, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Cluster the crops whose vectors correlate by at least threshold.
+
+        By default only crops whose difference hashes come within
+        BAND_RADIUS bits in one of HASH_BANDS 16-bit bands and differ in at
+        most MAX_HAMMING bits are compared; near duplicates almost always
+        qualify. With hashes spread evenly, a 16-bit band splits the crops
+        into 65,536 buckets, so the comparisons grow with the square of the
+        number of crops divided by 65,536 rather than the square itself.
+        Crops in buckets larger than MAX_BUCKET_SIZE, such as blank crops
+        with identical hashes, are only compared through their other bands
+        and are reported. exhaustive compares every pair with blockwise
+        matrix products instead, which finds every pair above the threshold
+        but takes time quadratic in the number of crops.
+
+        Returns:
+        - groups: numpy.ndarray with the group of every row, the lowest row of
+          its group; rows whose group is their own row have no duplicate.
+        """
+        count = len(self)
+        vectors = self.vectors()
+        parent = np.arange(count)
+
+        def find(row):
+            root = row
+            while parent[root] != root:
+                root = parent[root]
+            while parent[row] != root:
+                parent[row], row = root, parent[row]
+            return root
+
+        with metrics.timer('index.dedup'):
+            if exhaustive:
+                all_rows = np.arange(count)
+                blocks = [all_rows[start:start + block_size] for start in range(0, count, block_size)]
+                pairs = (pair for a in range(len(blocks)) for b in range(a, len(blocks))
+                         for pair in self._similar_pairs(vectors, blocks[a], blocks[b], threshold, a == b))
+            else:
+                hashes = np.asarray(self.hashes())
+                oversized = set()
+                pairs = (pair for rows_a, rows_b in self._candidate_pairs(hashes, oversized)
+                         for pair in self._similar_candidate_pairs(vectors, hashes, rows_a, rows_b, threshold))
+            for rows_a, rows_b in pairs:
+                for a, b in zip(rows_a.tolist(), rows_b.tolist()):
+                    root_a, root_b = find(a), find(b)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+            if not exhaustive and oversized:
+                metrics.count('index.oversized', len(oversized))
+                print(f"Warning: {len(oversized)} crops share a hash band with more than {MAX_BUCKET_SIZE} others "
+                      f"(e.g. blank crops) and were not compared through it; --exhaustive compares every pair.")
+        return np.array([find(row) for row in range(count)], dtype=np.int64)
+
+    def close(self):
+        self.connection.close()
+
+
+def _iter_chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_face_index(index_directory, face_directories=(), crop_store_path=None, workers=1, chunk_size=256):
+    """
+    Index the crops of faces directories and a crop store, skipping those already indexed.
+
+    Crops that were deleted since the last build are dropped from the index.
+
+    Parameters:
+    - index_directory: str, the FaceIndex directory.
+    - face_directories: list of str, directories of crop JPEGs, e.g. faces/ and faces_2/.
+    - crop_store_path: str, a crop store (see crop_store.py), or None.
+    - workers: int, processes decoding and describing the crops.
+    - chunk_size: int, crops per task.
+
+    Returns:
+    - counts: dict with the number of crops 'added', 'removed', 'unreadable' and in the index ('total').
+    """
+    index = FaceIndex(index_directory)
+    # Sources are recorded as normalised paths, so faces/ and faces are the same source
+    face_directories = [os.path.normpath(directory) for directory in face_directories]
+    if crop_store_path:
+        crop_store_path = os.path.normpath(crop_store_path)
+    reader = CropShardReader(crop_store_path) if crop_store_path else None
+    sources = []
+    present = {}
+    for directory in face_directories:
+        if os.path.isdir(directory):
+            present[directory] = {f for f in os.listdir(directory) if f.lower().endswith(CROP_EXTENSIONS)}
+            sources.append(directory)
+    if reader is not None:
+        present[crop_store_path] = set(reader.crop_ids())
+        sources.append(crop_store_path)
+    counts = {'added': 0, 'removed': index.remove_missing(present), 'unreadable': 0}
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for source in sources:
+            todo = sorted(present[source] - index.indexed(source))
+            if source == crop_store_path:
+                load = reader.get
+            else:
+                load = lambda crop_id, source=source: os.path.join(source, crop_id)
+            # Crop store crops are read here and decoded by the workers
+            chunks = ([load(crop_id) for crop_id in chunk] for chunk in _iter_chunks(todo, chunk_size))
+            if executor is None:
+                results = map(_describe, chunks)
+            else:
+                results = bounded_map(lambda chunk: executor.submit(_describe, chunk), chunks, 2 * workers)
+            for crop_ids, descriptors in zip(_iter_chunks(todo, chunk_size), results):
+                with metrics.timer('index.add'):
+                    described = [(crop_id, d) for crop_id, d in zip(crop_ids, descriptors) if d is not None]
+                    index.add(source, [crop_id for crop_id, _ in described], [d for _, d in described])
+                counts['added'] += len(described)
+                counts['unreadable'] += len(crop_ids) - len(described)
+                metrics.count('index.crops', len(described))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if reader is not None:
+            reader.close()
+    counts['total'] = len(index)
+    index.close()
+    return counts
+
+
+def deduplicate_faces(index_directory, output_path, threshold=DEFAULT_THRESHOLD, exhaustive=False, unique_directory=None):
+    """
+    Group near-duplicate crops and write a table of the groups.
+
+    The largest crop of every group, the one with the most detail, is its
+    representative; the others are marked as duplicates of it.
+
+    Parameters:
+    - index_directory: str, the FaceIndex directory.
+    - output_path: str, table with the 'source', 'crop_id', 'width',
+      'height', 'representative' (source/crop_id of the group's
+      representative), 'group_size' and 'duplicate' of every crop.
+    - threshold: float, minimum correlation of the thumbnails of two duplicates.
+    - exhaustive: bool, compare every pair (see FaceIndex.duplicate_groups).
+    - unique_directory: str, also copy the representatives there, under the
+      name of their source (e.g. unique/faces/<crop>.jpg), or None.
+
+    Returns:
+    - df: pandas.DataFrame, the table written to output_path.
+    """
+    index = FaceIndex(index_directory)
+    try:
+        df = index.crops()
+        groups = index.duplicate_groups(threshold, exhaustive)
+    finally:
+        index.close()
+    df['row'] = np.arange(len(df))
+    df['area'] = df['width'] * df['height']
+    df['group_row'] = groups
+    # Largest crop first, then the first indexed
+    representatives = df.sort_values(['group_row', 'area', 'row'], ascending=[True, False, True]) \
+        .drop_duplicates('group_row').set_index('group_row')['row']
+    representative_rows = df['group_row'].map(representatives).to_numpy()
+    paths = np.array([os.path.join(source, crop_id) for source, crop_id in zip(df['source'], df['crop_id'])], dtype=object)
+    df['representative'] = paths[representative_rows]
+    df['group_size'] = df.groupby('group_row')['row'].transform('size')
+    df['duplicate'] = df['row'].to_numpy() != representative_rows
+    df = df[['source', 'crop_id', 'width', 'height', 'representative', 'group_size', 'duplicate']]
+    write_table(df, output_path)
+
+    if unique_directory is not None:
+        readers = {}
+        try:
+            for source, crop_id in zip(df['source'][~df['duplicate']], df['crop_id'][~df['duplicate']]):
+                directory = os.path.join(unique_directory, os.path.basename(os.path.normpath(source)))
+                os.makedirs(directory, exist_ok=True)
+                if os.path.isfile(os.path.join(source, crop_id)):
+                    shutil.copyfile(os.path.join(source, crop_id), os.path.join(directory, crop_id))
+                    continue
+                # A crop store
+                reader = readers.get(source) or readers.setdefault(source, CropShardReader(source))
+                with open(os.path.join(directory, f"{crop_id}.jpg"), 'wb') as f:
+                    f.write(reader.get(crop_id))
+        finally:
+            for reader in readers.values():
+                reader.close()
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index face crops to find near duplicates and similar faces.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Add new crops to the index and drop deleted ones.")
+    build.add_argument('index', help="Index directory, e.g. face_index.")
+    build.add_argument('--faces', nargs='*', default=[], help="Directories of crop JPEGs, e.g. faces/ faces_2/.")
+    build.add_argument('--crop-store', default=None, help="Crop store to index as well.")
+    build.add_argument('--workers', type=int, default=1, help="Processes describing the crops (default: 1).")
+    query = subparsers.add_parser('query', help="List the indexed crops most similar to an image.")
+    query.add_argument('index', help="Index directory.")
+    query.add_argument('image', help="Face crop to look up.")
+    query.add_argument('-k', type=int, default=10, help="Number of neighbours (default: 10).")
+    dedup = subparsers.add_parser('dedup', help="Group near-duplicate crops.")
+    dedup.add_argument('index', help="Index directory.")
+    dedup.add_argument('--output', default='face_duplicates.csv', help="Table of the groups (default: face_duplicates.csv).")
+    dedup.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                       help=f"Minimum correlation of two duplicates' thumbnails (default: {DEFAULT_THRESHOLD}).")
+    dedup.add_argument('--exhaustive', action='store_true',
+                       help="Compare every pair of crops instead of those with similar hashes; quadratic in the number of crops.")
+    dedup.add_argument('--unique', default=None, metavar='DIRECTORY', help="Copy one crop per group to this directory.")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        print(build_face_index(args.index, args.faces, args.crop_store, args.workers))
+    elif args.command == 'query':
+        image = load_crop(args.image)
+        if image is None:
+            print(f"Error: could not read {args.image}")
+            return
+        index = FaceIndex(args.index)
+        try:
+            rows, similarities = index.search(crop_descriptor(image)[1][None], args.k)
+            crops = index.crops()
+        finally:
+            index.close()
+        for row, similarity in zip(rows[0], similarities[0]):
+            print(f"{similarity:.3f}  {os.path.join(crops['source'][row], crops['crop_id'][row])}")
+    else:
+        df = deduplicate_faces(args.index, args.output, args.threshold, args.exhaustive, args.unique)
+        print(f"{len(df)} crops in {(~df['duplicate']).sum()} groups, {df['duplicate'].sum()} duplicates; "
+              f"groups saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,45 @@
 import os
 import cv2
+import numpy as np
 import pandas as pd
-from collections import defaultdict
+from collections import Counter
 import zipfile
 import cv2
-from yoloface import face_analysis
-from mtcnn import MTCNN
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 import fitz  # PyMuPDF
 
 
 import sys
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from pdf_extraction import detectors
+from pdf_extraction.cache import open_cache, image_hash, DEFAULT_MAX_ENTRIES
+from pdf_extraction import cascade
+from pdf_extraction.cascade import CASCADE_METHODS, cascade_settings, passes_cascade
+from pdf_extraction.crop_store import open_crop_writer, CropShardReader
+from pdf_extraction.image_store import open_image_store
+from pdf_extraction.job_queue import JobQueue, keep_leases, default_worker_id, DEFAULT_LEASE_SECONDS
+from pdf_extraction.manifest import load_manifest, pdf_fingerprint, is_up_to_date, ManifestWriter, compact_manifest, manifest_results
+from pdf_extraction.prefilter import prefilter_image, print_skip_counts
+from pdf_extraction.resolution import inference_views, merge_view_boxes, resolution_key
+from pipeline import metrics
+from pipeline.archives import iter_archived_files, prefetch, bounded_map, DEFAULT_PREFETCH
+from pipeline.storage import read_table, write_table
 
 
+
+# Extensions save_image_without_conversion accepts; images of any other type are skipped
+VALID_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
+
+# Image decoders: 'bytes' decodes what extract_image returns with OpenCV, 'pixmap' lets PyMuPDF decode every xref
+DECODERS = ('bytes', 'pixmap')
+
+# Extension extract_image reports for images stored with these PDF filters; the others come out as PNG
+FILTER_EXTENSIONS = {'DCTDecode': 'jpeg', 'JPXDecode': 'jpx', 'JBIG2Decode': 'jb2'}
+
 def ensure_directories(*directories):
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
@@ -26,29 +52,277 @@ def save_image_without_conversion(image_path, output_path):
         return False
 
     # Ensure output path has a valid extension
-    valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
-    if not any(output_path.lower().endswith(ext) for ext in valid_extensions):
+    if not any(output_path.lower().endswith(ext) for ext in VALID_IMAGE_EXTENSIONS):
         print(f"Error: Output path {output_path} does not have a valid image extension.")
         return False
 
     # Save the image as is
-    success = cv2.imwrite(output_path, image)
+    with metrics.timer('image.write'):
+        success = cv2.imwrite(output_path, image)
     if not success:
         print(f"Error: Could not write image to {output_path}")
         return False
     else:
-        print(f"Saved image to {output_path}")
+        metrics.log(f"Saved image to {output_path}")
         return True
 
-def process_pdfs(pdf_directory, image_directory, face_directory, detection_method):
-    pdf_files = [f for f in os.listdir(pdf_directory) if f.endswith('.pdf')]
-    results = []
+def decode_image(image_bytes, image_ext=None):
+    """
+    Decode encoded image bytes (as returned by PyMuPDF) into a BGR array.
 
-    for pdf_file in pdf_files:
+    save_image_without_conversion re-encodes every image in its own format
+    before detection. That is lossless except for JPEG, so JPEGs go through
+    the same encode round trip in memory and the detector sees the same pixels.
+
+    Parameters:
+    - image_bytes: bytes, the encoded image.
+    - image_ext: str, the image extension reported by PyMuPDF.
+
+    Returns:
+    - image: numpy.ndarray or None if the bytes could not be decoded.
+    """
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    if image_ext is not None and image_ext.lower() in ('jpg', 'jpeg'):
+        image = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            return None
+        success, buffer = cv2.imencode('.' + image_ext.lower(), image)
+        if not success:
+            return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def pixmap_to_array(pdf_document, xref, smask=0):
+    """
+    Decode an image of a PDF with PyMuPDF into a BGR array.
+
+    PyMuPDF decodes every filter it supports (JPEG, JPX, JBIG2, CCITT, Flate)
+    and colorspace (CMYK, Indexed, Lab, ...) and applies the soft mask, so
+    images cv2.imread cannot read are covered too. The pixmap samples are
+    viewed by NumPy without a copy; the only copy is the conversion to the
+    contiguous BGR array the detectors expect. Transparent images are
+    composited onto white, as they appear on the page.
+
+    Parameters:
+    - pdf_document: fitz.Document the image belongs to.
+    - xref: int, the image's xref.
+    - smask: int, xref of its soft mask, or 0.
+
+    Returns:
+    - image: numpy.ndarray, the BGR image.
+    """
+    pix = fitz.Pixmap(pdf_document, xref)
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        # CMYK, Lab and other colorspaces are converted by MuPDF
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    if smask and not pix.alpha:
+        mask = fitz.Pixmap(pdf_document, smask)
+        if (mask.width, mask.height) == (pix.width, pix.height):
+            pix = fitz.Pixmap(pix, mask)
+    samples = np.ndarray((pix.height, pix.width, pix.n), dtype=np.uint8, buffer=pix.samples_mv,
+                         strides=(pix.stride, pix.n, 1))
+    if pix.alpha:
+        alpha = samples[:, :, -1:].astype(np.float32) / 255
+        samples = (samples[:, :, :-1] * alpha + 255 * (1 - alpha)).round().astype(np.uint8)
+    if samples.shape[2] == 1:
+        return cv2.cvtColor(samples, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(samples, cv2.COLOR_RGB2BGR)
+
+def iter_decoded_images(pdf_path, image_directory=None, prefilter=None, skip_counts=None, image_store=None, sources=None, stream=None, decoder='bytes'):
+    """
+    Yield the images of a PDF decoded into arrays, without writing them to disk.
+
+    With the 'bytes' decoder, only formats the on-disk path could convert are
+    yielded, so face counts match it. With the 'pixmap' decoder, PyMuPDF
+    decodes every image (see pixmap_to_array), including JPX, JBIG2, CMYK,
+    Indexed and soft-masked ones. If image_directory is given the raw images
+    are saved there too.
+
+    Yields:
+    - (image_name, image): the extracted image name and its BGR array.
+    """
+    pixmaps = decoder == 'pixmap'
+    for item in iter_images_from_pdf(pdf_path, prefilter, skip_counts, image_store, sources, stream,
+                                     pixmaps=pixmaps, keep_bytes=image_directory is not None):
+        image_name, image_bytes, image_ext = item[:3]
+        if image_directory is not None:
+            with metrics.timer('image.write'):
+                with open(os.path.join(image_directory, image_name), "wb") as image_file:
+                    image_file.write(image_bytes)
+
+        if pixmaps:
+            image = item[3]
+        elif "." + image_ext.lower() not in VALID_IMAGE_EXTENSIONS:
+            metrics.log(f"Skipping image {image_name} due to unsupported format.")
+            metrics.count('images.unsupported')
+            continue
+        else:
+            with metrics.timer('image.decode'):
+                image = decode_image(image_bytes, image_ext)
+        if image is None:
+            print(f"Error decoding image {image_name}")
+            metrics.count('errors.decode')
+            continue
+        yield image_name, image
+
+def process_pdf_in_memory(pdf_path, face_directory, detection_method, image_directory=None, cache=None, prefilter=None, skip_counts=None, resolution=None, image_store=None, crop_sink=None, stream=None, decoder='bytes'):
+    """
+    Detect faces in every image of a PDF without writing the images to disk.
+
+    The image bytes from PyMuPDF are decoded straight into arrays and handed to
+    the detector, so only the face crops are written. If image_directory is
+    given the raw images are saved there as well.
+
+    Returns:
+    - total_faces: int, number of faces detected in the PDF.
+    """
+    total_faces = 0
+    sources = {}
+    for image_name, image in iter_decoded_images(pdf_path, image_directory, prefilter, skip_counts, image_store, sources,
+                                                 stream, decoder):
+        total_faces += detect_faces(image_name, face_directory, method=detection_method, image=image, cache=cache,
+                                    resolution=resolution, crop_sink=crop_sink, source=sources.get(image_name))
+    return total_faces
+
+def process_pdf_group(pdf_files, pdf_directory, image_directory, face_directory, detection_method, save_images=False, batch_size=16, cache_path=None, cache_size=DEFAULT_MAX_ENTRIES, prefilter=None, resolution=None, image_store_path=None, crop_store_path=None, streams=None, decoder='bytes'):
+    """
+    Process several PDFs in memory, batching their images for detection.
+
+    Images are queued across pages and PDFs and sent to detect_faces_batch
+    whenever batch_size of them are pending. streams optionally holds the
+    bytes of each PDF, read from an archive instead of pdf_directory.
+
+    Returns:
+    - rows: list of dicts in the same format as process_pdf, in input order.
+    """
+    with metrics.collect() as group_metrics:
+        with group_metrics.timer('pdf_group'):
+            rows = _process_pdf_group(pdf_files, pdf_directory, image_directory, face_directory, detection_method,
+                                      save_images, batch_size, cache_path, cache_size, prefilter, resolution,
+                                      image_store_path, crop_store_path, streams, decoder)
+            _save_task_outputs(rows, crop_store_path, cache_path, cache_size)
+        group_metrics.count('pdfs', len(rows))
+        group_metrics.count('errors.pdf', sum('Error' in row for row in rows))
+    if rows:
+        rows[0]["_metrics"] = group_metrics.snapshot()
+    return rows
+
+def _process_pdf_group(pdf_files, pdf_directory, image_directory, face_directory, detection_method, save_images, batch_size, cache_path, cache_size, prefilter, resolution, image_store_path, crop_store_path, streams, decoder):
+    totals = {pdf_file: 0 for pdf_file in pdf_files}
+    errors = {}
+    pending = []
+    sources = {}
+    cache = open_cache(cache_path, cache_size) if cache_path else None
+    image_store = open_image_store(image_store_path) if image_store_path else None
+    crop_sink = open_crop_writer(crop_store_path) if crop_store_path else None
+    skip_counts = Counter()
+
+    def flush():
+        try:
+            counts = detect_faces_batch([(name, image) for _, name, image in pending],
+                                        face_directory, method=detection_method, batch_size=batch_size,
+                                        cache=cache, resolution=resolution, crop_sink=crop_sink,
+                                        sources=[sources.get(name) for _, name, _ in pending])
+            for (pdf_file, _, _), count in zip(pending, counts):
+                totals[pdf_file] += count
+        except Exception as e:
+            print(f"Error detecting faces in batch: {e}")
+            for pdf_file, _, _ in pending:
+                errors.setdefault(pdf_file, str(e))
+        pending.clear()
+
+    if streams is None:
+        streams = [None] * len(pdf_files)
+    for pdf_file, stream in zip(pdf_files, streams):
         pdf_path = os.path.join(pdf_directory, pdf_file)
-        extract_images_from_pdf(pdf_path, image_directory)
+        try:
+            for image_name, image in iter_decoded_images(pdf_path, image_directory if save_images else None,
+                                                         prefilter, skip_counts, image_store, sources, stream,
+                                                         decoder):
+                pending.append((pdf_file, image_name, image))
+                if len(pending) >= batch_size:
+                    flush()
+        except Exception as e:
+            print(f"Error processing {pdf_file}: {e}")
+            errors[pdf_file] = str(e)
+    flush()
+
+    rows = []
+    for pdf_file in pdf_files:
+        if pdf_file in errors:
+            rows.append({"PDF_File": pdf_file, "Number_of_Faces": 0, "Error": errors[pdf_file]})
+        else:
+            rows.append({"PDF_File": pdf_file, "Number_of_Faces": totals[pdf_file]})
+    if rows and skip_counts:
+        # Handed back to iter_process_pdfs, which adds them up and drops the key
+        rows[0]["_skipped"] = dict(skip_counts)
+    return rows
+
+def _save_task_outputs(rows, crop_store_path, cache_path, cache_size):
+    # Pool workers exit without running exit handlers, so the crops and cache counts are saved per task
+    if crop_store_path:
+        try:
+            open_crop_writer(crop_store_path).flush()
+        except Exception as e:
+            # The crops of these PDFs may be lost; as failed rows, the manifest or queue retries them
+            print(f"Error writing face crops: {e}")
+            for row in rows:
+                row.setdefault("Error", str(e))
+    if cache_path:
+        try:
+            open_cache(cache_path, cache_size).save_counters()
+        except Exception as e:
+            # The counts stay in memory and are saved with the next task
+            print(f"Error saving the detection cache counters: {e}")
+
+def process_pdf(pdf_file, pdf_directory, image_directory, face_directory, detection_method, in_memory=False, save_images=False, cache_path=None, cache_size=DEFAULT_MAX_ENTRIES, prefilter=None, resolution=None, image_store_path=None, crop_store_path=None, stream=None, decoder='bytes'):
+    """
+    Extract the images of a single PDF and count the faces in them.
+
+    The PDF is read from pdf_directory, or from stream, its bytes as read
+    from an archive.
+
+    Errors are caught and reported in the returned row so one broken PDF does
+    not abort a whole batch.
+
+    Returns:
+    - row: dict with 'PDF_File' and 'Number_of_Faces' (and 'Error' on failure).
+    """
+    with metrics.collect() as pdf_metrics:
+        with pdf_metrics.timer('pdf'):
+            row = _process_pdf(pdf_file, pdf_directory, image_directory, face_directory, detection_method,
+                               in_memory, save_images, cache_path, cache_size, prefilter, resolution,
+                               image_store_path, crop_store_path, stream, decoder)
+            _save_task_outputs([row], crop_store_path, cache_path, cache_size)
+        pdf_metrics.count('pdfs')
+        if 'Error' in row:
+            pdf_metrics.count('errors.pdf')
+    # Handed back to iter_process_pdfs like the skip counts
+    row["_metrics"] = pdf_metrics.snapshot()
+    return row
 
-        image_files = [f for f in os.listdir(image_directory) if f.startswith(os.path.splitext(pdf_file)[0])]
+def _process_pdf(pdf_file, pdf_directory, image_directory, face_directory, detection_method, in_memory, save_images, cache_path, cache_size, prefilter, resolution, image_store_path, crop_store_path, stream, decoder):
+    pdf_path = os.path.join(pdf_directory, pdf_file)
+    skip_counts = Counter()
+    try:
+        cache = open_cache(cache_path, cache_size) if cache_path else None
+        image_store = open_image_store(image_store_path) if image_store_path else None
+        crop_sink = open_crop_writer(crop_store_path) if crop_store_path else None
+        if in_memory:
+            # Decode images straight from the PDF; raw images are only written when asked for
+            total_faces = process_pdf_in_memory(pdf_path, face_directory, detection_method,
+                                                image_directory if save_images else None, cache=cache,
+                                                prefilter=prefilter, skip_counts=skip_counts, resolution=resolution,
+                                                image_store=image_store, crop_sink=crop_sink, stream=stream,
+                                                decoder=decoder)
+            return _with_skip_counts({"PDF_File": pdf_file, "Number_of_Faces": total_faces}, skip_counts)
+
+        sources = {}
+        extract_images_from_pdf(pdf_path, image_directory, prefilter, skip_counts, image_store, sources, stream)
+
+        image_prefix = f"{pdf_file.split('.')[0]}_page"
+        image_files = [f for f in os.listdir(image_directory) if f.startswith(image_prefix)]
         total_faces = 0
 
         for image_file in image_files:
@@ -58,6 +332,7 @@ def process_pdfs(pdf_directory, image_directory, face_directory, detection_metho
             # Save image without conversion and check if successful
             if not save_image_without_conversion(image_path, converted_image_path):
                 print(f"Skipping image {image_file} due to save error.")
+                metrics.count('errors.convert')
                 continue
             
             # Check if the converted image exists and can be read
@@ -65,30 +340,375 @@ def process_pdfs(pdf_directory, image_directory, face_directory, detection_metho
                 print(f"Converted image {converted_image_path} does not exist.")
                 continue
 
-            image = cv2.imread(converted_image_path)
+            with metrics.timer('image.decode'):
+                image = cv2.imread(converted_image_path)
             if image is None:
                 print(f"Error reading converted image {converted_image_path}")
                 continue
             
             # Detect faces in the converted image
-            num_faces = detect_faces(converted_image_path, face_directory, method=detection_method)
+            num_faces = detect_faces(converted_image_path, face_directory, method=detection_method, image=image, cache=cache,
+                                     resolution=resolution, crop_sink=crop_sink, source=sources.get(image_file))
             total_faces += num_faces
 
-        results.append({"PDF_File": pdf_file, "Number_of_Faces": total_faces})
-    
+        return _with_skip_counts({"PDF_File": pdf_file, "Number_of_Faces": total_faces}, skip_counts)
+    except Exception as e:
+        print(f"Error processing {pdf_file}: {e}")
+        return {"PDF_File": pdf_file, "Number_of_Faces": 0, "Error": str(e)}
+
+def _with_skip_counts(row, skip_counts):
+    # Handed back to iter_process_pdfs, which adds them up and drops the key
+    if skip_counts:
+        row["_skipped"] = dict(skip_counts)
+    return row
+
+def iter_process_pdfs(pdf_files, pdf_directory, image_directory, face_directory, detection_method, in_memory=False, save_images=False, workers=1, batch_size=1, weights_dir=None, cache_path=None, cache_size=DEFAULT_MAX_ENTRIES, prefilter=None, skip_counts=None, resolution=None, image_store_path=None, crop_store_path=None, decoder='bytes', cascade_config=None):
+    """
+    Process PDFs and yield one result row per PDF, in input order, as they finish.
+
+    pdf_files holds the names of PDFs in pdf_directory, or (name, bytes)
+    pairs of PDFs read from archives. It is read lazily, so it can be a
+    generator that reads the archives while the PDFs are processed.
+
+    Prefilter skip counts reported by the workers are added to skip_counts,
+    and their metrics to this process's metrics. With a cascade method, the
+    workers run with cascade_config, or this process's cascade settings.
+    """
+    for row in _iter_pdf_rows(pdf_files, pdf_directory, image_directory, face_directory, detection_method,
+                              in_memory, save_images, workers, batch_size, weights_dir,
+                              cache_path, cache_size, prefilter, resolution, image_store_path, crop_store_path, decoder,
+                              cascade_config):
+        skipped = row.pop("_skipped", None)
+        if skipped and skip_counts is not None:
+            skip_counts.update(skipped)
+        metrics.merge(row.pop("_metrics", None))
+        yield row
+
+def _iter_pdf_rows(pdf_files, pdf_directory, image_directory, face_directory, detection_method, in_memory, save_images, workers, batch_size, weights_dir, cache_path, cache_size, prefilter, resolution, image_store_path, crop_store_path, decoder, cascade_config):
+    if cascade_config is None and detection_method in CASCADE_METHODS:
+        # Passed to the pool initializer, so workers use the settings of this process however they are started
+        cascade_config = cascade_settings()
+    pdfs = (pdf if isinstance(pdf, tuple) else (pdf, None) for pdf in pdf_files)
+    # Only a few tasks are queued ahead of the workers, so streamed PDFs are not all held in memory
+    max_pending = 2 * workers
+    if in_memory and batch_size > 1:
+        # Images are batched across PDFs; each task gets batch_size PDFs
+        groups = _pdf_groups(pdfs, batch_size)
+        process_group = partial(process_pdf_group, pdf_directory=pdf_directory, image_directory=image_directory,
+                                face_directory=face_directory, detection_method=detection_method,
+                                save_images=save_images, batch_size=batch_size,
+                                cache_path=cache_path, cache_size=cache_size, prefilter=prefilter,
+                                resolution=resolution, image_store_path=image_store_path,
+                                crop_store_path=crop_store_path, decoder=decoder)
+        if workers <= 1:
+            load_detector(detection_method, weights_dir)
+            with cascade.using(cascade_config):
+                for group, streams in groups:
+                    yield from process_group(group, streams=streams)
+            return
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_detector,
+                                 initargs=(detection_method, weights_dir, cascade_config)) as executor:
+            submit = lambda group: executor.submit(process_group, group[0], streams=group[1])
+            for rows in bounded_map(submit, groups, max_pending):
+                yield from rows
+        return
+
+    process = partial(process_pdf, pdf_directory=pdf_directory, image_directory=image_directory,
+                      face_directory=face_directory, detection_method=detection_method,
+                      in_memory=in_memory, save_images=save_images,
+                      cache_path=cache_path, cache_size=cache_size, prefilter=prefilter,
+                      resolution=resolution, image_store_path=image_store_path,
+                      crop_store_path=crop_store_path, decoder=decoder)
+
+    if workers <= 1:
+        load_detector(detection_method, weights_dir)
+        with cascade.using(cascade_config):
+            for pdf_file, stream in pdfs:
+                yield process(pdf_file, stream=stream)
+        return
+
+    # Each worker loads the detector once; results come back in input order
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_detector,
+                             initargs=(detection_method, weights_dir, cascade_config)) as executor:
+        submit = lambda pdf: executor.submit(process, pdf[0], stream=pdf[1])
+        yield from bounded_map(submit, pdfs, max_pending)
+
+def _pdf_groups(pdfs, batch_size):
+    # Split (name, stream) pairs into lists of names and streams of batch_size PDFs
+    while True:
+        group = list(islice(pdfs, batch_size))
+        if not group:
+            return
+        yield [pdf_file for pdf_file, _ in group], [stream for _, stream in group]
+
+def process_pdfs(pdf_directory, image_directory, face_directory, detection_method, in_memory=False, save_images=False, workers=1, batch_size=1, weights_dir=None, cache_path=None, cache_size=DEFAULT_MAX_ENTRIES, manifest_path=None, checkpoint_every=50, hash_pdfs=False, prefilter=None, resolution=None, image_store_path=None, crop_store_path=None, archive_directory=None, prefetch_size=DEFAULT_PREFETCH, decoder='bytes'):
+    skip_counts = Counter()
+    process = partial(iter_process_pdfs, pdf_directory=pdf_directory, image_directory=image_directory,
+                      face_directory=face_directory, detection_method=detection_method,
+                      in_memory=in_memory, save_images=save_images, workers=workers,
+                      batch_size=batch_size, weights_dir=weights_dir,
+                      cache_path=cache_path, cache_size=cache_size,
+                      prefilter=prefilter, skip_counts=skip_counts, resolution=resolution,
+                      image_store_path=image_store_path, crop_store_path=crop_store_path, decoder=decoder)
+    # Skip the PDFs the manifest says are unchanged since they were processed with this configuration
+    config = _run_config(detection_method, in_memory, prefilter, resolution, decoder, weights_dir,
+                         outputs=_output_config(image_directory, face_directory, save_images, crop_store_path))
+    # ... and whose face crops are still there
+    crop_counts = saved_crop_counts(face_directory, crop_store_path) if manifest_path else None
+
+    if archive_directory is not None:
+        results = _process_archived_pdfs(process, archive_directory, manifest_path, checkpoint_every, config,
+                                         prefetch_size, crop_counts)
+    elif manifest_path is None:
+        # Sorted so the row order is the same for serial and parallel runs
+        pdf_files = sorted(f for f in os.listdir(pdf_directory) if f.endswith('.pdf'))
+        results = list(process(pdf_files))
+    else:
+        pdf_files = sorted(f for f in os.listdir(pdf_directory) if f.endswith('.pdf'))
+        manifest = load_manifest(manifest_path)
+        fingerprints = {f: pdf_fingerprint(os.path.join(pdf_directory, f), use_hash=hash_pdfs) for f in pdf_files}
+        todo = [f for f in pdf_files
+                if not (is_up_to_date(manifest.get(f), fingerprints[f], config) and _crops_saved(manifest[f], crop_counts))]
+        print(f"{len(pdf_files) - len(todo)} PDFs unchanged since the last run, {len(todo)} to process.")
+
+        writer = ManifestWriter(manifest_path, checkpoint_every)
+        try:
+            for row in process(todo):
+                writer.write(row, fingerprints[row['PDF_File']], config)
+                manifest[row['PDF_File']] = row
+        finally:
+            writer.close()
+        compact_manifest(manifest_path)
+        results = manifest_results(manifest, pdf_files)
+
+    if prefilter is not None:
+        print_skip_counts(skip_counts)
     return results
 
+def _run_config(detection_method, in_memory, prefilter, resolution, decoder, weights_dir=None, outputs=None):
+    # The settings a PDF's results depend on, as recorded in the manifest
+    config = {'detection_method': detection_method}
+    models = [detection_method]
+    if detection_method in CASCADE_METHODS:
+        config['cascade'] = cascade_settings()
+        models = [CASCADE_METHODS[detection_method], 'haar']
+    config['model'] = {name: detectors.model_identity(name, weights_dir) for name in models}
+    if prefilter is not None:
+        config['prefilter'] = prefilter
+    if resolution:
+        config['resolution'] = resolution
+    if in_memory and decoder != 'bytes':
+        config['decoder'] = decoder
+    if outputs:
+        config['outputs'] = outputs
+    return config
+
+def _output_config(image_directory, face_directory, save_images, crop_store_path):
+    # Where a run writes its crops (and images), so a run writing elsewhere processes the PDFs again
+    if crop_store_path:
+        outputs = {'crop_store': os.path.normpath(crop_store_path)}
+    else:
+        outputs = {'face_directory': os.path.normpath(face_directory)}
+    if save_images:
+        outputs['image_directory'] = os.path.normpath(image_directory)
+    return outputs
+
+def saved_crop_counts(face_directory, crop_store_path=None):
+    """
+    Count the face crops saved for every PDF, in the crop store or as files in face_directory.
+
+    Returns:
+    - counts: Counter mapping the PDF name without its extension to its number of crops.
+    """
+    counts = Counter()
+    if crop_store_path:
+        if os.path.exists(os.path.join(crop_store_path, 'index.sqlite')):
+            reader = CropShardReader(crop_store_path)
+            try:
+                for pdf, count in reader.connection.execute("SELECT pdf, COUNT(*) FROM crops GROUP BY pdf"):
+                    counts[str(pdf).split('.')[0]] += count
+            finally:
+                reader.close()
+        return counts
+    if os.path.isdir(face_directory):
+        # Crops are named <pdf>_page<n>_<index>_face_<i>.jpg
+        for name in os.listdir(face_directory):
+            if '_page' in name:
+                counts[name.rsplit('_page', 1)[0]] += 1
+    return counts
+
+def _crops_saved(record, crop_counts):
+    # A PDF whose crops were deleted since it was processed is processed again
+    if crop_counts is None:
+        return True
+    return crop_counts[record['PDF_File'].split('.')[0]] >= record.get('Number_of_Faces', 0)
+
+def enqueue_pdfs(queue_path, pdf_directory, detection_method, in_memory=False, prefilter=None, resolution=None, decoder='bytes', hash_pdfs=False, weights_dir=None):
+    """
+    Coordinator of a distributed run: queue the PDFs of a directory for queue workers.
+
+    The detection settings are stored in the queue, so every worker, on
+    whatever host, processes the PDFs the same way. Enqueuing again keeps the
+    results of PDFs that are unchanged and were done with the same settings,
+    like the manifest does.
+
+    Parameters:
+    - queue_path: str, the queue file, on storage every worker can reach.
+    - pdf_directory: str, directory of the PDFs; workers read them from the same path.
+    - hash_pdfs: bool, detect changed PDFs by content hash.
+    - weights_dir: str, the YOLO weights the workers run, recorded by content hash.
+
+    Returns:
+    - counts: dict of number of queued PDFs per status.
+    """
+    pdf_files = sorted(f for f in os.listdir(pdf_directory) if f.endswith('.pdf'))
+    fingerprints = {f: pdf_fingerprint(os.path.join(pdf_directory, f), use_hash=hash_pdfs) for f in pdf_files}
+    settings = {'detection_method': detection_method, 'in_memory': in_memory, 'prefilter': prefilter,
+                'resolution': resolution, 'decoder': decoder,
+                'config': _run_config(detection_method, in_memory, prefilter, resolution, decoder, weights_dir)}
+    queue = JobQueue(queue_path)
+    try:
+        return queue.enqueue(fingerprints, settings)
+    finally:
+        queue.close()
+
+def process_queued_pdfs(queue_path, pdf_directory, image_directory, face_directory, save_images=False, workers=1, batch_size=1, weights_dir=None, cache_path=None, cache_size=DEFAULT_MAX_ENTRIES, image_store_path=None, crop_store_path=None, claim_size=None, lease_seconds=DEFAULT_LEASE_SECONDS, worker_id=None, poll_seconds=5):
+    """
+    Worker of a distributed run: process PDFs from the queue until none are left.
+
+    PDFs are claimed claim_size at a time and fed to iter_process_pdfs, so
+    the worker processes and their detectors are started once, and every
+    result row is committed to the queue as soon as its PDF finishes. A
+    background thread keeps the worker's leases alive. Once nothing is
+    pending, the worker waits for the other workers' leases to finish or
+    expire, so the PDFs of a dead worker are still picked up.
+
+    Parameters:
+    - queue_path: str, the queue file enqueue_pdfs filled.
+    - claim_size: int, PDFs claimed at a time; defaults to enough to keep every worker process busy.
+    - lease_seconds: float, how long the claims of a worker that stopped sending heartbeats are held.
+    - worker_id: str, name of this worker in the queue; defaults to <host>-<pid>.
+    - poll_seconds: float, how often to check for requeued PDFs once nothing is pending.
+    The other parameters are the local settings of process_pdfs.
+
+    Returns:
+    - processed: int, number of PDFs this worker processed.
+    """
+    queue = JobQueue(queue_path, lease_seconds)
+    settings = queue.settings()
+    if settings is None:
+        queue.close()
+        raise ValueError(f"No PDFs were enqueued in {queue_path}")
+    worker_id = worker_id or default_worker_id()
+    in_memory = settings['in_memory']
+    # Enough to fill the pool and its pending tasks; small enough to spread the PDFs over the workers
+    claim_size = claim_size or 2 * max(1, workers) * (batch_size if in_memory else 1)
+    skip_counts = Counter()
+
+    def claimed_pdfs(pdf_files):
+        # Stops once nothing is pending; the PDFs this worker holds must finish before it waits on the others
+        while pdf_files:
+            yield from pdf_files
+            pdf_files = queue.claim(worker_id, claim_size)
+
+    processed = 0
+    try:
+        with keep_leases(queue_path, worker_id, lease_seconds):
+            while True:
+                pdf_files = queue.claim(worker_id, claim_size)
+                if not pdf_files:
+                    if not queue.unfinished():
+                        break
+                    # Other workers still hold PDFs; they are requeued if their leases expire
+                    time.sleep(poll_seconds)
+                    continue
+                for row in iter_process_pdfs(claimed_pdfs(pdf_files), pdf_directory, image_directory,
+                                             face_directory, settings['detection_method'], in_memory=in_memory,
+                                             save_images=save_images, workers=workers, batch_size=batch_size,
+                                             weights_dir=weights_dir, cache_path=cache_path, cache_size=cache_size,
+                                             prefilter=settings['prefilter'], skip_counts=skip_counts,
+                                             resolution=settings['resolution'], image_store_path=image_store_path,
+                                             crop_store_path=crop_store_path, decoder=settings['decoder'],
+                                             cascade_config=settings['config'].get('cascade')):
+                    queue.complete(worker_id, row)
+                    processed += 1
+    finally:
+        queue.close()
+    if settings['prefilter'] is not None:
+        print_skip_counts(skip_counts)
+    return processed
+
+def queue_results(queue_path):
+    """
+    Merge step of a distributed run: the result rows of every finished PDF in the queue.
+
+    Returns:
+    - results: list of result rows sorted by PDF name, like process_pdfs.
+    """
+    queue = JobQueue(queue_path)
+    try:
+        unfinished = queue.unfinished()
+        if unfinished:
+            print(f"Warning: {unfinished} PDFs in {queue_path} are not processed yet and are left out.")
+        return queue.results()
+    finally:
+        queue.close()
+
+def _process_archived_pdfs(process, archive_directory, manifest_path, checkpoint_every, config, prefetch_size, crop_counts=None):
+    """
+    Process the PDFs in the zip and tar archives of a directory without extracting them.
+
+    A background thread reads and decompresses the archives at most
+    prefetch_size PDFs ahead of the detection. With a manifest, PDFs whose
+    archive member has the same size and modification time as when they were
+    processed, and whose crops are still saved, are skipped without being read.
+
+    Returns:
+    - results: list of result rows, sorted by PDF name like process_pdfs.
+    """
+    manifest = load_manifest(manifest_path) if manifest_path else {}
+    pdf_files = []
+    fingerprints = {}
+
+    def want(pdf_file, fingerprint):
+        # Called from the prefetch thread while earlier PDFs are processed
+        pdf_files.append(pdf_file)
+        fingerprints[pdf_file] = fingerprint
+        if manifest_path is None or not is_up_to_date(manifest.get(pdf_file), fingerprint, config):
+            return True
+        return not _crops_saved(manifest[pdf_file], crop_counts)
+
+    def read_pdfs():
+        for pdf_file, data, _ in iter_archived_files(archive_directory, ('.pdf',), want):
+            yield pdf_file, data
+
+    writer = ManifestWriter(manifest_path, checkpoint_every) if manifest_path else None
+    processed = 0
+    try:
+        for row in process(prefetch(read_pdfs(), prefetch_size)):
+            if writer is not None:
+                writer.write(row, fingerprints[row['PDF_File']], config)
+            manifest[row['PDF_File']] = row
+            processed += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        compact_manifest(manifest_path)
+        print(f"{len(pdf_files) - processed} PDFs unchanged since the last run, {processed} processed.")
+    return manifest_results(manifest, sorted(set(pdf_files)))
+
 def create_and_save_dataframe(data, output_csv):
-    df = pd.DataFrame(data)
-    df.to_csv(output_csv, index=False)
+    # The format follows the extension: .csv, .parquet or .feather
+    df = write_table(pd.DataFrame(data), output_csv, schema='faces')
     print(df)
     return df
 
 def merge_dataframes(df1, df2_path, output_csv):
-    df2 = pd.read_csv(df2_path, sep='\t')
-    
-    # Select only the desired columns from df2
-    df2_selected = df2[['index', 'pmid', 'title', 'abstract', 'pub_date', 'pdf']]
+    # Read only the desired columns from df2
+    columns = ['index', 'pmid', 'title', 'abstract', 'pub_date', 'pdf']
+    df2 = read_table(df2_path, columns=columns, schema='retrieved')
+    df2_selected = df2[columns]
     
     # Strip the '.pdf' extension from the 'PDF_File' column in df1
     df1['PDF_File'] = df1['PDF_File'].str.replace('.pdf', '', regex=False)
@@ -99,102 +719,429 @@ def merge_dataframes(df1, df2_path, output_csv):
     # Drop the 'pdf' column
     merged_df.drop(columns=['PDF_File'], inplace=True)
     
-    # Save the merged DataFrame to a new CSV file
-    merged_df.to_csv(output_csv, index=False)
+    # Save the merged DataFrame to a new CSV (or Parquet/Feather) file
+    merged_df = write_table(merged_df, output_csv, schema='publications')
     print(merged_df)
     return merged_df
 
-def extract_images_from_pdf(pdf_path, output_folder):
-    pdf_document = fitz.open(pdf_path)
-    for page_number in range(len(pdf_document)):
-        for img_index, img in enumerate(pdf_document.get_page_images(page_number)):
-            xref = img[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
-            image_name = f"{os.path.basename(pdf_path).split('.')[0]}_page{page_number + 1}_{img_index}.{image_ext}"
+def iter_images_from_pdf(pdf_path, prefilter=None, skip_counts=None, image_store=None, sources=None, stream=None, pixmaps=False, keep_bytes=True):
+    """
+    Yield every image embedded in a PDF without touching the disk.
+
+    With a prefilter, images are first judged from the metadata
+    get_page_images returns, and rejected ones are never extracted.
+
+    Parameters:
+    - pdf_path: str, path to the PDF file.
+    - prefilter: dict of prefilter rules (see prefilter.DEFAULT_PREFILTER) or None.
+    - skip_counts: Counter, incremented per rule for every skipped image.
+    - image_store: ImageStore; every yielded image is also stored there, and
+      the PDF is marked complete once all of its images went through.
+    - sources: dict, filled with {'pdf', 'page', 'xref'} for every yielded image name.
+    - stream: bytes of the PDF, e.g. read from an archive; pdf_path then only names it.
+    - pixmaps: bool, also decode every image with pixmap_to_array and yield
+      the BGR array (None if it could not be decoded) as a fourth item.
+    - keep_bytes: bool, with pixmaps, False skips extracting the encoded
+      bytes (yielded as None) unless the image_store needs them; the
+      extension then follows the image's PDF filter.
+
+    Yields:
+    - (image_name, image_bytes, image_ext): the name extract_images_from_pdf
+      would save the image under, its encoded bytes and its extension.
+    """
+    extract = not pixmaps or keep_bytes or image_store is not None
+    pdf_file = os.path.basename(pdf_path)
+    skipped = 0
+    with metrics.timer('pdf.open'):
+        if stream is not None:
+            pdf_document = fitz.open(stream=stream, filetype='pdf')
+        else:
+            pdf_document = fitz.open(pdf_path)
+    if image_store is not None:
+        image_store.begin_pdf(pdf_file)
+    try:
+        for page_number in range(len(pdf_document)):
+            page_images = pdf_document.get_page_images(page_number)
+            smask_xrefs = {img[1] for img in page_images if img[1]}
+            for img_index, img in enumerate(page_images):
+                xref = img[0]
+                if prefilter is not None:
+                    rule = prefilter_image(img, smask_xrefs, prefilter)
+                    if rule is not None:
+                        skipped += 1
+                        if skip_counts is not None:
+                            skip_counts[rule] += 1
+                        continue
+                if extract:
+                    with metrics.timer('image.extract'):
+                        base_image = pdf_document.extract_image(xref)
+                    image_bytes = base_image["image"]
+                    image_ext = base_image["ext"]
+                else:
+                    image_bytes = None
+                    image_ext = FILTER_EXTENSIONS.get(img[8], 'png')
+                image_name = f"{pdf_file.split('.')[0]}_page{page_number + 1}_{img_index}.{image_ext}"
+                if image_store is not None:
+                    image_store.put(pdf_file, page_number + 1, xref, image_ext, image_bytes)
+                if sources is not None:
+                    sources[image_name] = {'pdf': pdf_file, 'page': page_number + 1, 'xref': xref}
+                metrics.count('images')
+                if not pixmaps:
+                    yield image_name, image_bytes, image_ext
+                    continue
+                try:
+                    with metrics.timer('image.decode'):
+                        image = pixmap_to_array(pdf_document, xref, img[1])
+                except Exception as e:
+                    print(f"Error decoding image {image_name}: {e}")
+                    image = None
+                yield image_name, image_bytes, image_ext, image
+        metrics.count('images.prefiltered', skipped)
+        if image_store is not None:
+            # A streamed PDF has no file to fingerprint; no file on disk matches mtime 0, so the export extracts it again
+            fingerprint = {'size': len(stream), 'mtime': 0.0} if stream is not None else None
+            image_store.finish_pdf(pdf_file, pdf_path, complete=not skipped, fingerprint=fingerprint)
+    finally:
+        pdf_document.close()
+
+def extract_images_from_pdf(pdf_path, output_folder, prefilter=None, skip_counts=None, image_store=None, sources=None, stream=None):
+    for image_name, image_bytes, _ in iter_images_from_pdf(pdf_path, prefilter, skip_counts, image_store, sources, stream):
+        with metrics.timer('image.write'):
             with open(os.path.join(output_folder, image_name), "wb") as image_file:
                 image_file.write(image_bytes)
-    pdf_document.close()
 
 
 
-# Initialize YOLO face analysis
-face_yolo = face_analysis()  # Auto Download a large weight files from Google Drive.
+# Detectors come from the shared registry: loaded on first use (or by a pool worker's initializer), not at import
+def load_detector(method, weights_dir=None, cascade_config=None):
+    if weights_dir is not None:
+        detectors.configure(weights_dir)
+    if cascade_config is not None:
+        cascade.configure(**cascade_config)
+    if method in CASCADE_METHODS:
+        detectors.get_detector('haar')
+        method = CASCADE_METHODS[method]
+    return detectors.get_detector(method)
+
+def save_face_crops(image, boxes, image_path, save_dir, method='yolo', expand_ratio=0.2, confidences=None, crop_sink=None, source=None):
+    """
+    Expand each detected box, crop it out of the image and save it.
+
+    The two detectors have always expanded their boxes slightly differently
+    (YOLO scales the box, MTCNN pads it by whole pixels), so the method picks
+    the formula.
 
-def detect_faces_yolo(image_path, save_dir):
-    img, box, conf = face_yolo.face_detection(image_path=image_path, model='full')
+    Parameters:
+    - image: numpy.ndarray, the image the boxes were detected in.
+    - boxes: list of (x, y, w, h) boxes.
+    - image_path: str, path or name of the image, used to name the crops.
+    - save_dir: str, directory the crops are saved to.
+    - method: str, 'yolo' or 'mctnn'.
+    - expand_ratio: float, how much to expand each box on every side.
+    - confidences: list of float, the detector's score for each box.
+    - crop_sink: CropShardWriter; when given, the crops are appended to its
+      shards instead of being saved as one file each.
+    - source: dict with the 'pdf', 'page' and 'xref' the image came from,
+      stored with each crop in the sink.
+
+    Returns:
+    - face_count: int, number of crops saved.
+    """
     face_count = 0
-    if len(box) > 0:
-        # Load the image using OpenCV
-        image = cv2.imread(image_path)
-        for i, (x, y, w, h) in enumerate(box):
-            # Expand the bounding box to include more area around the face
-            expand_ratio = 0.2  # 20% expansion
+    for i, (x, y, w, h) in enumerate(boxes):
+        # Expand the bounding box to include more area around the face
+        if method == 'mctnn':
+            expand_w = int(w * expand_ratio)
+            expand_h = int(h * expand_ratio)
+            x = max(0, x - expand_w)
+            y = max(0, y - expand_h)
+            w = min(w + 2 * expand_w, image.shape[1] - x)
+            h = min(h + 2 * expand_h, image.shape[0] - y)
+        else:
             x = max(0, int(x - w * expand_ratio))
             y = max(0, int(y - h * expand_ratio))
             w = min(int(w * (1 + 2 * expand_ratio)), image.shape[1] - x)
             h = min(int(h * (1 + 2 * expand_ratio)), image.shape[0] - y)
-            
-            # Extract the face from the image
-            face_img = image[y:y+h, x:x+w]
-            if face_img.size > 0:
-                # Save the face image to the save directory
-                face_filename = os.path.join(save_dir, f"{os.path.splitext(os.path.basename(image_path))[0]}_face_{i+1}.jpg")
-                cv2.imwrite(face_filename, face_img)
+
+        # Extract the face from the image
+        face_img = image[y:y+h, x:x+w]
+        if face_img.size > 0:
+            crop_id = f"{os.path.splitext(os.path.basename(image_path))[0]}_face_{i+1}"
+            if crop_sink is not None:
+                # Copied so the queued crop does not keep the whole image alive
+                metadata = dict(source or {}, source=os.path.basename(image_path), box=(x, y, w, h),
+                                confidence=float(confidences[i]) if confidences is not None else None)
+                with metrics.timer('crop.queue'):
+                    crop_sink.put(crop_id, face_img.copy(), metadata)
                 face_count += 1
-            else:
-                print(f"Skipped empty face image from {image_path} at coordinates {x, y, w, h}")
+                continue
+            # Save the face image to the save directory
+            face_filename = os.path.join(save_dir, f"{crop_id}.jpg")
+            with metrics.timer('crop.write'):
+                cv2.imwrite(face_filename, face_img)
+            face_count += 1
+        else:
+            metrics.log(f"Skipped empty face image from {image_path} at coordinates {x, y, w, h}")
+    metrics.count('faces', face_count)
     return face_count
 
-def detect_faces_mctnn(image_path, save_dir):
-    try:
+def _run_detector(image, method):
+    if method == 'yolo':
+        _, boxes, confidences = detectors.get_detector('yolo').face_detection(frame_arr=image, frame_status=True, model='full')
+    elif method == 'mctnn':
+        faces = detectors.get_detector('mctnn').detect_faces(image)
+        boxes = [face['box'] for face in faces]
+        confidences = [face['confidence'] for face in faces]
+    else:
+        raise ValueError(f"Unknown detection method: {method}")
+    return boxes, confidences
+
+def detect_boxes(image, method='yolo', cache=None, resolution=None):
+    """
+    Run a detector on a decoded image and return its raw boxes.
+
+    With a cache, an image that was seen before (by content) is not run
+    through the model again. With a resolution setting, large images are
+    downscaled and/or tiled for inference (see resolution.inference_views) and
+    the boxes are mapped back to full resolution coordinates.
+
+    Parameters:
+    - image: numpy.ndarray, the BGR image.
+    - method: str, 'yolo' or 'mctnn', or 'cascade' / 'cascade-mctnn' to
+      only run that model on the images the Haar tier lets through.
+    - cache: DetectionCache or None.
+    - resolution: dict with 'max_size', 'tile_size' and 'tile_overlap', or None.
+
+    Returns:
+    - (boxes, confidences): the unexpanded (x, y, w, h) boxes and their scores.
+    """
+    if method in CASCADE_METHODS:
+        if not passes_cascade(image):
+            return [], []
+        # Cached under the heavy model, so runs with and without the cascade share the cache
+        return detect_boxes(image, CASCADE_METHODS[method], cache, resolution)
+
+    key = None
+    model = resolution_key(resolution)
+    if cache is not None:
+        key = image_hash(image)
+        cached = cache.get(key, method, model)
+        if cached is not None:
+            metrics.count('detect.cached')
+            return cached
+
+    with metrics.timer('detect'):
+        if resolution:
+            views = inference_views(image, resolution)
+            results = [_run_detector(view, method) for view, _, _, _ in views]
+            boxes, confidences = merge_view_boxes(views, [r[0] for r in results], [r[1] for r in results])
+        else:
+            boxes, confidences = _run_detector(image, method)
+
+    if cache is not None:
+        cache.put(key, method, boxes, confidences, model)
+    return boxes, confidences
+
+def detect_faces_yolo(image_path, save_dir, image=None, cache=None, resolution=None, crop_sink=None, source=None):
+    # An already decoded image can be passed in; image_path then only names the crops
+    if image is None:
         image = cv2.imread(image_path)
+    box, conf = detect_boxes(image, 'yolo', cache, resolution)
+    face_count = 0
+    if len(box) > 0:
+        face_count = save_face_crops(image, box, image_path, save_dir, method='yolo', confidences=conf,
+                                     crop_sink=crop_sink, source=source)
+    return face_count
+
+def detect_faces_mctnn(image_path, save_dir, image=None, cache=None, resolution=None, crop_sink=None, source=None):
+    try:
+        if image is None:
+            image = cv2.imread(image_path)
         if image is None:
             print(f"Skipping: Unable to load image at {image_path}")
             return 0
 
-        detector = MTCNN()
-        faces = detector.detect_faces(image)
-        face_count = 0
-        expansion_ratio = 0.2  # Adjust this value to control the amount of expansion
-
-        for i, face in enumerate(faces):
-            x, y, w, h = face['box']
-            
-            # Calculate the amount to expand
-            expand_w = int(w * expansion_ratio)
-            expand_h = int(h * expansion_ratio)
-            
-            # Expand the bounding box
-            x = max(0, x - expand_w)
-            y = max(0, y - expand_h)
-            w = min(w + 2 * expand_w, image.shape[1] - x)
-            h = min(h + 2 * expand_h, image.shape[0] - y)
-            
-            # Extract the face from the image
-            face_img = image[y:y+h, x:x+w]
-            if face_img.size > 0:
-                # Save the face image to the save directory
-                face_filename = os.path.join(save_dir, f"{os.path.splitext(os.path.basename(image_path))[0]}_face_{i+1}.jpg")
-                cv2.imwrite(face_filename, face_img)
-                face_count += 1
-            else:
-                print(f"Skipped empty face image from {image_path} at coordinates {x, y, w, h}")
-        
-        return face_count
+        boxes, confidences = detect_boxes(image, 'mctnn', cache, resolution)
+        return save_face_crops(image, boxes, image_path, save_dir, method='mctnn', confidences=confidences,
+                               crop_sink=crop_sink, source=source)
     except Exception as e:
         print(f"Error processing {image_path}: {e}")
         return 0
 
-def detect_faces(image_path, save_dir, method='yolo'):
+def detect_faces_cascade(image_path, save_dir, method='cascade', image=None, cache=None, resolution=None, crop_sink=None, source=None):
+    """
+    Detect faces with a cheap Haar tier first: only images it finds face-like
+    regions in are run through the heavy model (YOLO for 'cascade', MTCNN for
+    'cascade-mctnn'), and the crops are cut as that model's would be.
+    """
+    if image is None:
+        image = cv2.imread(image_path)
+    if image is None:
+        print(f"Skipping: Unable to load image at {image_path}")
+        return 0
+    if not passes_cascade(image):
+        return 0
+    face_count = detect_faces(image_path, save_dir, method=CASCADE_METHODS[method], image=image, cache=cache,
+                              resolution=resolution, crop_sink=crop_sink, source=source)
+    if not face_count:
+        metrics.count('cascade.heavy_rejected')
+    return face_count
+
+def detect_faces(image_path, save_dir, method='yolo', image=None, cache=None, resolution=None, crop_sink=None, source=None):
+    if method in CASCADE_METHODS:
+        return detect_faces_cascade(image_path, save_dir, method=method, image=image, cache=cache,
+                                    resolution=resolution, crop_sink=crop_sink, source=source)
     if method == 'yolo':
-        return detect_faces_yolo(image_path, save_dir)
+        return detect_faces_yolo(image_path, save_dir, image=image, cache=cache, resolution=resolution,
+                                 crop_sink=crop_sink, source=source)
     elif method == 'mctnn':
-        return detect_faces_mctnn(image_path, save_dir)
+        return detect_faces_mctnn(image_path, save_dir, image=image, cache=cache, resolution=resolution,
+                                  crop_sink=crop_sink, source=source)
+    else:
+        raise ValueError(f"Unknown detection method: {method}")
+
+def detect_boxes_yolo_batch(images, model='full'):
+    """
+    Run the YOLO network once over a batch of images.
+
+    Every image is resized to the 416x416 network input exactly as
+    face_analysis.face_detection does, and since the network predicts
+    coordinates relative to the input, the boxes map straight back onto each
+    original image. Post-processing (0.5 confidence, NMS, face class only)
+    mirrors face_detection so the boxes are the same as one call per image.
+
+    Parameters:
+    - images: list of numpy.ndarray BGR images.
+    - model: str, 'full' or 'tiny'.
+
+    Returns:
+    - (boxes, confidences): one list of boxes and one list of confidences per image.
+    """
+    face_yolo = detectors.get_detector('yolo')
+    if model == 'full':
+        net = face_yolo.full_net
+        classes = ['face', 'back']
     else:
+        net = face_yolo.tiny_net
+        classes = ['face']
+
+    blob = cv2.dnn.blobFromImages(images, 1/255, (416, 416), (0, 0, 0), swapRB=True, crop=False)
+    net.setInput(blob)
+    layer_outputs = net.forward(net.getUnconnectedOutLayersNames())
+    # Each output is (batch, detections, values); older OpenCV flattens the batch axis
+    layer_outputs = [output.reshape(len(images), -1, output.shape[-1]) for output in layer_outputs]
+
+    all_boxes, all_confidences = [], []
+    for n, image in enumerate(images):
+        height, width = image.shape[:2]
+        boxes, confidences, class_ids = [], [], []
+        for output in layer_outputs:
+            for detection in output[n]:
+                scores = detection[5:]
+                class_id = np.argmax(scores)
+                confidence = scores[class_id]
+                if confidence > 0.50:
+                    center_x = int(detection[0] * width)
+                    center_y = int(detection[1] * height)
+                    w = int(detection[2] * width)
+                    h = int(detection[3] * height)
+                    x = int(center_x - (w / 2))
+                    y = int(center_y - (h / 2))
+                    # Same [x, y, h, w] order face_detection returns
+                    boxes.append([x, y, h, w])
+                    confidences.append(float(confidence))
+                    class_ids.append(class_id)
+        indexes = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
+        face_boxes, face_confidences = [], []
+        if len(indexes) > 0:
+            for i in np.array(indexes).flatten():
+                if classes[class_ids[i]] == classes[0]:
+                    face_boxes.append(boxes[i])
+                    face_confidences.append(confidences[i])
+        all_boxes.append(face_boxes)
+        all_confidences.append(face_confidences)
+    return all_boxes, all_confidences
+
+def detect_faces_batch(images, save_dir, method='yolo', batch_size=16, cache=None, resolution=None, crop_sink=None, sources=None):
+    """
+    Detect faces in many in-memory images, running inference once per batch.
+
+    The images can come from any number of pages and PDFs. The boxes found for
+    each image are expanded and cropped exactly as detect_faces does. With a
+    cache, only images that miss it are sent to the model. With a resolution
+    setting, the downscaled views and tiles of all images share the batches,
+    and the crops are still taken from the full resolution images.
+
+    Parameters:
+    - images: list of (image_path, image) pairs; image_path names the crops.
+    - save_dir: str, directory the face crops are saved to.
+    - method: str, 'yolo', 'mctnn', 'cascade' or 'cascade-mctnn'.
+    - batch_size: int, number of images (or views) per inference call.
+    - cache: DetectionCache or None.
+    - resolution: dict with 'max_size', 'tile_size' and 'tile_overlap', or None.
+    - crop_sink: CropShardWriter to append the crops to instead of saving files.
+    - sources: list with the source dict of each image (see save_face_crops), or None.
+
+    Returns:
+    - face_counts: list of int, number of faces saved for each image.
+    """
+    if sources is None:
+        sources = [None] * len(images)
+    if method in CASCADE_METHODS:
+        # Only the images the Haar tier lets through are batched for the heavy model
+        escalated = [n for n, (_, image) in enumerate(images) if passes_cascade(image)]
+        counts = [0] * len(images)
+        heavy_counts = detect_faces_batch([images[n] for n in escalated], save_dir, CASCADE_METHODS[method],
+                                          batch_size, cache, resolution, crop_sink, [sources[n] for n in escalated])
+        for n, count in zip(escalated, heavy_counts):
+            counts[n] = count
+        metrics.count('cascade.heavy_rejected', heavy_counts.count(0))
+        return counts
+    if method == 'mctnn':
+        # MTCNN runs an image pyramid per image, so it only shares the loaded model
+        return [detect_faces_mctnn(image_path, save_dir, image=image, cache=cache, resolution=resolution,
+                                   crop_sink=crop_sink, source=source)
+                for (image_path, image), source in zip(images, sources)]
+    if method != 'yolo':
         raise ValueError(f"Unknown detection method: {method}")
 
+    model = resolution_key(resolution)
+    boxes = [None] * len(images)
+    confidences = [None] * len(images)
+    keys = [None] * len(images)
+    if cache is not None:
+        for n, (_, image) in enumerate(images):
+            keys[n] = image_hash(image)
+            cached = cache.get(keys[n], method, model)
+            if cached is not None:
+                boxes[n], confidences[n] = cached
+                metrics.count('detect.cached')
+
+    misses = [n for n in range(len(images)) if boxes[n] is None]
+    # Every miss contributes one or more views (the image itself, or its downscaled tiles)
+    views = {n: inference_views(images[n][1], resolution) if resolution else [(images[n][1], 0, 0, 1.0)]
+             for n in misses}
+    flat = [(n, v) for n in misses for v in range(len(views[n]))]
+    view_boxes = {n: [None] * len(views[n]) for n in misses}
+    view_confidences = {n: [None] * len(views[n]) for n in misses}
+    for start in range(0, len(flat), batch_size):
+        batch = flat[start:start + batch_size]
+        with metrics.timer('detect.batch'):
+            batch_boxes, batch_confidences = detect_boxes_yolo_batch([views[n][v][0] for n, v in batch])
+        for (n, v), b, c in zip(batch, batch_boxes, batch_confidences):
+            view_boxes[n][v] = b
+            view_confidences[n][v] = c
+
+    for n in misses:
+        image_boxes, image_confidences = merge_view_boxes(views[n], view_boxes[n], view_confidences[n])
+        boxes[n], confidences[n] = image_boxes, image_confidences
+        if cache is not None:
+            cache.put(keys[n], method, image_boxes, image_confidences, model)
+
+    return [save_face_crops(image, image_boxes, image_path, save_dir, method='yolo', confidences=image_confidences,
+                            crop_sink=crop_sink, source=source)
+            for (image_path, image), image_boxes, image_confidences, source in zip(images, boxes, confidences, sources)]
+
 def unzip_pdfs(zip_directory, extract_to_directory):
     zip_files = [f for f in os.listdir(zip_directory) if f.endswith('.zip')]
 
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sqlite3
+
+from pdf_extraction.manifest import pdf_fingerprint
+
+
+DEFAULT_IMAGE_STORE = 'image_store'
+
+# One store per (process, path); pool workers open their own connection
+_open_stores = {}
+
+
+class ImageStore:
+    """
+    Content-addressed store of the images extracted from PDFs.
+
+    Image bytes are saved once per content hash under objects/, and an SQLite
+    index maps every (pdf, page, xref) to its hash. A PDF is only marked
+    complete when all of its images were stored, so later stages can serve
+    its images from the store instead of opening the PDF again. Detection
+    results live in the detection cache, keyed by the decoded pixels.
+    """
+
+    def __init__(self, path=DEFAULT_IMAGE_STORE):
+        self.path = path
+        self.objects = os.path.join(path, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, 'index.sqlite'), timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                pdf TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                xref INTEGER NOT NULL,
+                ext TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                PRIMARY KEY (pdf, page, xref)
+            );
+            CREATE TABLE IF NOT EXISTS pdfs (
+                pdf TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                complete INTEGER NOT NULL
+            );
+        """)
+        self.connection.commit()
+        # Index rows of the PDFs being extracted, written in one short transaction by finish_pdf
+        self._pending = {}
+
+    def object_path(self, content_hash, ext):
+        return os.path.join(self.objects, content_hash[:2], f"{content_hash}.{ext}")
+
+    def begin_pdf(self, pdf):
+        """
+        Forget the images of a PDF before it is extracted again.
+        """
+        self._pending[pdf] = []
+        with self.connection:
+            self.connection.execute("DELETE FROM images WHERE pdf = ?", (pdf,))
+            self.connection.execute("DELETE FROM pdfs WHERE pdf = ?", (pdf,))
+
+    def put(self, pdf, page, xref, ext, image_bytes):
+        """
+        Store an extracted image; the bytes are only written if no image with
+        the same content is stored yet. The index row is kept in memory until
+        finish_pdf, so no transaction is held open while the image is processed.
+
+        Returns:
+        - content_hash: str, sha256 of the image bytes.
+        """
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        object_path = self.object_path(content_hash, ext)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = f"{object_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(temp_path, object_path)
+        self._pending.setdefault(pdf, []).append((pdf, page, xref, ext, content_hash))
+        return content_hash
+
+    def finish_pdf(self, pdf, pdf_path, complete=True, fingerprint=None):
+        """
+        Write the index rows of a PDF's images and record which version of the file they came from.
+
+        Parameters:
+        - complete: bool, False if some images were not stored (e.g. skipped by
+          the prefilter), so the PDF is not served from the store.
+        - fingerprint: dict with 'size' and 'mtime', for a PDF that was not
+          read from pdf_path; defaults to the fingerprint of pdf_path.
+        """
+        if fingerprint is None:
+            fingerprint = pdf_fingerprint(pdf_path)
+        rows = self._pending.pop(pdf, [])
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?, ?)",
+                                    (pdf, fingerprint['size'], fingerprint['mtime'], int(complete)))
+
+    def images(self, pdf, pdf_path=None):
+        """
+        List the stored images of a PDF.
+
+        Parameters:
+        - pdf: str, the PDF file name.
+        - pdf_path: str, the PDF on disk; if given, the images are only
+          returned if they were extracted from this version of the file.
+
+        Returns:
+        - images: list of (page, xref, ext, content_hash) in page order, or None
+          if the PDF is not (completely) in the store.
+        """
+        row = self.connection.execute("SELECT size, mtime, complete FROM pdfs WHERE pdf = ?", (pdf,)).fetchone()
+        if row is None or not row[2]:
+            return None
+        if pdf_path is not None:
+            fingerprint = pdf_fingerprint(pdf_path)
+            if (row[0], row[1]) != (fingerprint['size'], fingerprint['mtime']):
+                return None
+        return self.connection.execute(
+            "SELECT page, xref, ext, content_hash FROM images WHERE pdf = ? ORDER BY page, xref",
+            (pdf,)).fetchall()
+
+    def read(self, content_hash, ext):
+        with open(self.object_path(content_hash, ext), 'rb') as f:
+            return f.read()
+
+    def stats(self):
+        return {
+            'pdfs': self.connection.execute("SELECT COUNT(*) FROM pdfs WHERE complete = 1").fetchone()[0],
+            'images': self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0],
+            'objects': self.connection.execute("SELECT COUNT(DISTINCT content_hash) FROM images").fetchone()[0],
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+def open_image_store(path):
+    """
+    Return this process's image store for a path, opening it on first use.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    store = _open_stores.get(key)
+    if store is None:
+        store = _open_stores[key] = ImageStore(path)
+    return store
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_QUEUE_PATH = 'pdf_jobs.sqlite'
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+
+# A job is 'pending' until a worker claims it, 'leased' while the worker holds it,
+# then 'done', or 'failed' if processing it raised an error or kept killing workers
+STATUSES = ('pending', 'leased', 'done', 'failed')
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobQueue:
+    """
+    File-backed queue of PDFs shared by workers on any number of hosts.
+
+    A coordinator enqueues the PDFs together with the settings every worker
+    must use. Workers claim small batches of jobs under a lease, keep the
+    lease alive with heartbeats while they work, and commit each PDF's result
+    row as it finishes. A job whose lease expires, because its worker died or
+    its host lost the shared storage, is handed to the next worker that
+    claims; after max_attempts expired leases it is marked failed instead,
+    so a PDF that crashes every worker cannot stall the run.
+
+    The queue is a single SQLite file. It uses the rollback journal rather
+    than WAL so it also works on network file systems with working POSIX
+    locks (NFS with lockd, Lustre, ...). Leases are compared with each host's
+    clock, so the clocks must agree to well within the lease time.
+
+    Parameters:
+    - path: str, the queue file.
+    - lease_seconds: float, how long a claim holds without a heartbeat.
+    - max_attempts: int, claims of a job before it is given up on.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Transactions are begun explicitly, so claims can take the write lock up front
+        self.connection = sqlite3.connect(path, timeout=120, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                pdf TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, pdf);
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def settings(self):
+        """
+        Returns:
+        - settings: dict the coordinator enqueued the PDFs with, or None if nothing was enqueued.
+        """
+        row = self.connection.execute("SELECT value FROM settings WHERE key = 'settings'").fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def enqueue(self, fingerprints, settings):
+        """
+        Queue PDFs, keeping the results of those already done.
+
+        A PDF is (re)queued if it is new, its fingerprint changed or it
+        failed. If the settings differ from the ones the queue holds, every
+        PDF is queued again. PDFs no longer listed are dropped, unless a
+        worker is processing them.
+
+        Parameters:
+        - fingerprints: dict mapping PDF file name to its fingerprint dict.
+        - settings: dict of JSON-serialisable settings the workers must use.
+
+        Returns:
+        - counts: dict of number of jobs per status.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            if self.settings() != settings:
+                connection.execute("UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, "
+                                   "attempts = 0, result = NULL, updated = ? WHERE status != 'leased'", (now,))
+                connection.execute("INSERT OR REPLACE INTO settings VALUES ('settings', ?)", (json.dumps(settings),))
+            existing = dict(connection.execute("SELECT pdf, fingerprint FROM jobs"))
+            for pdf_file in sorted(fingerprints):
+                fingerprint = json.dumps(fingerprints[pdf_file], sort_keys=True)
+                if pdf_file not in existing:
+                    connection.execute("INSERT INTO jobs (pdf, fingerprint, status, updated) VALUES (?, ?, 'pending', ?)",
+                                       (pdf_file, fingerprint, now))
+                else:
+                    connection.execute("UPDATE jobs SET fingerprint = ?, status = 'pending', worker = NULL, "
+                                       "lease_expires = NULL, attempts = 0, result = NULL, updated = ? "
+                                       "WHERE pdf = ? AND status != 'leased' AND (fingerprint != ? OR status = 'failed')",
+                                       (fingerprint, now, pdf_file, fingerprint))
+            for pdf_file in set(existing) - set(fingerprints):
+                connection.execute("DELETE FROM jobs WHERE pdf = ? AND status != 'leased'", (pdf_file,))
+        return self.counts()
+
+    def _expire_leases(self, connection, now):
+        # Jobs out of attempts are given up on; the others go back to the queue
+        connection.execute("UPDATE jobs SET status = 'failed', worker = NULL, lease_expires = NULL, updated = ? "
+                           "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                           (now, now, self.max_attempts))
+        connection.execute("UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, updated = ? "
+                           "WHERE status = 'leased' AND lease_expires < ?", (now, now))
+
+    def claim(self, worker, count):
+        """
+        Lease up to count pending PDFs to a worker, after requeueing expired leases.
+
+        Returns:
+        - pdf_files: list of str, the claimed PDFs in name order; empty if none are pending.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            self._expire_leases(connection, now)
+            pdf_files = [row[0] for row in connection.execute(
+                "SELECT pdf FROM jobs WHERE status = 'pending' ORDER BY pdf LIMIT ?", (count,))]
+            connection.executemany("UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                                   "attempts = attempts + 1, updated = ? WHERE pdf = ?",
+                                   [(worker, now + self.lease_seconds, now, pdf_file) for pdf_file in pdf_files])
+        return pdf_files
+
+    def heartbeat(self, worker):
+        """
+        Extend the leases of every job a worker holds.
+
+        Returns:
+        - count: int, number of leases extended.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            return connection.execute("UPDATE jobs SET lease_expires = ?, updated = ? "
+                                      "WHERE worker = ? AND status = 'leased'",
+                                      (now + self.lease_seconds, now, worker)).rowcount
+
+    def complete(self, worker, row):
+        """
+        Record the result row of a PDF, as 'failed' if it has an 'Error'.
+
+        A result arriving after the lease expired is still kept, unless
+        another worker already finished the PDF.
+
+        Returns:
+        - bool, whether the result was recorded.
+        """
+        status = 'failed' if 'Error' in row else 'done'
+        with self._transaction() as connection:
+            return connection.execute("UPDATE jobs SET status = ?, worker = ?, lease_expires = NULL, result = ?, "
+                                      "updated = ? WHERE pdf = ? AND status NOT IN ('done', 'failed')",
+                                      (status, worker, json.dumps(row), time.time(), row['PDF_File'])).rowcount > 0
+
+    def release(self, worker):
+        """
+        Put the jobs a worker still holds back in the queue, e.g. when it is stopped.
+        """
+        with self._transaction() as connection:
+            return connection.execute("UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, "
+                                      "attempts = MAX(attempts - 1, 0), updated = ? "
+                                      "WHERE worker = ? AND status = 'leased'", (time.time(), worker)).rowcount
+
+    def requeue_failed(self):
+        with self._transaction() as connection:
+            return connection.execute("UPDATE jobs SET status = 'pending', worker = NULL, attempts = 0, result = NULL, "
+                                      "updated = ? WHERE status = 'failed'", (time.time(),)).rowcount
+
+    def counts(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return counts
+
+    def unfinished(self):
+        """
+        Returns:
+        - count: int, number of jobs pending or leased, counting expired leases.
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def workers(self):
+        """
+        Returns:
+        - workers: dict mapping every worker holding leases to its number of jobs and latest lease expiry.
+        """
+        rows = self.connection.execute("SELECT worker, COUNT(*), MAX(lease_expires) FROM jobs "
+                                       "WHERE status = 'leased' GROUP BY worker ORDER BY worker")
+        return {worker: {'jobs': jobs, 'lease_expires': expires} for worker, jobs, expires in rows}
+
+    def results(self):
+        """
+        Build the process_pdfs result rows of the finished PDFs.
+
+        Returns:
+        - results: list of dicts with 'PDF_File' and 'Number_of_Faces' (and
+          'Error'), sorted by PDF name like process_pdfs.
+        """
+        results = []
+        for pdf_file, status, attempts, result in self.connection.execute(
+                "SELECT pdf, status, attempts, result FROM jobs WHERE status IN ('done', 'failed') ORDER BY pdf"):
+            if result is None:
+                # Given up on after its workers kept dying
+                row = {'PDF_File': pdf_file, 'Number_of_Faces': 0,
+                       'Error': f"Lease expired {attempts} times without a result"}
+            else:
+                row = json.loads(result)
+            results.append(row)
+        return results
+
+    def close(self):
+        self.connection.close()
+
+
+@contextmanager
+def keep_leases(path, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Send heartbeats for a worker from a background thread every third of the lease time.
+
+    On exit the worker's remaining leases are released, so its unfinished
+    jobs go straight back to the queue instead of waiting for them to expire.
+    """
+    stop = threading.Event()
+
+    def beat():
+        # SQLite connections stay in the thread that opened them
+        queue = JobQueue(path, lease_seconds)
+        try:
+            while not stop.wait(lease_seconds / 3):
+                try:
+                    queue.heartbeat(worker)
+                except sqlite3.OperationalError as e:
+                    # The shared storage may be briefly unavailable; the next beat tries again
+                    print(f"Heartbeat of {worker} failed: {e}")
+        finally:
+            queue.close()
+
+    thread = threading.Thread(target=beat, name='heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        queue = JobQueue(path, lease_seconds)
+        try:
+            queue.release(worker)
+        finally:
+            queue.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or maintain a PDF job queue.")
+    parser.add_argument('queue', nargs='?', default=DEFAULT_QUEUE_PATH,
+                        help=f"Queue file (default: {DEFAULT_QUEUE_PATH}).")
+    parser.add_argument('--requeue-failed', action='store_true', help="Queue the failed PDFs again.")
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.queue)
+    try:
+        if args.requeue_failed:
+            print(f"Requeued {queue.requeue_failed()} failed PDFs.")
+        print(json.dumps({'jobs': queue.counts(), 'workers': queue.workers(), 'settings': queue.settings()}, indent=2))
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
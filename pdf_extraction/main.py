@@ -1,4 +1,6 @@
 import os
+import time
+import argparse
 import cv2
 import pandas as pd
 from collections import defaultdict
@@ -8,22 +10,153 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from pdf_extraction.functions import extract_images_from_pdf
 from pdf_extraction.functions import detect_faces
-from pdf_extraction.functions import unzip_pdfs
+from pdf_extraction.functions import unzip_pdfs, DECODERS
 from pdf_extraction.functions import ensure_directories
 from pdf_extraction.functions import save_image_without_conversion
+from pdf_extraction.functions import enqueue_pdfs, process_queued_pdfs, queue_results
 from pdf_extraction.functions import process_pdfs, create_and_save_dataframe, merge_dataframes, save_image_without_conversion, ensure_directories, extract_images_from_pdf, detect_faces
+from pdf_extraction.cache import DetectionCache, DEFAULT_MAX_ENTRIES
+from pdf_extraction import cascade
+from pdf_extraction.crop_store import CropShardReader, DEFAULT_CROP_STORE
+from pdf_extraction.image_store import ImageStore, DEFAULT_IMAGE_STORE
+from pdf_extraction.job_queue import DEFAULT_LEASE_SECONDS
+from pdf_extraction.manifest import DEFAULT_MANIFEST_PATH
+from pdf_extraction.prefilter import DEFAULT_PREFILTER, make_prefilter
+from pdf_extraction.resolution import DEFAULT_RESOLUTION
+from pipeline import metrics
+from pipeline.archives import DEFAULT_PREFETCH
+from pipeline.storage import with_format
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract images from PDFs and count the faces in them.")
+    parser.add_argument('--method', default='yolo', choices=['yolo', 'mctnn'] + list(cascade.CASCADE_METHODS),
+                        help="Face detection method (default: yolo). 'cascade' and 'cascade-mctnn' only run YOLO or "
+                             "MTCNN on the images a cheap Haar cascade finds face-like regions in.")
+    parser.add_argument('--cascade-min-neighbors', type=int, default=cascade.DEFAULT_CASCADE['min_neighbors'],
+                        help=f"With a cascade method, overlapping Haar hits an image needs to be escalated; higher "
+                             f"is faster but misses more faces (default: {cascade.DEFAULT_CASCADE['min_neighbors']}).")
+    parser.add_argument('--cascade-max-size', type=int, default=cascade.DEFAULT_CASCADE['max_size'],
+                        help=f"With a cascade method, long side the images are downscaled to for the Haar tier "
+                             f"(default: {cascade.DEFAULT_CASCADE['max_size']}).")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes to spread the PDFs over (default: 1).")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="With --in-memory, number of images per detection call (default: 1).")
+    parser.add_argument('--weights-dir', default=None,
+                        help="Directory with pre-downloaded YOLO weights, so nothing is downloaded.")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="Decode images in memory instead of going through images/.")
+    parser.add_argument('--save-images', action='store_true',
+                        help="With --in-memory, also write the raw images to images/.")
+    parser.add_argument('--decode', default='bytes', choices=DECODERS,
+                        help="With --in-memory, how images are decoded: 'bytes' decodes the extracted JPEG/PNG files "
+                             "with OpenCV and skips other formats, 'pixmap' decodes every image with PyMuPDF, "
+                             "including JPEG 2000, JBIG2, CMYK and soft-masked ones (default: bytes).")
+    parser.add_argument('--cache', default=None, metavar='PATH',
+                        help="SQLite file caching detections by image content, e.g. detection_cache.sqlite.")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"Maximum number of cached images before LRU eviction (default: {DEFAULT_MAX_ENTRIES}).")
+    parser.add_argument('--invalidate-cache', action='store_true',
+                        help="Empty the detection cache before running, e.g. after the model changed.")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST_PATH, metavar='PATH',
+                        help=f"Manifest of processed PDFs; unchanged PDFs are skipped on a rerun (default: {DEFAULT_MANIFEST_PATH}).")
+    parser.add_argument('--no-manifest', action='store_true',
+                        help="Process every PDF and do not record a manifest.")
+    parser.add_argument('--checkpoint-every', type=int, default=50,
+                        help="Sync the manifest to disk every N PDFs (default: 50).")
+    parser.add_argument('--hash-pdfs', action='store_true',
+                        help="Detect changed PDFs by content hash instead of size and modification time.")
+    parser.add_argument('--prefilter', action='store_true',
+                        help="Skip images that cannot be photographs (tiny, thin, 1-bit, masks) before decoding them.")
+    parser.add_argument('--min-image-size', type=int, default=DEFAULT_PREFILTER['min_width'],
+                        help=f"With --prefilter, minimum image width and height in pixels (default: {DEFAULT_PREFILTER['min_width']}).")
+    parser.add_argument('--max-aspect-ratio', type=float, default=DEFAULT_PREFILTER['max_aspect_ratio'],
+                        help=f"With --prefilter, maximum ratio of the long to the short side (default: {DEFAULT_PREFILTER['max_aspect_ratio']}).")
+    parser.add_argument('--max-inference-size', type=int, default=None,
+                        help=f"Downscale images so their long side is at most this many pixels for detection "
+                             f"(e.g. {DEFAULT_RESOLUTION['max_size']}); crops are still taken at full resolution.")
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help=f"Split images larger than this into overlapping tiles for detection (e.g. {DEFAULT_RESOLUTION['tile_size']}).")
+    parser.add_argument('--tile-overlap', type=float, default=DEFAULT_RESOLUTION['tile_overlap'],
+                        help=f"Fraction of a tile shared with its neighbours (default: {DEFAULT_RESOLUTION['tile_overlap']}).")
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet', 'feather'],
+                        help="Format of results_1 and results_2 (default: csv).")
+    parser.add_argument('--image-store', default=None, metavar='PATH',
+                        help=f"Keep the extracted images in a shared store the export step reuses, e.g. {DEFAULT_IMAGE_STORE}.")
+    parser.add_argument('--crop-store', default=None, metavar='PATH',
+                        help=f"Append the face crops to packed shard files with an index instead of writing one JPEG per face to faces/, e.g. {DEFAULT_CROP_STORE}.")
+    parser.add_argument('--archives', default=None, metavar='DIRECTORY',
+                        help="Read the PDFs straight out of the zip and tar archives in this directory (e.g. unzip_pdfs/) instead of pdfs/, without extracting them.")
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH,
+                        help=f"With --archives, number of PDFs read ahead of the detection (default: {DEFAULT_PREFETCH}).")
+    parser.add_argument('--queue', default=None, metavar='PATH',
+                        help="Job queue on shared storage for a distributed run, e.g. /shared/pdf_jobs.sqlite; see --role.")
+    parser.add_argument('--role', default=None, choices=['coordinator', 'worker', 'merge'],
+                        help="With --queue: 'coordinator' queues the PDFs with the detection options, 'worker' processes "
+                             "queued PDFs until none are left (run any number, on any host), 'merge' writes the results.")
+    parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+                        help=f"With --role worker, seconds after which the PDFs of a worker that stopped sending "
+                             f"heartbeats are handed to another worker (default: {DEFAULT_LEASE_SECONDS}).")
+    parser.add_argument('--claim-size', type=int, default=None,
+                        help="With --role worker, number of PDFs claimed at a time (default: twice the worker processes).")
+    parser.add_argument('--quiet', action='store_true',
+                        help="Only print errors and summaries, not a line per image.")
+    parser.add_argument('--report', default=None, metavar='PATH',
+                        help="Write a JSON run report with stage timers, latency percentiles and counters, e.g. run_report.json.")
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help="Run under cProfile and save the stats to this file (read with python -m pstats).")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Trace Python allocations and report the peak in the run report.")
+    args = parser.parse_args(argv)
+    if bool(args.queue) != bool(args.role):
+        parser.error("--queue and --role go together")
+    if args.queue and args.archives:
+        parser.error("--queue reads the PDFs from pdfs/; extract the archives first")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.quiet:
+        metrics.set_quiet()
+    start = time.perf_counter()
+    try:
+        with metrics.profiled(args.profile, args.trace_memory):
+            run(args)
+    finally:
+        if args.report:
+            metrics.write_report(args.report, wall_seconds=time.perf_counter() - start, settings=vars(args))
+            print(f"Run report saved to {args.report}.")
+
+def run(args):
     try:
         zip_directory = 'unzip_pdfs/'
         pdf_directory = 'pdfs/'
         image_directory = 'images/'
         face_directory = 'faces/'
-        output_csv = "results_1.csv"
+        output_csv = with_format("results_1.csv", args.format)
         retrieved_df_path = "retrieved_df2.tsv"
-        final_output_csv = "results_2.csv"
-        detection_method = 'yolo'  # Change to 'mctnn' to switch to MTCNN
+        final_output_csv = with_format("results_2.csv", args.format)
+        detection_method = args.method  # 'yolo' or 'mctnn'
+        in_memory = args.in_memory
+        save_images = args.save_images
+        workers = args.workers
+        batch_size = args.batch_size
+        weights_dir = args.weights_dir
+        cache_path = args.cache
+        image_store_path = args.image_store
+        crop_store_path = args.crop_store
+        manifest_path = None if args.no_manifest else args.manifest
+        prefilter = None
+        if args.prefilter:
+            prefilter = make_prefilter(min_width=args.min_image_size, min_height=args.min_image_size,
+                                       max_aspect_ratio=args.max_aspect_ratio)
+        if detection_method in cascade.CASCADE_METHODS:
+            cascade.configure(min_neighbors=args.cascade_min_neighbors, max_size=args.cascade_max_size)
+        resolution = None
+        if args.max_inference_size or args.tile_size:
+            resolution = {'max_size': args.max_inference_size, 'tile_size': args.tile_size,
+                          'tile_overlap': args.tile_overlap}
 
         try:
             ensure_directories(pdf_directory, image_directory, face_directory)
@@ -34,14 +167,63 @@ def main():
 
         try:
             # unzip_pdfs(zip_directory, pdf_directory)
-            print("Skipped unzipping PDFs (uncomment if needed).")
+            if args.archives:
+                print(f"Reading the PDFs from the archives in {args.archives}.")
+            else:
+                print("Skipped unzipping PDFs (uncomment if needed).")
         except Exception as e:
             print(f"Error unzipping PDFs: {e}")
             return  # Exit if there is an error unzipping PDFs
 
+        if cache_path and args.invalidate_cache:
+            cache = DetectionCache(cache_path, args.cache_size)
+            print(f"Invalidated {cache.invalidate()} cached detections.")
+            cache.close()
+
         try:
-            data = process_pdfs(pdf_directory, image_directory, face_directory, detection_method)
+            if args.role == 'coordinator':
+                counts = enqueue_pdfs(args.queue, pdf_directory, detection_method, in_memory=in_memory,
+                                      prefilter=prefilter, resolution=resolution, decoder=args.decode,
+                                      hash_pdfs=args.hash_pdfs, weights_dir=weights_dir)
+                print(f"Queued the PDFs in {args.queue}: {counts}")
+                return
+            if args.role == 'worker':
+                processed = process_queued_pdfs(args.queue, pdf_directory, image_directory, face_directory,
+                                                save_images=save_images, workers=workers, batch_size=batch_size,
+                                                weights_dir=weights_dir, cache_path=cache_path,
+                                                cache_size=args.cache_size, image_store_path=image_store_path,
+                                                crop_store_path=crop_store_path, claim_size=args.claim_size,
+                                                lease_seconds=args.lease_seconds)
+                print(f"Processed {processed} PDFs from {args.queue}; run --role merge once all workers are done.")
+            elif args.role == 'merge':
+                data = queue_results(args.queue)
+            else:
+                data = process_pdfs(pdf_directory, image_directory, face_directory, detection_method,
+                                    in_memory=in_memory, save_images=save_images, workers=workers,
+                                    batch_size=batch_size, weights_dir=weights_dir,
+                                    cache_path=cache_path, cache_size=args.cache_size,
+                                    manifest_path=manifest_path, checkpoint_every=args.checkpoint_every,
+                                    hash_pdfs=args.hash_pdfs, prefilter=prefilter, resolution=resolution,
+                                    image_store_path=image_store_path, crop_store_path=crop_store_path,
+                                    archive_directory=args.archives, prefetch_size=args.prefetch,
+                                    decoder=args.decode)
             print("PDFs processed successfully.")
+            if detection_method in cascade.CASCADE_METHODS:
+                cascade.print_cascade_counts(metrics.current().counters)
+            if cache_path:
+                cache = DetectionCache(cache_path, args.cache_size)
+                print(f"Detection cache: {cache.stats()}")
+                cache.close()
+            if image_store_path:
+                store = ImageStore(image_store_path)
+                print(f"Image store: {store.stats()}")
+                store.close()
+            if crop_store_path:
+                crops = CropShardReader(crop_store_path)
+                print(f"Crop store: {crops.stats()}")
+                crops.close()
+            if args.role == 'worker':
+                return  # The merge step writes the results of every worker
         except Exception as e:
             print(f"Error processing PDFs: {e}")
             return  # Exit if there is an error processing PDFs
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+
+DEFAULT_MANIFEST_PATH = 'manifest.jsonl'
+
+
+def pdf_fingerprint(pdf_path, use_hash=False):
+    """
+    Describe a PDF so a later run can tell whether it changed.
+
+    Parameters:
+    - pdf_path: str, path to the PDF file.
+    - use_hash: bool, also hash the content; slower, but robust to files
+      that are copied with new modification times.
+
+    Returns:
+    - fingerprint: dict with 'size', 'mtime' and optionally 'sha256'.
+    """
+    stat = os.stat(pdf_path)
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as pdf_file:
+            for chunk in iter(lambda: pdf_file.read(1 << 20), b''):
+                digest.update(chunk)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+
+def load_manifest(manifest_path):
+    """
+    Read a manifest, keeping the latest record of every PDF.
+
+    The manifest is a JSON lines file that is only ever appended to, so a
+    crash can at worst lose a partially written last line, which is skipped.
+
+    Returns:
+    - manifest: dict mapping PDF file name to its latest record.
+    """
+    manifest = {}
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            manifest[record['PDF_File']] = record
+    return manifest
+
+
+def is_up_to_date(record, fingerprint, config):
+    """
+    Check whether a manifest record still describes a PDF.
+
+    A record is only reused if the PDF has the same fingerprint, it was
+    processed with the same detector configuration and it did not fail.
+    """
+    if record is None or 'Error' in record:
+        return False
+    if record.get('config') != config:
+        return False
+    if 'sha256' in fingerprint:
+        return record.get('sha256') == fingerprint['sha256']
+    return record.get('size') == fingerprint['size'] and record.get('mtime') == fingerprint['mtime']
+
+
+class ManifestWriter:
+    """
+    Append a record to the manifest as each PDF finishes.
+
+    Records are flushed immediately and synced to disk every checkpoint_every
+    records, so a crash loses at most that many finished PDFs.
+    """
+
+    def __init__(self, manifest_path, checkpoint_every=50):
+        self.manifest_path = manifest_path
+        self.checkpoint_every = checkpoint_every
+        self.pending = 0
+        self.file = open(manifest_path, 'a')
+
+    def write(self, row, fingerprint, config):
+        record = dict(row)
+        record.update(fingerprint)
+        record['config'] = config
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+
+def compact_manifest(manifest_path):
+    """
+    Rewrite the manifest with only the latest record of every PDF.
+    """
+    manifest = load_manifest(manifest_path)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        for pdf_file in sorted(manifest):
+            f.write(json.dumps(manifest[pdf_file]) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, manifest_path)
+
+
+def manifest_results(manifest, pdf_files=None):
+    """
+    Build the process_pdfs result rows from a manifest.
+
+    Parameters:
+    - manifest: dict returned by load_manifest.
+    - pdf_files: list of str, the PDFs to report, in order; defaults to every
+      PDF in the manifest, sorted.
+
+    Returns:
+    - results: list of dicts with 'PDF_File' and 'Number_of_Faces' (and 'Error').
+    """
+    if pdf_files is None:
+        pdf_files = sorted(manifest)
+    results = []
+    for pdf_file in pdf_files:
+        record = manifest.get(pdf_file)
+        if record is None:
+            continue
+        row = {'PDF_File': pdf_file, 'Number_of_Faces': record['Number_of_Faces']}
+        if 'Error' in record:
+            row['Error'] = record['Error']
+        results.append(row)
+    return results
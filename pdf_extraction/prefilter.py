@@ -0,0 +1,74 @@
+from collections import Counter
+
+
+# Rules that drop images which cannot be photographs of faces, judged from the
+# metadata get_page_images returns before anything is extracted or decoded.
+# A rule set to None (or an empty list) is not applied.
+DEFAULT_PREFILTER = {
+    'min_width': 32,                # icons, bullets and thin rules
+    'min_height': 32,
+    'max_aspect_ratio': 8.0,        # banners, rules and separators
+    'min_bpc': 8,                   # 1-bit masks and line art
+    'max_pixels': None,             # e.g. 40_000_000 to drop huge scans
+    'skip_colorspaces': [],         # e.g. ['Separation', 'DeviceN']
+    'skip_filters': ['CCITTFaxDecode', 'JBIG2Decode'],  # bilevel scan codecs
+    'skip_smask_only': True,        # images only used as another image's soft mask
+}
+
+
+def make_prefilter(**overrides):
+    """
+    Return a copy of DEFAULT_PREFILTER with some rules changed.
+    """
+    rules = dict(DEFAULT_PREFILTER)
+    unknown = set(overrides) - set(rules)
+    if unknown:
+        raise ValueError(f"Unknown prefilter rules: {', '.join(sorted(unknown))}")
+    rules.update(overrides)
+    return rules
+
+
+def prefilter_image(img, smask_xrefs, rules):
+    """
+    Decide whether an image can be skipped from its PDF metadata alone.
+
+    Parameters:
+    - img: tuple, an entry of fitz Document.get_page_images():
+      (xref, smask, width, height, bpc, colorspace, alt_colorspace, name, filter, ...).
+    - smask_xrefs: set of int, xrefs used as soft masks by images on the page.
+    - rules: dict of prefilter rules (see DEFAULT_PREFILTER).
+
+    Returns:
+    - rule: str, the name of the first rule that rejects the image, or None to keep it.
+    """
+    xref, _, width, height, bpc, colorspace = img[:6]
+    image_filter = img[8] if len(img) > 8 else ''
+
+    if rules.get('skip_smask_only') and xref in smask_xrefs:
+        return 'skip_smask_only'
+    if rules.get('min_width') and width < rules['min_width']:
+        return 'min_width'
+    if rules.get('min_height') and height < rules['min_height']:
+        return 'min_height'
+    if rules.get('max_aspect_ratio') and min(width, height) > 0:
+        if max(width, height) / min(width, height) > rules['max_aspect_ratio']:
+            return 'max_aspect_ratio'
+    if rules.get('min_bpc') and bpc < rules['min_bpc']:
+        return 'min_bpc'
+    if rules.get('max_pixels') and width * height > rules['max_pixels']:
+        return 'max_pixels'
+    if rules.get('skip_colorspaces') and colorspace in rules['skip_colorspaces']:
+        return 'skip_colorspaces'
+    if rules.get('skip_filters') and image_filter in rules['skip_filters']:
+        return 'skip_filters'
+    return None
+
+
+def print_skip_counts(skip_counts):
+    """
+    Log how many images each prefilter rule skipped.
+    """
+    total = sum(skip_counts.values())
+    print(f"Prefilter skipped {total} images.")
+    for rule, count in Counter(skip_counts).most_common():
+        print(f"  {rule}: {count}")
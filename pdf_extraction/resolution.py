@@ -0,0 +1,117 @@
+import cv2
+
+
+# Example setting for the resolution option used throughout pdf_extraction.functions:
+# detect on at most 1024 px, and split anything over 2048 px into overlapping tiles first.
+DEFAULT_RESOLUTION = {'max_size': 1024, 'tile_size': 2048, 'tile_overlap': 0.2}
+
+
+def resolution_key(resolution):
+    """
+    Describe a resolution setting as a string, to tell cached detections apart.
+    """
+    if not resolution:
+        return 'full'
+    return (f"full:max{resolution.get('max_size') or 0}"
+            f":tile{resolution.get('tile_size') or 0}:overlap{resolution.get('tile_overlap', 0.2)}")
+
+
+def _tile_starts(length, tile_size, step):
+    starts = list(range(0, max(length - tile_size, 0) + 1, step))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def inference_views(image, resolution):
+    """
+    Split an image into the downscaled views the detector is run on.
+
+    Images larger than tile_size are cut into overlapping tiles, so the panels
+    of a large figure plate are each seen at a useful size. Every tile (or the
+    whole image) larger than max_size is then downscaled to it. The views are
+    resized copies, so the full resolution array is only read, never copied.
+
+    Parameters:
+    - image: numpy.ndarray, the full resolution image.
+    - resolution: dict with 'max_size', 'tile_size' and 'tile_overlap'; missing
+      or None values disable that step.
+
+    Returns:
+    - views: list of (view, x_offset, y_offset, scale) where scale is the
+      size of the view relative to the original region.
+    """
+    height, width = image.shape[:2]
+    max_size = resolution.get('max_size')
+    tile_size = resolution.get('tile_size')
+    overlap = resolution.get('tile_overlap', 0.2)
+
+    regions = [(0, 0, width, height)]
+    if tile_size and max(width, height) > tile_size:
+        step = max(1, int(tile_size * (1 - overlap)))
+        regions = [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+                   for y in _tile_starts(height, tile_size, step)
+                   for x in _tile_starts(width, tile_size, step)]
+
+    views = []
+    for x, y, w, h in regions:
+        region = image[y:y + h, x:x + w]
+        scale = 1.0
+        if max_size and max(w, h) > max_size:
+            scale = max_size / max(w, h)
+            region = cv2.resize(region, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                interpolation=cv2.INTER_AREA)
+        views.append((region, x, y, scale))
+    return views
+
+
+def merge_view_boxes(views, view_boxes, view_confidences, nms_threshold=0.4, containment=0.7):
+    """
+    Map boxes found in the views back onto the original image.
+
+    Boxes from overlapping tiles are merged with non-maximum suppression, so a
+    face inside the overlap is only reported once, and partial boxes of faces
+    cut by a tile edge are dropped in favour of the complete box.
+
+    Parameters:
+    - views: list returned by inference_views.
+    - view_boxes: list of box lists, one per view, in view coordinates.
+    - view_confidences: list of confidence lists, one per view.
+    - nms_threshold: float, overlap above which two boxes count as the same face.
+    - containment: float, fraction of a box inside a larger one above which it is dropped.
+
+    Returns:
+    - (boxes, confidences): boxes in original image coordinates.
+    """
+    boxes, confidences = [], []
+    for (_, x_offset, y_offset, scale), v_boxes, v_confidences in zip(views, view_boxes, view_confidences):
+        for (x, y, a, b), confidence in zip(v_boxes, v_confidences):
+            boxes.append([int(round(x / scale)) + x_offset, int(round(y / scale)) + y_offset,
+                          int(round(a / scale)), int(round(b / scale))])
+            confidences.append(float(confidence))
+
+    if len(views) <= 1 or len(boxes) <= 1:
+        return boxes, confidences
+
+    # The last two values are (w, h) or (h, w) depending on the detector; faces are close to square
+    # so the order barely changes the overlap, and the boxes themselves are returned untouched
+    keep = cv2.dnn.NMSBoxes(boxes, confidences, 0.0, nms_threshold)
+    keep = [int(i) for i in (keep.flatten() if hasattr(keep, 'flatten') else keep)]
+
+    # A face cut by a tile edge leaves a partial box inside the complete one from the
+    # neighbouring tile; drop boxes that lie mostly inside a larger kept box
+    kept = []
+    for i in sorted(keep, key=lambda i: -boxes[i][2] * boxes[i][3]):
+        x, y, a, b = boxes[i]
+        contained = False
+        for j in kept:
+            kx, ky, ka, kb = boxes[j]
+            inter_w = min(x + a, kx + ka) - max(x, kx)
+            inter_h = min(y + b, ky + kb) - max(y, ky)
+            if inter_w > 0 and inter_h > 0 and inter_w * inter_h >= containment * a * b:
+                contained = True
+                break
+        if not contained:
+            kept.append(i)
+    kept = set(kept)
+    return [boxes[i] for i in keep if i in kept], [confidences[i] for i in keep if i in kept]
@@ -0,0 +1,169 @@
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+
+from pipeline import metrics
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+DEFAULT_PREFETCH = 8
+
+# Marks the end of a prefetched iterable
+_DONE = object()
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def list_archives(directory):
+    """
+    Returns:
+    - archives: list of str, the zip and tar archives in a directory, in sorted order.
+    """
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if is_archive(os.path.join(directory, f)))
+
+
+def iter_archive_members(archive_path, extensions, want=None, seen=None):
+    """
+    Yield the files of a zip or tar archive whose names end with one of the
+    extensions, reading each member into memory without extracting anything
+    to disk.
+
+    Tar archives (plain or gzip, bzip2 or xz compressed) are read as a
+    stream, front to back, so members come out in archive order while the
+    archive is being decompressed.
+
+    Parameters:
+    - archive_path: str, path to the archive.
+    - extensions: tuple of str, e.g. ('.pdf',).
+    - want: callable taking (name, fingerprint) and returning False for
+      members to skip without reading them, or None.
+    - seen: dict mapping the member names found so far to where they were
+      found, shared to check several archives at once, or None.
+
+    Raises:
+    - ValueError: if two members have the same file name. Members are keyed
+      by file name in the results, the manifest and the output files, so
+      they would overwrite each other.
+
+    Yields:
+    - (name, data, fingerprint): the member's file name without its
+      directories, its bytes and a dict with its 'size' and 'mtime'.
+    """
+    seen = {} if seen is None else seen
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path, 'r') as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name.lower().endswith(extensions):
+                    continue
+                _check_unique(name, f"{archive_path}/{info.filename}", seen)
+                fingerprint = {'size': info.file_size, 'mtime': time.mktime(info.date_time + (0, 0, -1))}
+                if want is not None and not want(name, fingerprint):
+                    continue
+                with metrics.timer('archive.read'):
+                    data = archive.read(info)
+                yield name, data, fingerprint
+        return
+
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            name = os.path.basename(member.name)
+            if not member.isfile() or not name.lower().endswith(extensions):
+                continue
+            _check_unique(name, f"{archive_path}/{member.name}", seen)
+            fingerprint = {'size': member.size, 'mtime': float(member.mtime)}
+            if want is not None and not want(name, fingerprint):
+                continue
+            with metrics.timer('archive.read'):
+                data = archive.extractfile(member).read()
+            yield name, data, fingerprint
+
+
+def iter_archived_files(directory, extensions, want=None):
+    """
+    Yield the matching members of every archive in a directory, like
+    iter_archive_members, checking that no file name occurs twice across them.
+    """
+    seen = {}
+    for archive_path in list_archives(directory):
+        yield from iter_archive_members(archive_path, extensions, want, seen)
+
+
+def _check_unique(name, location, seen):
+    if name in seen:
+        raise ValueError(f"Two archived files are named {name}: {seen[name]} and {location}. Rename one of them.")
+    seen[name] = location
+
+
+def prefetch(iterable, size=DEFAULT_PREFETCH):
+    """
+    Run an iterable in a background thread, at most size items ahead of the consumer.
+
+    Reading and decompressing archives then overlaps with the work done on
+    the items, while the bounded queue keeps no more than size of them in
+    memory. An exception raised by the iterable is raised again in the
+    consumer.
+    """
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def put(item):
+        # Gives up once the consumer is gone, so the thread never blocks forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # The consumer stopped early or failed; let the producer finish
+        stop.set()
+
+
+def bounded_map(submit, iterable, max_pending):
+    """
+    Like executor.map, but only takes up to max_pending items from the
+    iterable ahead of the results, instead of submitting all of them at once.
+
+    Parameters:
+    - submit: callable taking an item and returning a Future, e.g.
+      lambda item: executor.submit(fn, item).
+    - iterable: the items, read lazily.
+    - max_pending: int, number of submitted items whose results were not yet yielded.
+
+    Yields the results in input order.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(submit(item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,308 @@
+import argparse
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Set in the environment so pool workers, however they are started, are quiet too
+QUIET_ENV = 'PIPELINE_QUIET'
+
+# Upper bounds of the latency histogram buckets in seconds: 0.1 ms doubling up to ~14 minutes
+BUCKET_BOUNDS = [0.0001 * 2 ** i for i in range(24)]
+
+
+class Histogram:
+    """
+    Latency histogram with fixed log-spaced buckets.
+
+    The buckets are the same in every process, so histograms collected by
+    pool workers can be added up exactly.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        for i, bound in enumerate(BUCKET_BOUNDS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def merge(self, data):
+        if not data['count']:
+            return
+        self.count += data['count']
+        self.total += data['total']
+        self.min = data['min'] if self.min is None else min(self.min, data['min'])
+        self.max = data['max'] if self.max is None else max(self.max, data['max'])
+        self.buckets = [a + b for a, b in zip(self.buckets, data['buckets'])]
+
+    def percentile(self, q):
+        """
+        Estimate a percentile by interpolating within the bucket it falls in,
+        clamped to the observed minimum and maximum.
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = max(BUCKET_BOUNDS[i - 1] if i else 0.0, self.min)
+                upper = min(BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'buckets': list(self.buckets)}
+
+    def summary(self):
+        return {'count': self.count, 'total_seconds': round(self.total, 6),
+                'mean_seconds': round(self.total / self.count, 6) if self.count else None,
+                'min_seconds': self.min, 'max_seconds': self.max,
+                'p50_seconds': self.percentile(50), 'p90_seconds': self.percentile(90),
+                'p99_seconds': self.percentile(99)}
+
+
+class Metrics:
+    """
+    Timers, counters and gauges collected during a run.
+
+    Timers keep a latency histogram per name (e.g. 'pdf.open', 'detect'),
+    counters add up (e.g. 'images', 'faces', 'errors') and gauges keep their
+    maximum (e.g. peak memory). snapshot() gives a plain dict that can be sent
+    back from a worker process and merged into the parent's metrics.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = Counter()
+        self.gauges = {}
+
+    def observe(self, name, seconds):
+        histogram = self.timers.get(name)
+        if histogram is None:
+            histogram = self.timers[name] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def gauge(self, name, value):
+        self.gauges[name] = max(value, self.gauges.get(name, value))
+
+    def snapshot(self):
+        return {'timers': {name: h.to_dict() for name, h in self.timers.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges)}
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        for name, data in snapshot.get('timers', {}).items():
+            self.timers.setdefault(name, Histogram()).merge(data)
+        self.counters.update(snapshot.get('counters', {}))
+        for name, value in snapshot.get('gauges', {}).items():
+            self.gauge(name, value)
+
+    def summary(self):
+        """
+        Returns:
+        - summary: dict with 'timers' (count, total, mean and percentiles per
+          timer), 'counters' and 'gauges', sorted by name.
+        """
+        return {'timers': {name: self.timers[name].summary() for name in sorted(self.timers)},
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items()))}
+
+
+# Metrics being collected in this process; collect() pushes a fresh one on top
+_stack = [Metrics()]
+
+
+def current():
+    return _stack[-1]
+
+
+def timer(name):
+    return current().timer(name)
+
+
+def observe(name, seconds):
+    current().observe(name, seconds)
+
+
+def count(name, n=1):
+    current().count(name, n)
+
+
+def merge(snapshot):
+    current().merge(snapshot)
+
+
+@contextmanager
+def collect():
+    """
+    Collect the metrics of a block of work separately, e.g. one task of a pool worker.
+
+    Yields the new Metrics. They are not merged into the metrics that were
+    current before: the caller hands their snapshot back with the task's
+    result and merges it once, the same whether the task ran in a pool
+    worker or in the calling process.
+    """
+    metrics = Metrics()
+    _stack.append(metrics)
+    try:
+        yield metrics
+    finally:
+        _stack.remove(metrics)
+
+
+@contextmanager
+def profiled(profile_path=None, trace_memory=False):
+    """
+    Optionally run a block under cProfile and/or tracemalloc.
+
+    Parameters:
+    - profile_path: str, file the cProfile stats are dumped to (read them
+      with python -m pstats), or None.
+    - trace_memory: bool, record the peak traced Python memory as the
+      'peak_traced_memory_bytes' gauge.
+    """
+    profiler = None
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if trace_memory and tracemalloc.is_tracing():
+            current().gauge('peak_traced_memory_bytes', tracemalloc.get_traced_memory()[1])
+            if started_tracing:
+                tracemalloc.stop()
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+            profiler.dump_stats(profile_path)
+
+
+def set_quiet(quiet=True):
+    """
+    Silence the per-image and per-file progress messages of log(); errors are still printed.
+    """
+    if quiet:
+        os.environ[QUIET_ENV] = '1'
+    else:
+        os.environ.pop(QUIET_ENV, None)
+
+
+def log(message):
+    if not os.environ.get(QUIET_ENV):
+        print(message)
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(peak, children) * scale
+
+
+def write_report(report_path, metrics=None, wall_seconds=None, **details):
+    """
+    Write a JSON run report.
+
+    Parameters:
+    - report_path: str, path of the JSON file.
+    - metrics: Metrics to summarise; defaults to this process's metrics.
+    - wall_seconds: float, wall time of the run.
+    - details: any other JSON serialisable entries, e.g. the settings or the per-stage results.
+
+    Returns:
+    - report: dict, what was written.
+    """
+    metrics = metrics if metrics is not None else current()
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'command': sys.argv,
+              'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                       'cpus': os.cpu_count()},
+              'wall_seconds': wall_seconds,
+              'peak_rss_bytes': peak_rss_bytes()}
+    report.update(details)
+    report.update(metrics.summary())
+    temp_path = report_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(temp_path, report_path)
+    return report
+
+
+def print_summary(summary):
+    """
+    Print the timers and counters of a report (or of Metrics.summary()) as a table.
+    """
+    timers = summary.get('timers', {})
+    width = max([len(name) for name in timers] + [len(name) for name in summary.get('counters', {})] + [5])
+    if timers:
+        print(f"  {'timer':<{width}}  {'count':>8}  {'total':>9}  {'mean':>9}  {'p50':>9}  {'p99':>9}")
+        for name, t in timers.items():
+            print(f"  {name:<{width}}  {t['count']:>8}  {t['total_seconds']:>8.2f}s  {t['mean_seconds'] * 1000:>7.1f}ms"
+                  f"  {t['p50_seconds'] * 1000:>7.1f}ms  {t['p99_seconds'] * 1000:>7.1f}ms")
+    for name, value in summary.get('counters', {}).items():
+        print(f"  {name:<{width}}  {value:>8}")
+    for name, value in summary.get('gauges', {}).items():
+        print(f"  {name:<{width}}  {value:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the timers and counters of a JSON run report.")
+    parser.add_argument('report', help="Run report written with --report.")
+    args = parser.parse_args(argv)
+    with open(args.report, 'r') as f:
+        report = json.load(f)
+    print(f"Wall time: {report.get('wall_seconds')}s, peak RSS: {report.get('peak_rss_bytes')} bytes")
+    print_summary(report)
+    for stage in report.get('stages', []):
+        if stage.get('metrics'):
+            print(f"Stage {stage['stage']} ({stage['status']}, {stage['seconds']:.1f}s):")
+            print_summary(stage['metrics'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline import metrics
+
+
+DEFAULT_STATE_PATH = '.pipeline_state.json'
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Parameters:
+    - name: str, unique stage name.
+    - run: module level function taking the config dict; it runs in a worker
+      process, so it must be importable.
+    - inputs: list of file or directory paths the stage reads.
+    - outputs: list of file or directory paths the stage writes.
+    - config: dict of settings passed to run; changing any of them reruns the stage.
+    - code: list of source files whose changes should rerun the stage.
+    """
+
+    def __init__(self, name, run, inputs, outputs, config=None, code=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.config = config or {}
+        self.code = list(code or [])
+
+
+class FileHasher:
+    """
+    Content hashes of files and directories, cached by size and modification time.
+
+    A file is only read again when its size or mtime changed since the hash
+    was recorded, so fingerprinting an unchanged tree costs one stat per file.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else {}
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.cache.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.cache[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return self.cache[key][2]
+
+    def fingerprint(self, path):
+        """
+        Returns:
+        - digest: str, hash of a file, or of the names and hashes of every file
+          under a directory; None if the path does not exist.
+        """
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(self.file_hash(file_path).encode())
+        return digest.hexdigest()
+
+
+def load_state(state_path):
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
+    return {'files': {}, 'stages': {}}
+
+
+def save_state(state, state_path):
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+
+
+def stage_key(stage, hasher):
+    """
+    Hash everything a stage's result depends on: its config, its code and the content of its inputs.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(stage.config, sort_keys=True, default=str).encode())
+    for path in stage.code + stage.inputs:
+        digest.update(path.encode())
+        digest.update(str(hasher.fingerprint(path)).encode())
+    return digest.hexdigest()
+
+
+def _is_up_to_date(stage, key, record, hasher):
+    if record is None or record.get('key') != key:
+        return False
+    # Outputs must still be the ones the stage wrote
+    return all(hasher.fingerprint(path) == record['outputs'].get(path) for path in stage.outputs)
+
+
+def _run_stage(run, config, profile_path=None, trace_memory=False):
+    # The stage's metrics are collected in its worker process and sent back with its wall time
+    with metrics.collect() as stage_metrics:
+        start = time.perf_counter()
+        with metrics.profiled(profile_path, trace_memory):
+            run(config)
+        seconds = time.perf_counter() - start
+    return seconds, stage_metrics.snapshot()
+
+
+def _dependencies(stages):
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    return {stage.name: {producers[path] for path in stage.inputs if path in producers} - {stage.name}
+            for stage in stages}
+
+
+def select_stages(stages, targets):
+    """
+    Return the target stages and every stage they depend on, in declaration order.
+    """
+    if not targets:
+        return list(stages)
+    names = {stage.name for stage in stages}
+    unknown = set(targets) - names
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    dependencies = _dependencies(stages)
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    return [stage for stage in stages if stage.name in selected]
+
+
+def run_pipeline(stages, state_path=DEFAULT_STATE_PATH, jobs=2, force=(), dry_run=False, profile_directory=None, trace_memory=False):
+    """
+    Run the stages in dependency order, skipping those that are up to date.
+
+    A stage depends on the stages that produce its inputs. It is skipped when
+    its config, code and input contents hash to the same key as its last
+    successful run and its outputs are unchanged. Stages whose dependencies
+    are done run concurrently, up to jobs at a time, each in its own process.
+
+    Parameters:
+    - stages: list of Stage.
+    - state_path: str, JSON file keeping the hashes of the last runs.
+    - jobs: int, number of stages run at the same time.
+    - force: names of stages to rerun even if they are up to date; 'all' for every stage.
+    - dry_run: bool, only report which stages would run.
+    - profile_directory: str, directory to save a cProfile file per stage run
+      (<stage>.prof), or None.
+    - trace_memory: bool, record the peak traced memory of every stage run.
+
+    Returns:
+    - report: list of dicts with 'stage', 'status' ('ran', 'skipped', 'would run',
+      'failed' or 'blocked'), 'seconds', on failure 'error', and for the stages
+      that ran 'metrics', the summary of their timers and counters.
+    """
+    state = load_state(state_path)
+    hasher = FileHasher(state.setdefault('files', {}))
+    records = state.setdefault('stages', {})
+    dependencies = _dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    status = {}
+    report = {}
+    running = {}
+
+    def finish(name, stage_status, seconds=0.0, error=None, stage_metrics=None):
+        status[name] = stage_status
+        report[name] = {'stage': name, 'status': stage_status, 'seconds': seconds}
+        if error is not None:
+            report[name]['error'] = error
+        if stage_metrics is not None:
+            report[name]['metrics'] = stage_metrics
+
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while len(status) < len(stages):
+            done_before = len(status)
+            for stage in stages:
+                name = stage.name
+                if name in status or name in running.values():
+                    continue
+                deps = dependencies[name]
+                if any(status.get(dep) in ('failed', 'blocked') for dep in deps):
+                    finish(name, 'blocked')
+                    continue
+                if not all(status.get(dep) in ('ran', 'skipped', 'would run') for dep in deps):
+                    continue
+
+                key = stage_key(stage, hasher)
+                forced = 'all' in force or name in force
+                # In a dry run the inputs of a stage after one that would run are not known yet
+                upstream_pending = any(status[dep] == 'would run' for dep in deps)
+                if not forced and not upstream_pending and _is_up_to_date(stage, key, records.get(name), hasher):
+                    finish(name, 'skipped')
+                elif dry_run:
+                    finish(name, 'would run')
+                else:
+                    print(f"[pipeline] Running {name}")
+                    profile_path = os.path.join(profile_directory, f"{name}.prof") if profile_directory else None
+                    running[executor.submit(_run_stage, stage.run, stage.config, profile_path, trace_memory)] = name
+            progress = len(status) > done_before
+
+            if not running:
+                if len(status) < len(stages) and not progress:
+                    raise ValueError("The stages depend on each other in a cycle")
+                continue
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = by_name[name]
+                try:
+                    seconds, snapshot = future.result()
+                except Exception as e:
+                    print(f"[pipeline] {name} failed: {e}")
+                    finish(name, 'failed', error=str(e))
+                    records.pop(name, None)
+                else:
+                    # Inputs are hashed again, as the key must describe what the stage actually read
+                    records[name] = {'key': stage_key(stage, hasher),
+                                     'outputs': {path: hasher.fingerprint(path) for path in stage.outputs},
+                                     'seconds': seconds}
+                    stage_metrics = metrics.Metrics()
+                    stage_metrics.merge(snapshot)
+                    # Also added to the totals of the whole run
+                    metrics.merge(snapshot)
+                    finish(name, 'ran', seconds, stage_metrics=stage_metrics.summary())
+                if not dry_run:
+                    save_state(state, state_path)
+
+    if not dry_run:
+        save_state(state, state_path)
+    return [report[stage.name] for stage in stages]
+
+
+def print_report(report, wall_seconds=None):
+    """
+    Print the status and wall time of every stage, and of the whole run if given.
+    """
+    width = max(len(row['stage']) for row in report) if report else 0
+    total = 0.0
+    for row in report:
+        total += row['seconds']
+        line = f"  {row['stage']:<{width}}  {row['status']:<9}  {row['seconds']:8.1f}s"
+        if 'error' in row:
+            line += f"  {row['error']}"
+        print(line)
+    print(f"  {'total':<{width}}  {'':<9}  {total:8.1f}s")
+    if wall_seconds is not None:
+        print(f"  {'wall time':<{width}}  {'':<9}  {wall_seconds:8.1f}s")
@@ -0,0 +1,316 @@
+import argparse
+import os
+import operator
+import pandas as pd
+
+
+# Column types of the tables passed between stages. Text is stored as pandas'
+# string dtype (Arrow strings in Parquet/Feather), so pmid and index are never
+# re-inferred as numbers; face counts are 32 bit integers.
+SCHEMAS = {
+    # pdf_extraction: results_1
+    'faces': {'PDF_File': 'string', 'Number_of_Faces': 'int32', 'Error': 'string'},
+    # retrieved_df2.tsv, the PubMed metadata of the PDFs
+    'retrieved': {'index': 'string', 'pmid': 'string', 'title': 'string', 'abstract': 'string',
+                  'pub_date': 'string', 'pdf': 'string'},
+    # pdf_extraction: results_2
+    'publications': {'Number_of_Faces': 'int32', 'Error': 'string', 'index': 'string', 'pmid': 'string',
+                     'title': 'string', 'abstract': 'string', 'pub_date': 'string', 'pdf': 'string'},
+    # genes: results_4
+    'abstract_genes': {'Number_of_Faces': 'int32', 'Error': 'string', 'index': 'string', 'pmid': 'string',
+                       'title': 'string', 'abstract': 'string', 'pub_date': 'string', 'pdf': 'string',
+                       'genes_found': 'string'},
+    # genes: extracted_genes
+    'genereviews': {'title': 'string', 'pmid': 'string', 'genes': 'string'},
+    # genes: results_7 and filtered_results_7
+    'matched': {'Number_of_Faces': 'int32', 'number_of_faces': 'int32', 'Error': 'string', 'error': 'string',
+                'index': 'string', 'pmid': 'string', 'pub_title': 'string', 'abstract': 'string',
+                'pub_date': 'string', 'genes_in_pub': 'string', 'genereviews_title': 'string',
+                'genes_in_pub_and_genereviews': 'string', 'cross_referenced_genes': 'string'},
+}
+
+FORMAT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.txt': 'tsv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+}
+
+_FILTER_OPERATORS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Feather storage need pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def storage_format(path):
+    """
+    Return the storage format of a path from its extension: 'csv', 'tsv', 'parquet' or 'feather'.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unknown table format for {path}; use one of {', '.join(sorted(FORMAT_EXTENSIONS))}")
+    return FORMAT_EXTENSIONS[extension]
+
+
+def with_format(path, file_format):
+    """
+    Swap the extension of a path for the one of a format, e.g. results_1.csv -> results_1.parquet.
+    """
+    return f"{os.path.splitext(path)[0]}.{file_format}"
+
+
+def _schema(schema):
+    if schema is None:
+        return {}
+    if isinstance(schema, str):
+        return SCHEMAS[schema]
+    return schema
+
+
+def apply_schema(df, schema):
+    """
+    Cast the columns of a dataframe that appear in a schema to their type.
+
+    Integer columns with missing values are cast to the nullable version of
+    the type (e.g. 'Int32') instead of failing.
+
+    Parameters:
+    - df: pandas.DataFrame.
+    - schema: str naming one of SCHEMAS, or a dict of column to dtype.
+
+    Returns:
+    - df: the same dataframe, cast in place.
+    """
+    for column, dtype in _schema(schema).items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        if dtype.startswith('int') and df[column].isna().any():
+            dtype = dtype.capitalize()
+        df[column] = df[column].astype(dtype)
+    return df
+
+
+def _filter_groups(filters):
+    # Same (column, op, value) form as pyarrow; a list of lists is an OR of ANDs
+    if not filters:
+        return []
+    return filters if isinstance(filters[0], list) else [filters]
+
+
+def _apply_filters(df, filters):
+    groups = _filter_groups(filters)
+    if not groups:
+        return df
+    keep = pd.Series(False, index=df.index)
+    for group in groups:
+        mask = pd.Series(True, index=df.index)
+        for column, op, value in group:
+            if op == 'in':
+                mask &= df[column].isin(value)
+            elif op == 'not in':
+                mask &= ~df[column].isin(value)
+            else:
+                mask &= _FILTER_OPERATORS[op](df[column], value).fillna(False).astype(bool)
+        keep |= mask
+    return df[keep].reset_index(drop=True)
+
+
+def read_table(path, columns=None, filters=None, schema=None):
+    """
+    Read a table written by any stage, whatever its format.
+
+    Parameters:
+    - path: str, a .csv, .tsv, .parquet or .feather file.
+    - columns: list of str, only read these columns; those not in the file are
+      left out, so callers can check for them as before.
+    - filters: list of (column, op, value) tuples, e.g.
+      [('Number_of_Faces', '!=', 0)]. Parquet applies them while reading, so
+      row groups that cannot match are never loaded; other formats filter
+      after reading.
+    - schema: str naming one of SCHEMAS, or a dict of column to dtype.
+
+    Returns:
+    - df: pandas.DataFrame.
+    """
+    file_format = storage_format(path)
+    schema = _schema(schema)
+
+    if file_format in ('csv', 'tsv'):
+        wanted = None
+        if columns is not None:
+            # Filtered columns are read too, and dropped again after filtering
+            needed = set(columns) | {column for group in _filter_groups(filters) for column, _, _ in group}
+            wanted = lambda column: column in needed
+        # Read the text columns as strings directly, so pmid is never parsed as a number
+        text_columns = {column: dtype for column, dtype in schema.items() if dtype == 'string'}
+        df = pd.read_csv(path, sep='\t' if file_format == 'tsv' else ',', usecols=wanted, dtype=text_columns,
+                         low_memory=False)
+        df = _apply_filters(df, filters)
+        if columns is not None:
+            df = df[[column for column in df.columns if column in columns]]
+    elif file_format == 'parquet':
+        _require_pyarrow()
+        import pyarrow.parquet
+        if columns is not None:
+            available = pyarrow.parquet.read_schema(path).names
+            columns = [column for column in available if column in columns]
+        df = pd.read_parquet(path, engine='pyarrow', columns=columns, filters=filters or None)
+    else:
+        _require_pyarrow()
+        df = _apply_filters(pd.read_feather(path), filters)
+        if columns is not None:
+            df = df[[column for column in df.columns if column in columns]]
+
+    return apply_schema(df, schema)
+
+
+def table_columns(path):
+    """
+    Returns:
+    - columns: list of str, the column names of a table, read from its header or schema only.
+    """
+    file_format = storage_format(path)
+    if file_format in ('csv', 'tsv'):
+        return list(pd.read_csv(path, sep='\t' if file_format == 'tsv' else ',', nrows=0).columns)
+    _require_pyarrow()
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(path) as reader:
+        return reader.schema.names
+
+
+def write_table(df, path, schema=None):
+    """
+    Write a stage output in the format given by the extension of path.
+
+    Parameters:
+    - df: pandas.DataFrame.
+    - path: str, a .csv, .tsv, .parquet or .feather file.
+    - schema: str naming one of SCHEMAS, or a dict of column to dtype.
+
+    Returns:
+    - df: the dataframe as written, with the schema applied.
+    """
+    file_format = storage_format(path)
+    df = apply_schema(df, schema)
+    if file_format in ('csv', 'tsv'):
+        df.to_csv(path, sep='\t' if file_format == 'tsv' else ',', index=False)
+    elif file_format == 'parquet':
+        _require_pyarrow()
+        df.to_parquet(path, engine='pyarrow', index=False)
+    else:
+        _require_pyarrow()
+        df.reset_index(drop=True).to_feather(path)
+    return df
+
+
+def iter_table(path, columns=None, chunksize=100000, schema=None):
+    """
+    Read a table in chunks of at most chunksize rows.
+
+    Returns:
+    - chunks: iterator of pandas.DataFrame.
+    """
+    file_format = storage_format(path)
+    if file_format in ('csv', 'tsv'):
+        wanted = None if columns is None else (lambda column: column in columns)
+        text_columns = {column: dtype for column, dtype in _schema(schema).items() if dtype == 'string'}
+        for chunk in pd.read_csv(path, sep='\t' if file_format == 'tsv' else ',', usecols=wanted,
+                                 dtype=text_columns, chunksize=chunksize):
+            yield apply_schema(chunk, schema)
+    elif file_format == 'parquet':
+        _require_pyarrow()
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        if columns is not None:
+            columns = [column for column in parquet_file.schema_arrow.names if column in columns]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield apply_schema(batch.to_pandas(), schema)
+    else:
+        pyarrow = _require_pyarrow()
+        import pyarrow.ipc
+        reader = pyarrow.ipc.open_file(path)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select([column for column in batch.schema.names if column in columns])
+            for start in range(0, batch.num_rows, chunksize):
+                yield apply_schema(batch.slice(start, chunksize).to_pandas(), schema)
+
+
+class TableWriter:
+    """
+    Append chunks of rows to a table without holding the whole table in memory.
+
+    CSV chunks are appended to the file; Parquet chunks become row groups and
+    Feather chunks record batches of a single file. Every chunk must have
+    the same columns.
+    """
+
+    def __init__(self, path, schema=None):
+        self.path = path
+        self.schema = schema
+        self.format = storage_format(path)
+        self.writer = None
+        self.arrow_schema = None
+        self.header = True
+
+    def write(self, df):
+        df = apply_schema(df, self.schema)
+        if self.format in ('csv', 'tsv'):
+            df.to_csv(self.path, sep='\t' if self.format == 'tsv' else ',', index=False,
+                      mode='w' if self.header else 'a', header=self.header)
+            self.header = False
+            return
+        pyarrow = _require_pyarrow()
+        if self.writer is None:
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            self.arrow_schema = table.schema
+            if self.format == 'parquet':
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            else:
+                import pyarrow.ipc
+                self.writer = pyarrow.ipc.new_file(self.path, table.schema)
+        else:
+            table = pyarrow.Table.from_pandas(df, schema=self.arrow_schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a stage output between CSV, TSV, Parquet and Feather.")
+    parser.add_argument('input', help="Table to read.")
+    parser.add_argument('output', help="Table to write; the format follows the extension.")
+    parser.add_argument('--schema', choices=sorted(SCHEMAS), default=None, help="Column types to apply.")
+    args = parser.parse_args(argv)
+
+    df = write_table(read_table(args.input, schema=args.schema), args.output, schema=args.schema)
+    print(f"Wrote {len(df)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()